@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼图库接口
+不依赖文件系统：输入为内存中的图片（字节或 PIL 图片对象），输出为编码后的字节和元数据，
+可以直接嵌入上传服务等程序中使用。命令行工具（puzzle.py）使用同一套处理阶段，只是输入和输出换成了目录。
+
+示例：
+    outputs = build_puzzles({'pc': pc_bytes}, only=['pc'])
+    outputs['pc-combined.jpg'].data
+
+    for output in iter_puzzles({'mobile': mobile_img, 'mobile-lock': lock_bytes}, only=['mobile']):
+        upload(output.name, output.data)
+"""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, Optional
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .mobile_puzzle import prepare_mobile_desktop, create_mobile_puzzle, prepare_mobile_desktop_2, create_mobile_puzzle_2, prepare_mobile_desktop_3, create_mobile_puzzle_3
+    from .pad_puzzle import prepare_pad_images, create_pad_puzzle
+    from .pc_puzzle import prepare_pc_desktop_mac, create_pc_puzzle
+    from .scheduler import Stage, run_stages
+    from .context import ImageInput, MemoryPuzzleContext, PuzzleContext
+    from .encoding import EncodedImage
+    from .image_cache import IMAGE_EXTENSIONS
+    from .instrument import DirectoryStats
+except ImportError:
+    from mobile_puzzle import prepare_mobile_desktop, create_mobile_puzzle, prepare_mobile_desktop_2, create_mobile_puzzle_2, prepare_mobile_desktop_3, create_mobile_puzzle_3
+    from pad_puzzle import prepare_pad_images, create_pad_puzzle
+    from pc_puzzle import prepare_pc_desktop_mac, create_pc_puzzle
+    from scheduler import Stage, run_stages
+    from context import ImageInput, MemoryPuzzleContext, PuzzleContext
+    from encoding import EncodedImage
+    from image_cache import IMAGE_EXTENSIONS
+    from instrument import DirectoryStats
+
+logger = logging.getLogger(__name__)
+
+# 处理链（可通过 only 选择）
+CHAINS = ['mobile', 'pc', 'pad']
+
+# 每条处理链必需的输入文件
+CHAIN_REQUIRED_FILES = {
+    'mobile': ['mobile.png', 'mobile-lock.png'],
+    'pc': ['pc.png'],
+    'pad': ['pad.png']
+}
+
+# 可以提供的输入图片（基础文件名）
+INPUT_NAMES = ('mobile', 'mobile-lock', 'mobile-2', 'pc', 'pad', 'pad-lock')
+
+# 单个目录内并行执行阶段的默认线程数
+DEFAULT_STAGE_THREADS = 4
+
+
+@dataclass(frozen=True)
+class PuzzleOutput:
+    """
+    一张编码完成的拼图
+
+    Attributes:
+        name: 文件名（扩展名为实际的编码格式），如 mobile-combined.jpg
+        image: 编码结果（字节、格式、尺寸、质量等）
+        elapsed_ms: 从开始处理到这张拼图完成的耗时（毫秒）
+    """
+    name: str
+    image: EncodedImage
+    elapsed_ms: float
+
+    @property
+    def data(self) -> bytes:
+        return self.image.data
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.nbytes
+
+
+def build_stages(ctx: PuzzleContext, main_color: Optional[str] = None) -> List[Stage]:
+    """
+    构建处理阶段 DAG
+    Mobile、PC、Pad 三条处理链互不依赖，每个拼图阶段只依赖自己的预处理阶段
+    预处理生成的中间图片通过 ctx 在内存中传递给拼图阶段，拼图通过 ctx.save_output 保存
+
+    Args:
+        ctx: 处理上下文
+        main_color: 主色调
+
+    Returns:
+        阶段列表
+    """
+    work_dir, output_dir = ctx.work_dir, ctx.output_dir
+    return [
+        Stage('prepare_mobile_desktop', lambda: prepare_mobile_desktop(work_dir, ctx), chain='mobile'),
+        Stage('prepare_mobile_desktop_2', lambda: prepare_mobile_desktop_2(work_dir, ctx), chain='mobile'),
+        Stage('prepare_mobile_desktop_3', lambda: prepare_mobile_desktop_3(work_dir, ctx), chain='mobile'),
+        Stage('prepare_pad_images', lambda: prepare_pad_images(work_dir, ctx), chain='pad'),
+        Stage('prepare_pc_desktop_mac', lambda: prepare_pc_desktop_mac(work_dir, ctx), chain='pc'),
+        Stage('create_mobile_puzzle', lambda: create_mobile_puzzle(work_dir, output_dir, main_color, ctx),
+              deps=('prepare_mobile_desktop',), chain='mobile', output=True),
+        Stage('create_mobile_puzzle_2', lambda: create_mobile_puzzle_2(work_dir, output_dir, main_color, ctx),
+              deps=('prepare_mobile_desktop_2',), chain='mobile', output=True),
+        Stage('create_mobile_puzzle_3', lambda: create_mobile_puzzle_3(work_dir, output_dir, main_color, ctx),
+              deps=('prepare_mobile_desktop_3',), chain='mobile', output=True),
+        Stage('create_pc_puzzle', lambda: create_pc_puzzle(work_dir, output_dir, main_color, ctx),
+              deps=('prepare_pc_desktop_mac',), chain='pc', output=True),
+        Stage('create_pad_puzzle', lambda: create_pad_puzzle(work_dir, output_dir, main_color, ctx),
+              deps=('prepare_pad_images',), chain='pad', output=True)
+    ]
+
+
+def missing_inputs(ctx: PuzzleContext, chains: Optional[List[str]] = None) -> List[str]:
+    """
+    列出所选处理链缺少的必需输入
+
+    Args:
+        ctx: 处理上下文
+        chains: 处理链，默认全部
+
+    Returns:
+        缺少的输入文件名
+    """
+    missing = []
+    for chain in chains or CHAINS:
+        for file in CHAIN_REQUIRED_FILES[chain]:
+            if ctx.find_input(Path(file).stem) is None:
+                missing.append(file)
+    return missing
+
+
+def normalize_inputs(inputs: Mapping[str, ImageInput]) -> Dict[str, ImageInput]:
+    """
+    规范化输入图片的名称：接受 mobile 或 mobile.png 这样的写法
+
+    Args:
+        inputs: {名称: 输入图片}
+
+    Returns:
+        {基础文件名: 输入图片}
+
+    Raises:
+        ValueError: 名称不是支持的输入图片
+    """
+    normalized = {}
+    for name, value in inputs.items():
+        path = Path(name)
+        base_name = path.stem if path.suffix.lower() in IMAGE_EXTENSIONS else name
+        if base_name not in INPUT_NAMES:
+            raise ValueError(f"不支持的输入图片: {name}（可选: {', '.join(INPUT_NAMES)}）")
+        normalized[base_name] = value
+    return normalized
+
+
+def iter_puzzles(
+    inputs: Mapping[str, ImageInput],
+    main_color: Optional[str] = None,
+    only: Optional[List[str]] = None,
+    threads: int = DEFAULT_STAGE_THREADS,
+    stats: Optional[DirectoryStats] = None
+) -> Iterator[PuzzleOutput]:
+    """
+    在内存中生成拼图，每张拼图编码完成后立即产出
+
+    处理阶段在后台线程中按依赖关系执行，调用方可以在其余拼图仍在处理时开始使用已完成的结果。
+    全部阶段结束后，如果有拼图生成失败，抛出 RuntimeError（已完成的拼图在此之前已经产出）。
+
+    Args:
+        inputs: {基础文件名: 输入图片}，输入图片可以是编码后的字节、PIL 图片对象或文件路径
+        main_color: 主色调（None 为默认背景，"" 为自动提取，"#ffffff" 为纯色）
+        only: 只执行指定的处理链（mobile / pc / pad），默认全部执行
+        threads: 并行执行阶段的线程数
+        stats: 收集每个阶段的耗时、CPU 时间、解码/编码次数、内存峰值和生成的拼图（与 process_directory 相同）
+
+    Yields:
+        编码完成的拼图
+
+    Raises:
+        ValueError: 输入图片名称不支持或缺少必需的输入
+        RuntimeError: 有拼图生成失败
+    """
+    chains = only or CHAINS
+    start = time.perf_counter()
+    finished = queue.Queue()
+
+    def on_output(name: str, image: EncodedImage) -> None:
+        if stats is not None:
+            # 拼图文件名以处理链开头，如 pc-combined.jpg
+            stats.add_output(name, next((chain for chain in CHAINS if name.startswith(f"{chain}-")), ''), image)
+        finished.put(PuzzleOutput(name, image, (time.perf_counter() - start) * 1000))
+
+    ctx = MemoryPuzzleContext(normalize_inputs(inputs), on_output)
+    missing = missing_inputs(ctx, chains)
+    if missing:
+        raise ValueError(f"缺少输入图片: {', '.join(missing)}")
+
+    stages = [stage for stage in build_stages(ctx, main_color) if stage.chain in chains]
+    results = {}
+
+    def measured(stage: Stage) -> Stage:
+        """在阶段所在线程中收集统计"""
+        def run() -> bool:
+            with stats.stage(stage.name, stage.chain) as stage_stats:
+                stage_stats.ok = bool(stage.func())
+            return stage_stats.ok
+        return replace(stage, func=run)
+
+    if stats is not None:
+        stages = [measured(stage) for stage in stages]
+
+    def run() -> None:
+        try:
+            results.update(run_stages(stages, threads))
+        finally:
+            finished.put(None)
+
+    runner = threading.Thread(target=run, name='puzzle-stages', daemon=True)
+    runner.start()
+    while True:
+        output = finished.get()
+        if output is None:
+            break
+        yield output
+    runner.join()
+
+    failed = [stage.name for stage in stages if stage.output and not results.get(stage.name)]
+    if failed:
+        raise RuntimeError(f"拼图生成失败: {', '.join(failed)}")
+
+
+def build_puzzles(
+    inputs: Mapping[str, ImageInput],
+    main_color: Optional[str] = None,
+    only: Optional[List[str]] = None,
+    threads: int = DEFAULT_STAGE_THREADS
+) -> Dict[str, PuzzleOutput]:
+    """
+    在内存中生成全部拼图
+
+    Args:
+        inputs: {基础文件名: 输入图片}，输入图片可以是编码后的字节、PIL 图片对象或文件路径
+        main_color: 主色调（None 为默认背景，"" 为自动提取，"#ffffff" 为纯色）
+        only: 只执行指定的处理链（mobile / pc / pad），默认全部执行
+        threads: 并行执行阶段的线程数
+
+    Returns:
+        {文件名: 拼图}
+
+    Raises:
+        ValueError: 输入图片名称不支持或缺少必需的输入
+        RuntimeError: 有拼图生成失败
+    """
+    return {output.name: output for output in iter_puzzles(inputs, main_color, only, threads)}
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磨玻璃模糊基准测试
+在典型手机截图分辨率（1290×2796）上对比快速模糊与精确高斯模糊的耗时和误差（误差只供参考，准确性由 test_puzzle.py 检查）
+
+用法：
+    python benchmarks/bench_blur.py [--repeat 3] [--radius 140]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from blur import fast_blur_plan, gaussian_blur  # noqa: E402
+
+# 典型手机截图分辨率
+SCREEN_SIZE = (1290, 2796)
+
+
+def make_screenshot(size, seed: int) -> Image.Image:
+    """
+    生成合成的手机截图：渐变壁纸 + 应用图标网格 + 状态栏文字块，包含大量锐利边缘
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y = np.linspace(0, 1, height)[:, None]
+    x = np.linspace(0, 1, width)[None, :]
+    top, bottom = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    wallpaper = top * (1 - y[..., None]) + bottom * y[..., None] + 20 * np.sin(x * 9)[..., None]
+    image = Image.fromarray(np.clip(wallpaper, 0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(image)
+    icon = width // 6
+    for row in range(6):
+        for col in range(4):
+            x0 = icon // 2 + col * icon * 3 // 2
+            y0 = height // 8 + row * icon * 3 // 2
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            draw.rounded_rectangle([x0, y0, x0 + icon, y0 + icon], radius=icon // 5, fill=color)
+    for line in range(3):
+        draw.rectangle([40, 30 + line * 24, 40 + rng.integers(100, 400), 44 + line * 24], fill=(255, 255, 255))
+    return image
+
+
+def best_time(func, repeat: int) -> float:
+    """
+    多次调用取最短耗时（秒）
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='磨玻璃模糊基准测试')
+    parser.add_argument('--repeat', type=int, default=3, help='每种模式重复次数（取最短耗时）')
+    parser.add_argument('--radius', type=float, default=140, help='模糊半径')
+    args = parser.parse_args()
+
+    factor, small_size, small_radius = fast_blur_plan(SCREEN_SIZE, args.radius)
+    print(f"输入 {SCREEN_SIZE[0]}x{SCREEN_SIZE[1]}，模糊半径 {args.radius}，"
+          f"快速模式缩小 {factor} 倍到 {small_size[0]}x{small_size[1]}，小图模糊半径 {small_radius:.2f}")
+    print(f"{'样本':<6}{'精确(ms)':>10}{'快速(ms)':>10}{'加速比':>8}{'最大误差':>10}{'平均误差':>10}{'99.9%误差':>10}")
+
+    max_error = 0
+    for seed in range(3):
+        image = make_screenshot(SCREEN_SIZE, seed)
+        exact = np.asarray(gaussian_blur(image, args.radius, 'exact'), dtype=np.int16)
+        fast = np.asarray(gaussian_blur(image, args.radius, 'fast'), dtype=np.int16)
+        diff = np.abs(exact - fast)
+        max_error = max(max_error, int(diff.max()))
+
+        exact_time = best_time(lambda: gaussian_blur(image, args.radius, 'exact'), args.repeat)
+        fast_time = best_time(lambda: gaussian_blur(image, args.radius, 'fast'), args.repeat)
+        print(f"{seed:<6}{exact_time * 1000:>10.1f}{fast_time * 1000:>10.1f}{exact_time / fast_time:>7.1f}x"
+              f"{int(diff.max()):>10}{diff.mean():>10.2f}{np.percentile(diff, 99.9):>10.1f}")
+
+    print(f"\n最大逐像素误差 {max_error}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+主色调提取基准测试
+对比各主色调提取算法与全分辨率 KMeans 的耗时和颜色误差
+
+用法：
+    python benchmarks/bench_color.py [--repeat 3] [--tolerance 12]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from color_extract import COLOR_EXTRACTORS  # noqa: E402
+
+# 典型设备截图分辨率
+RESOLUTIONS = [
+    ('mobile', (1290, 2796)),
+    ('pad', (2388, 1668)),
+    ('pc', (2880, 1800))
+]
+
+
+def make_fixture(size: Tuple[int, int], seed: int) -> Image.Image:
+    """
+    生成合成测试图片：带噪声的主色背景 + 若干其他颜色的色块和渐变条
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    base = rng.integers(0, 256, 3)
+    noise = rng.normal(0, 6, (height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    # 渐变条
+    band = height // 6
+    ramp = np.linspace(0, 255, width, dtype=np.float64)
+    pixels[:band, :, 0] = ramp.astype(np.uint8)
+    pixels[:band, :, 1] = ramp[::-1].astype(np.uint8)
+
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x0, y0 = rng.integers(0, width // 2), rng.integers(band, height // 2)
+        x1, y1 = x0 + rng.integers(width // 10, width // 3), y0 + rng.integers(height // 20, height // 6)
+        draw.rectangle([x0, y0, x1, y1], fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    return image
+
+
+def time_call(func, image: Image.Image, repeat: int) -> Tuple[float, Tuple[int, int, int]]:
+    """
+    多次调用取最短耗时
+    """
+    best = float('inf')
+    color = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        color = func(image)
+        best = min(best, time.perf_counter() - start)
+    return best, color
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='主色调提取基准测试')
+    parser.add_argument('--repeat', type=int, default=3, help='每个算法重复次数（取最短耗时）')
+    parser.add_argument('--tolerance', type=float, default=12.0, help='允许的最大 RGB 欧氏距离误差')
+    args = parser.parse_args()
+
+    rows: List[tuple] = []
+    max_error = 0.0
+    for seed, (name, size) in enumerate(RESOLUTIONS):
+        image = make_fixture(size, seed)
+        reference_time, reference = time_call(COLOR_EXTRACTORS['kmeans'], image, 1)
+        rows.append((name, size, 'kmeans', reference_time, reference, 0.0))
+        for method, func in COLOR_EXTRACTORS.items():
+            if method == 'kmeans':
+                continue
+            elapsed, color = time_call(func, image, args.repeat)
+            error = float(np.linalg.norm(np.array(color) - np.array(reference)))
+            max_error = max(max_error, error)
+            rows.append((name, size, method, elapsed, color, error))
+
+    print(f"{'输入':<8}{'尺寸':<12}{'算法':<8}{'耗时(s)':>10}{'加速比':>10}  {'颜色':<18}{'误差':>6}")
+    reference_times = {(row[0], row[2]): row[3] for row in rows}
+    for name, size, method, elapsed, color, error in rows:
+        speedup = reference_times[(name, 'kmeans')] / elapsed if elapsed else float('inf')
+        print(f"{name:<8}{size[0]}x{size[1]:<7}{method:<8}{elapsed:>10.3f}{speedup:>9.1f}x  {str(color):<18}{error:>6.1f}")
+
+    if max_error > args.tolerance:
+        print(f"\n颜色误差 {max_error:.1f} 超过允许范围 {args.tolerance}")
+        return 1
+    print(f"\n最大颜色误差 {max_error:.1f}（允许 {args.tolerance}）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
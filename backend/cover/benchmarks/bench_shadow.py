@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阴影渲染基准测试
+对比九宫格阴影与整图模糊阴影的耗时（逐像素误差只供参考，准确性由 test_puzzle.py 检查）
+
+用法：
+    python benchmarks/bench_shadow.py [--repeat 3]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shadow import render_shadow_layer, render_shadow_nine_slice  # noqa: E402
+from utils import BORDER_RADIUS, SHADOW_OFFSET, SHADOW_BLUR  # noqa: E402
+
+# 拼图中常见的精灵尺寸，以及比九宫格模板更小的尺寸
+SIZES = [(1600, 900), (1440, 1080), (700, 1500), (1290, 2796), (200, 120), (40, 40)]
+
+# 额外检查的 (圆角半径, 阴影偏移, 模糊半径) 组合
+PARAMS = [
+    (BORDER_RADIUS, SHADOW_OFFSET, SHADOW_BLUR),
+    (0, (0, 0), 4),
+    (40, (12, 3), 20)
+]
+
+
+def best_time(func, repeat: int) -> float:
+    """
+    多次调用取最短耗时（秒）
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='阴影渲染基准测试')
+    parser.add_argument('--repeat', type=int, default=3, help='每种渲染方式重复次数（取最短耗时）')
+    args = parser.parse_args()
+
+    max_error = 0
+    print(f"{'尺寸':<12}{'参数':<18}{'整图模糊(ms)':>14}{'九宫格(ms)':>12}{'加速比':>8}{'最大误差':>10}")
+    for radius, offset, blur in PARAMS:
+        for size in SIZES:
+            exact = render_shadow_layer(size, radius, offset, blur)
+            sliced = render_shadow_nine_slice(size, radius, offset, blur)
+            error = int(np.abs(np.asarray(exact, dtype=np.int16) - np.asarray(sliced, dtype=np.int16)).max())
+            max_error = max(max_error, error)
+
+            exact_time = best_time(lambda: render_shadow_layer(size, radius, offset, blur), args.repeat)
+            sliced_time = best_time(lambda: render_shadow_nine_slice(size, radius, offset, blur), args.repeat)
+            params = f"r={radius},o={offset[0]}/{offset[1]},b={blur}"
+            print(f"{size[0]}x{size[1]:<7}{params:<18}{exact_time * 1000:>14.1f}{sliced_time * 1000:>12.1f}"
+                  f"{exact_time / sliced_time:>7.1f}x{error:>10}")
+
+    print(f"\n最大逐像素误差 {max_error}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼图和切分热点函数的基准测试套件
+使用按真实设备分辨率生成的合成图片，测量每个热点函数和每个 prepare_*/create_* 阶段的吞吐量（ops/s）和峰值内存，
+可以保存为基线 JSON，之后的运行与基线对比并标出性能退化
+
+峰值内存在 Linux 上通过 /proc/self/clear_refs 重置常驻内存峰值后读取 VmHWM（包含 Pillow 在 Python 堆外分配的像素缓冲），
+其他平台退化为 tracemalloc（只统计 Python 和 numpy 分配的内存）
+
+用法：
+    python benchmarks/bench_suite.py [--filter create_] [--repeat 3] [--min-time 1.0]
+    python benchmarks/bench_suite.py --save-baseline              # 保存基线到 benchmarks/baseline.json
+    python benchmarks/bench_suite.py --threshold 0.2              # 与基线对比，吞吐量下降超过 20% 时以非零状态退出
+"""
+
+import contextlib
+import gc
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import argparse
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+COVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(COVER_DIR))
+sys.path.insert(0, str(COVER_DIR.parent / 'split'))
+
+from color_extract import COLOR_EXTRACTORS, clear_color_cache, extract_main_color  # noqa: E402
+from context import PuzzleContext  # noqa: E402
+from instrument import read_proc_status, release_free_memory, reset_peak_rss  # noqa: E402
+from mobile_puzzle import (prepare_mobile_desktop, create_mobile_puzzle, prepare_mobile_desktop_2,  # noqa: E402
+                           create_mobile_puzzle_2, prepare_mobile_desktop_3, create_mobile_puzzle_3)
+from pad_puzzle import prepare_pad_images, create_pad_puzzle  # noqa: E402
+from pc_puzzle import prepare_pc_desktop_mac, create_pc_puzzle  # noqa: E402
+from split_images import split_image  # noqa: E402
+from utils import (MOBILE_BLOCK_COVER, MOBILE_SPRITE_BOX, PC_SPRITE_BOX, add_shadow_and_rounded_corners,  # noqa: E402
+                   create_background, get_cover_overlay, overlay_images, overlay_onto, paste_with_shadow,
+                   ratio_corrected_size, resize_to_fit_ratio, save_optimized_image, save_optimized_jpeg)
+
+# 默认基线文件
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+
+# 合成输入图片的分辨率（与真实设备截图一致）
+FIXTURE_SIZES = {
+    'mobile': (1290, 2796),
+    'mobile-lock': (1290, 2796),
+    'mobile-2': (1290, 2796),
+    'pc': (2880, 1800),
+    'pad': (2388, 1668)
+}
+
+# 峰值内存增长低于该值（MB）时不视为退化，避免小对象的测量噪声
+MEMORY_NOISE_MB = 1.0
+
+
+def make_screenshot(size: Tuple[int, int], seed: int) -> Image.Image:
+    """
+    生成合成截图：渐变壁纸 + 圆角图标网格 + 文字块，包含大量锐利边缘，编码和模糊的开销接近真实截图
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y = np.linspace(0, 1, height)[:, None]
+    x = np.linspace(0, 1, width)[None, :]
+    top, bottom = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    wallpaper = top * (1 - y[..., None]) + bottom * y[..., None] + 20 * np.sin(x * 9)[..., None]
+    noise = rng.normal(0, 3, (height, width, 1))
+    image = Image.fromarray(np.clip(wallpaper + noise, 0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(image)
+    icon = min(width, height) // 8
+    columns = max(1, width // (icon * 3 // 2))
+    rows = max(1, (height - height // 8) // (icon * 3 // 2))
+    for row in range(rows):
+        for col in range(columns):
+            x0 = icon // 2 + col * icon * 3 // 2
+            y0 = height // 8 + row * icon * 3 // 2
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            draw.rounded_rectangle([x0, y0, x0 + icon, y0 + icon], radius=icon // 5, fill=color)
+    for line in range(8):
+        draw.rectangle([40, 30 + line * 24, 40 + int(rng.integers(100, width // 2)), 44 + line * 24], fill=(255, 255, 255))
+    return image
+
+
+class Fixtures:
+    """
+    基准测试的输入：临时工作目录中的合成截图文件，以及对应的已解码图片
+    """
+
+    def __init__(self, root: Path):
+        """
+        Args:
+            root: 临时目录
+        """
+        self.work_dir = root / 'set'
+        self.output_dir = self.work_dir / 'intr'
+        self.split_dir = root / 'split'
+        for path in (self.work_dir, self.output_dir, self.split_dir):
+            path.mkdir(parents=True)
+
+        self.images: Dict[str, Image.Image] = {}
+        for seed, (name, size) in enumerate(FIXTURE_SIZES.items()):
+            image = make_screenshot(size, seed)
+            image.save(self.work_dir / f"{name}.png")
+            self.images[name] = image
+
+        # 四宫格图片（split_image 的输入）
+        mobile_width, mobile_height = FIXTURE_SIZES['mobile']
+        grid = Image.new('RGB', (mobile_width * 2, mobile_height * 2))
+        for index, name in enumerate(['mobile', 'mobile-lock', 'mobile-2', 'mobile']):
+            grid.paste(self.images[name], ((index % 2) * mobile_width, (index // 2) * mobile_height))
+        self.grid_file = root / 'grid.png'
+        grid.save(self.grid_file)
+
+        # 典型的 2000×2000 拼图（编码函数的输入）
+        self.composite = create_background((2000, 2000))
+        self.composite.paste(resize_to_fit_ratio(self.images['pc'], 16 / 9, PC_SPRITE_BOX), (200, 300))
+        self.composite.paste(resize_to_fit_ratio(self.images['mobile'], 9 / 19, MOBILE_SPRITE_BOX), (700, 1100))
+
+    def context(self, *prepare: Callable[[Path, PuzzleContext], bool]) -> PuzzleContext:
+        """
+        新建目录处理上下文（不写入中间图片），并执行拼图阶段依赖的预处理阶段
+        """
+        ctx = PuzzleContext(self.work_dir, keep_intermediates=False, output_dir=self.output_dir)
+        for func in prepare:
+            func(self.work_dir, ctx)
+        return ctx
+
+
+@dataclass
+class Case:
+    """
+    一个基准测试用例
+
+    Attributes:
+        name: 用例名称
+        run: 被计时的函数，参数为 setup 的返回值
+        setup: 每次运行前执行的准备函数（不计时），返回传给 run 的状态
+    """
+    name: str
+    run: Callable[[Any], Any]
+    setup: Optional[Callable[[], Any]] = None
+
+
+def build_cases(fx: Fixtures) -> List[Case]:
+    """
+    构建全部基准测试用例
+
+    Args:
+        fx: 输入图片
+
+    Returns:
+        用例列表
+    """
+    mobile, pc = fx.images['mobile'], fx.images['pc']
+    mobile_sprite = resize_to_fit_ratio(mobile, 9 / 19, MOBILE_SPRITE_BOX)
+    pc_sprite = resize_to_fit_ratio(pc, 16 / 9, PC_SPRITE_BOX)
+    mobile_base = mobile.resize(ratio_corrected_size(mobile.size, 9 / 19), Image.Resampling.LANCZOS)
+    mobile_cover = get_cover_overlay(MOBILE_BLOCK_COVER, mobile_base.size)
+
+    cases = [
+        Case(f"extract_main_color[{method}]", lambda _, method=method: extract_main_color(pc, method=method),
+             setup=clear_color_cache)
+        for method in COLOR_EXTRACTORS
+    ]
+    cases += [
+        Case('add_shadow_and_rounded_corners[mobile]', lambda _: add_shadow_and_rounded_corners(mobile_sprite)),
+        Case('add_shadow_and_rounded_corners[pc]', lambda _: add_shadow_and_rounded_corners(pc_sprite)),
+        Case('paste_with_shadow[mobile]', lambda canvas: paste_with_shadow(canvas, mobile_sprite, (700, 1100)),
+             setup=lambda: create_background((2000, 2000))),
+        Case('paste_with_shadow[pc]', lambda canvas: paste_with_shadow(canvas, pc_sprite, (200, 300)),
+             setup=lambda: create_background((2000, 2000))),
+        Case('resize_to_fit_ratio[mobile]', lambda _: resize_to_fit_ratio(mobile, 9 / 19, MOBILE_SPRITE_BOX)),
+        Case('resize_to_fit_ratio[pc]', lambda _: resize_to_fit_ratio(pc, 16 / 9, PC_SPRITE_BOX)),
+        Case('overlay_images[mobile]', lambda _: overlay_images(mobile_base, mobile_cover)),
+        Case('overlay_onto[mobile]', lambda base: overlay_onto(base, mobile_cover), setup=mobile_base.copy),
+        Case('create_background[default]', lambda _: create_background((2000, 2000))),
+        Case('create_background[color]', lambda _: create_background((2000, 2000), '#336699')),
+        Case('save_optimized_image', lambda _: save_optimized_image(fx.composite, fx.output_dir / 'bench.png')),
+        Case('save_optimized_jpeg', lambda _: save_optimized_jpeg(fx.composite, fx.output_dir / 'bench.jpg')),
+    ]
+
+    # 目录处理阶段：每次运行使用新的上下文（包含输入解码），拼图阶段的预处理不计时
+    stages = [
+        (prepare_mobile_desktop, create_mobile_puzzle),
+        (prepare_mobile_desktop_2, create_mobile_puzzle_2),
+        (prepare_mobile_desktop_3, create_mobile_puzzle_3),
+        (prepare_pc_desktop_mac, create_pc_puzzle),
+        (prepare_pad_images, create_pad_puzzle)
+    ]
+    for prepare, create in stages:
+        cases.append(Case(prepare.__name__, lambda ctx, prepare=prepare: prepare(fx.work_dir, ctx), setup=fx.context))
+    for prepare, create in stages:
+        cases.append(Case(create.__name__, lambda ctx, create=create: create(fx.work_dir, fx.output_dir, None, ctx),
+                          setup=lambda prepare=prepare: fx.context(prepare)))
+
+    cases.append(Case('split_image', lambda _: split_image(str(fx.grid_file), str(fx.split_dir))))
+    return cases
+
+
+def memory_method() -> str:
+    """
+    当前平台使用的峰值内存测量方式
+    """
+    return 'rss' if reset_peak_rss() else 'tracemalloc'
+
+
+def measure_peak_memory(case: Case, method: str) -> float:
+    """
+    运行一次用例并测量峰值内存增量（MB）
+
+    Args:
+        case: 用例
+        method: 测量方式（rss / tracemalloc）
+
+    Returns:
+        运行期间相对于运行前的峰值内存增量
+    """
+    state = case.setup() if case.setup else None
+    gc.collect()
+    if method == 'rss':
+        release_free_memory()
+        reset_peak_rss()
+        before = read_proc_status('VmRSS')
+        case.run(state)
+        peak = read_proc_status('VmHWM') - before
+    else:
+        tracemalloc.start()
+        case.run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return max(peak, 0) / 1024 / 1024
+
+
+def run_case(case: Case, repeat: int, min_time: float, method: str) -> Dict[str, float]:
+    """
+    运行用例：预热一次后至少运行 repeat 次且累计不少于 min_time 秒，再单独运行一次测量峰值内存
+
+    Args:
+        case: 用例
+        repeat: 最少计时次数
+        min_time: 最少累计计时（秒）
+        method: 峰值内存测量方式
+
+    Returns:
+        测量结果
+    """
+    case.run(case.setup() if case.setup else None)
+
+    times = []
+    while len(times) < repeat or sum(times) < min_time:
+        state = case.setup() if case.setup else None
+        start = time.perf_counter()
+        case.run(state)
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    return {
+        'runs': len(times),
+        'best_ms': best * 1000,
+        'median_ms': statistics.median(times) * 1000,
+        'ops_per_sec': 1 / best,
+        'peak_mb': measure_peak_memory(case, method)
+    }
+
+
+def compare(result: Dict[str, float], base: Optional[Dict[str, float]], threshold: float,
+            memory_threshold: float, same_memory_method: bool) -> Tuple[str, bool]:
+    """
+    与基线对比
+
+    Returns:
+        (对比说明, 是否退化)
+    """
+    if base is None:
+        return '无基线', False
+
+    notes, regressed = [], False
+    slowdown = base['ops_per_sec'] / result['ops_per_sec'] - 1
+    if slowdown > threshold:
+        notes.append(f"退化: 慢 {slowdown:.0%}")
+        regressed = True
+    else:
+        notes.append(f"{-slowdown:+.0%}")
+
+    if same_memory_method:
+        growth = result['peak_mb'] - base['peak_mb']
+        if growth > MEMORY_NOISE_MB and growth > base['peak_mb'] * memory_threshold:
+            notes.append(f"退化: 内存 +{growth:.1f}MB")
+            regressed = True
+    return '，'.join(notes), regressed
+
+
+def environment() -> Dict[str, Any]:
+    """
+    运行环境信息（保存在基线中，换机器后对比结果需要重新保存基线）
+    """
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'memory_method': memory_method()
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='拼图和切分热点函数的基准测试套件')
+    parser.add_argument('--filter', action='append', default=[], help='只运行名称包含该字符串的用例（可多次指定）')
+    parser.add_argument('--list', action='store_true', help='只列出用例名称')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例最少计时次数')
+    parser.add_argument('--min-time', type=float, default=1.0, help='每个用例最少累计计时（秒）')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help=f'基线文件（默认 {DEFAULT_BASELINE.name}）')
+    parser.add_argument('--save-baseline', action='store_true', help='将本次结果保存为基线（与已有基线合并，覆盖同名用例）')
+    parser.add_argument('--threshold', type=float, default=0.2, help='吞吐量下降超过该比例时视为退化')
+    parser.add_argument('--memory-threshold', type=float, default=0.2, help='峰值内存增长超过该比例时视为退化')
+    args = parser.parse_args()
+
+    # 阶段函数的日志只保留警告和错误
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+    env = environment()
+    same_memory_method = baseline.get('environment', {}).get('memory_method') == env['memory_method']
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as tmp:
+        print('生成输入图片...')
+        fx = Fixtures(Path(tmp))
+        cases = [case for case in build_cases(fx) if not args.filter or any(f in case.name for f in args.filter)]
+        if args.list:
+            for case in cases:
+                print(case.name)
+            return 0
+
+        print(f"峰值内存测量方式: {env['memory_method']}" + ('' if baseline else '，未找到基线'))
+        print(f"{'用例':<42}{'次数':>6}{'最短(ms)':>11}{'中位(ms)':>11}{'ops/s':>9}{'峰值(MB)':>10}  对比基线")
+        results, regressions = {}, []
+        for case in cases:
+            # split_image 每处理一张图片输出一行，不计入结果
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_case(case, args.repeat, args.min_time, env['memory_method'])
+            note, regressed = compare(result, baseline.get('cases', {}).get(case.name), args.threshold,
+                                      args.memory_threshold, same_memory_method)
+            if regressed:
+                regressions.append(case.name)
+            results[case.name] = result
+            print(f"{case.name:<42}{result['runs']:>6}{result['best_ms']:>11.1f}{result['median_ms']:>11.1f}"
+                  f"{result['ops_per_sec']:>9.2f}{result['peak_mb']:>10.1f}  {note}")
+
+    if args.save_baseline:
+        merged = baseline.get('cases', {}) if same_memory_method else {}
+        merged.update(results)
+        data = {'environment': env, 'cases': merged}
+        args.baseline.write_text(json.dumps(data, indent=2, sort_keys=True, ensure_ascii=False) + '\n', encoding='utf-8')
+        print(f"\n已保存基线: {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} 个用例相对基线退化: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
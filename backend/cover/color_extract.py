@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+主色调提取模块
+提供可替换的主色调提取算法，并在一次运行内按源图片缓存提取结果
+"""
+
+import logging
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+from PIL import Image
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .instrument import instrumented
+except ImportError:
+    from instrument import instrumented
+
+# numpy 和 scikit-learn 只在实际提取主色调时导入，避免拖慢不需要主色调的运行的启动速度
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 快速算法使用的缩略图最大边长
+FAST_THUMBNAIL_SIZE = 256
+
+# 快速算法每个颜色通道的量化位数（5 位即 32 级）
+FAST_QUANTIZE_BITS = 5
+
+# 快速算法的 K-means 重复初始化次数和最大迭代次数
+FAST_N_INIT = 4
+FAST_MAX_ITER = 50
+
+# 默认的主色调提取算法
+DEFAULT_COLOR_EXTRACTOR = 'fast'
+
+Color = Tuple[int, int, int]
+
+
+def _rgb_array(image: Image.Image) -> 'np.ndarray':
+    """
+    将图片转换为 (像素数, 3) 的 RGB 数组
+    """
+    import numpy as np
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    img_array = np.asarray(image)
+    return img_array[:, :, :3].reshape(-1, 3)
+
+
+def extract_color_kmeans(image: Image.Image, k: int = 3) -> Color:
+    """
+    使用 scikit-learn KMeans 对全分辨率像素聚类提取主色调（精确但较慢）
+
+    Args:
+        image: PIL Image 对象
+        k: K-means 聚类数量
+
+    Returns:
+        RGB 颜色元组
+    """
+    import numpy as np
+    from sklearn.cluster import KMeans
+
+    pixels = _rgb_array(image)
+
+    # 使用 K-means 聚类
+    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+    kmeans.fit(pixels)
+
+    # 获取最大的聚类中心（主色调）
+    cluster_sizes = np.bincount(kmeans.labels_)
+    main_color = kmeans.cluster_centers_[np.argmax(cluster_sizes)]
+
+    return tuple(map(int, main_color))
+
+
+def _weighted_kmeans(points: 'np.ndarray', weights: 'np.ndarray', k: int, rng: 'np.random.Generator') -> Tuple['np.ndarray', 'np.ndarray', float]:
+    """
+    带权重的 K-means（k-means++ 初始化）
+
+    Args:
+        points: (n, 3) 颜色点
+        weights: (n,) 每个点的像素数
+        k: 聚类数量
+        rng: 随机数生成器
+
+    Returns:
+        (聚类中心, 每个点所属的聚类, 加权误差)
+    """
+    import numpy as np
+
+    # k-means++ 初始化
+    centers = [points[rng.choice(len(points), p=weights / weights.sum())]]
+    for _ in range(1, k):
+        dist = np.min(((points[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2), axis=1)
+        prob = dist * weights
+        if prob.sum() <= 0:
+            break
+        centers.append(points[rng.choice(len(points), p=prob / prob.sum())])
+    centers = np.array(centers, dtype=np.float64)
+
+    labels = np.zeros(len(points), dtype=np.intp)
+    for _ in range(FAST_MAX_ITER):
+        dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = np.argmin(dist, axis=1)
+        new_centers = centers.copy()
+        for i in range(len(centers)):
+            mask = labels == i
+            if mask.any():
+                new_centers[i] = np.average(points[mask], axis=0, weights=weights[mask])
+        if np.allclose(new_centers, centers, atol=0.01):
+            centers = new_centers
+            break
+        centers = new_centers
+
+    dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    labels = np.argmin(dist, axis=1)
+    inertia = float((dist[np.arange(len(points)), labels] * weights).sum())
+    return centers, labels, inertia
+
+
+def extract_color_fast(image: Image.Image, k: int = 3) -> Color:
+    """
+    快速提取主色调：缩略图 + 颜色直方图量化 + 带权重的 K-means
+
+    先把图片按面积平均缩小到不超过 FAST_THUMBNAIL_SIZE，再把颜色量化到直方图的桶中，
+    以每个桶内像素的平均颜色和像素数做带权重聚类。结果与全分辨率 KMeans 基本一致，
+    但参与聚类的点数从数百万降到数千。
+
+    Args:
+        image: PIL Image 对象
+        k: 聚类数量
+
+    Returns:
+        RGB 颜色元组
+    """
+    import numpy as np
+
+    # 与 KMeans 算法一样忽略透明通道（RGBA 缩放时会按透明度预乘，需先去掉透明通道）
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # 按面积平均缩小
+    scale = max(image.size) / FAST_THUMBNAIL_SIZE
+    if scale > 1:
+        thumb_size = (max(1, round(image.width / scale)), max(1, round(image.height / scale)))
+        image = image.resize(thumb_size, Image.Resampling.BOX)
+
+    pixels = _rgb_array(image).astype(np.int64)
+
+    # 颜色直方图量化：每个桶记录像素数和平均颜色
+    shift = 8 - FAST_QUANTIZE_BITS
+    quantized = pixels >> shift
+    bins = (quantized[:, 0] << (2 * FAST_QUANTIZE_BITS)) | (quantized[:, 1] << FAST_QUANTIZE_BITS) | quantized[:, 2]
+    _, inverse, counts = np.unique(bins, return_inverse=True, return_counts=True)
+    sums = np.stack([np.bincount(inverse, weights=pixels[:, c]) for c in range(3)], axis=1)
+    points = sums / counts[:, None]
+    weights = counts.astype(np.float64)
+
+    if len(points) <= k:
+        return tuple(map(int, points[np.argmax(weights)]))
+
+    # 多次初始化，取误差最小的结果
+    rng = np.random.default_rng(42)
+    best = None
+    for _ in range(FAST_N_INIT):
+        result = _weighted_kmeans(points, weights, k, rng)
+        if best is None or result[2] < best[2]:
+            best = result
+
+    centers, labels, _ = best
+    cluster_sizes = np.bincount(labels, weights=weights, minlength=len(centers))
+    return tuple(map(int, centers[np.argmax(cluster_sizes)]))
+
+
+# 可用的主色调提取算法
+COLOR_EXTRACTORS: Dict[str, Callable[[Image.Image, int], Color]] = {
+    'fast': extract_color_fast,
+    'kmeans': extract_color_kmeans
+}
+
+_extractor_name = DEFAULT_COLOR_EXTRACTOR
+
+# 本次运行内已提取的主色调
+# 有文件名的图片按 (文件名, 算法, 聚类数量) 缓存，附带文件的修改时间、大小和图片的尺寸、模式，
+# 文件被替换（--watch 中用户换了同名图片）后重新提取；内存中的图片按对象缓存，对象被回收后自动失效
+_file_colors: Dict[tuple, Tuple[tuple, Color]] = {}
+_object_colors: Dict[tuple, Tuple[weakref.ref, Color]] = {}
+_cache_lock = threading.Lock()
+
+
+def set_color_extractor(name: str) -> None:
+    """
+    设置默认的主色调提取算法
+
+    Args:
+        name: 算法名称（COLOR_EXTRACTORS 中的键）
+    """
+    if name not in COLOR_EXTRACTORS:
+        raise ValueError(f"未知的主色调提取算法: {name}（可选: {', '.join(COLOR_EXTRACTORS)}）")
+    global _extractor_name
+    _extractor_name = name
+
+
+def get_color_extractor() -> str:
+    """
+    获取当前默认的主色调提取算法名称
+    """
+    return _extractor_name
+
+
+def clear_color_cache() -> None:
+    """
+    清空主色调缓存
+    """
+    with _cache_lock:
+        _file_colors.clear()
+        _object_colors.clear()
+
+
+@instrumented
+def extract_main_color(image: Image.Image, k: int = 3, method: Optional[str] = None) -> Color:
+    """
+    提取图片的主色调（结果按源图片缓存）
+
+    Args:
+        image: PIL Image 对象
+        k: 聚类数量
+        method: 提取算法名称，默认使用 set_color_extractor 设置的算法
+
+    Returns:
+        RGB 颜色元组
+    """
+    method = method or _extractor_name
+    extractor = COLOR_EXTRACTORS[method]
+
+    filename = getattr(image, 'filename', '')
+    signature = None
+    if filename:
+        try:
+            stat = os.stat(filename)
+            signature = (stat.st_mtime_ns, stat.st_size, image.size, image.mode)
+        except OSError:
+            pass
+    if signature is not None:
+        key = (filename, method, k)
+        with _cache_lock:
+            cached = _file_colors.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        color = extractor(image, k)
+        with _cache_lock:
+            _file_colors[key] = (signature, color)
+        return color
+
+    key = (id(image), method, k)
+    with _cache_lock:
+        cached = _object_colors.get(key)
+    if cached is not None and cached[0]() is image:
+        return cached[1]
+
+    color = extractor(image, k)
+    with _cache_lock:
+        # 回调可能在垃圾回收时触发，不能获取锁
+        _object_colors[key] = (weakref.ref(image, lambda _: _object_colors.pop(key, None)), color)
+    return color
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录处理上下文
+为 prepare_* 和 create_* 提供输入图片、中间图片和输出的统一接口：
+PuzzleContext 从工作目录读取输入并把拼图写入输出目录，MemoryPuzzleContext 完全在内存中完成
+"""
+
+import io
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Mapping, Optional, Tuple, Union
+from PIL import Image
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .image_cache import DirectoryImageCache, LRUImageCache, decode_image
+    from .encoding import EncodedImage, encode_image
+    from .manifest import atomic_write_bytes
+    from .utils import encode_output, write_encoded
+except ImportError:
+    from image_cache import DirectoryImageCache, LRUImageCache, decode_image
+    from encoding import EncodedImage, encode_image
+    from manifest import atomic_write_bytes
+    from utils import encode_output, write_encoded
+
+logger = logging.getLogger(__name__)
+
+# 内存输入图片的类型：编码后的字节、已解码的图片或图片文件路径
+ImageInput = Union[bytes, bytearray, memoryview, Image.Image, Path]
+
+# 拼图完成后的回调，参数为 (输出文件名, 编码结果)
+OutputCallback = Callable[[str, EncodedImage], None]
+
+# 内存输入解码缓存的容量（按解码后的像素字节数计算）
+MEMORY_IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class PuzzleContext:
+    """
+    单个目录的处理上下文
+
+    中间图片（如 mobile-desktop.png、pc-desktop-mac.png）由 prepare_* 生成后保存在内存中，
+    create_* 直接使用内存中的图片对象。只有 keep_intermediates 为 True 时才会写入磁盘（覆盖已有文件）。
+    reuse_intermediates 为 True 时，磁盘上已存在的中间图片（例如上次运行保留下来的）会被直接使用；
+    这些文件不一定由当前的输入图片生成，按构建清单重建拼图时不使用。
+
+    输入图片通过 images（目录图片缓存）读取，同一张图片在多个阶段中只解码一次。
+    拼图通过 save_output 编码后写入 output_dir。
+
+    中间图片和缓存中的图片在多个阶段之间共享，使用方不能原地修改。
+    """
+
+    def __init__(
+        self,
+        work_dir: Optional[Path],
+        keep_intermediates: bool = True,
+        image_cache: Optional[DirectoryImageCache] = None,
+        output_dir: Optional[Path] = None,
+        on_output: Optional[OutputCallback] = None,
+        reuse_intermediates: bool = True
+    ):
+        """
+        Args:
+            work_dir: 工作目录
+            keep_intermediates: 是否将中间图片写入工作目录
+            image_cache: 目录图片缓存，默认新建
+            output_dir: 拼图输出目录，默认为工作目录下的 intr
+            on_output: 每张拼图保存后的回调
+            reuse_intermediates: 是否使用磁盘上已存在的中间图片（为 False 时总是由 prepare_* 重新生成）
+        """
+        self.work_dir = work_dir
+        self.keep_intermediates = keep_intermediates
+        self.reuse_intermediates = reuse_intermediates
+        self.images = image_cache or DirectoryImageCache()
+        self.output_dir = output_dir or (work_dir / 'intr' if work_dir is not None else None)
+        self.on_output = on_output
+        self.outputs: Dict[str, EncodedImage] = {}
+        self._intermediates: Dict[str, Image.Image] = {}
+        self._lock = threading.Lock()
+
+    def find_input(self, base_name: str) -> Optional[Hashable]:
+        """
+        查找输入图片（支持多种格式）
+
+        Args:
+            base_name: 基础文件名（不含扩展名），如 mobile-lock
+
+        Returns:
+            输入图片的引用（传给 open_input、input_source_size），不存在时返回 None
+        """
+        return self.images.find(self.work_dir, base_name)
+
+    def open_input(self, ref: Hashable, min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        """
+        解码输入图片（缓存，只读）
+
+        Args:
+            ref: find_input 返回的引用
+            min_size: 布局需要的最小尺寸，提供时按需降低解码分辨率
+
+        Returns:
+            已解码的图片对象
+        """
+        return self.images.open(ref, min_size)
+
+    def input_source_size(self, ref: Hashable) -> Tuple[int, int]:
+        """
+        读取输入图片的原始尺寸（不解码像素）
+
+        Args:
+            ref: find_input 返回的引用
+
+        Returns:
+            原始尺寸 (width, height)
+        """
+        return self.images.source_size(ref)
+
+    def has_intermediate(self, name: str) -> bool:
+        """
+        检查中间图片是否已存在（内存，以及 reuse_intermediates 为 True 时的磁盘）
+
+        Args:
+            name: 中间图片文件名，如 mobile-desktop.png
+
+        Returns:
+            是否存在
+        """
+        with self._lock:
+            if name in self._intermediates:
+                return True
+        return self.reuse_intermediates and (self.work_dir / name).exists()
+
+    def put_intermediate(self, name: str, image: Image.Image) -> None:
+        """
+        保存中间图片
+
+        Args:
+            name: 中间图片文件名
+            image: 图片对象
+        """
+        with self._lock:
+            self._intermediates[name] = image
+        if self.keep_intermediates:
+            atomic_write_bytes(self.work_dir / name, encode_image(image, 'PNG'))
+            logger.debug(f"  已写入中间图片: {name}")
+
+    def get_intermediate(self, name: str) -> Optional[Image.Image]:
+        """
+        获取中间图片，优先使用内存中的图片，其次读取磁盘上的文件（reuse_intermediates 为 True 时）
+
+        Args:
+            name: 中间图片文件名
+
+        Returns:
+            图片对象，如果不存在则返回 None
+        """
+        with self._lock:
+            image = self._intermediates.get(name)
+        if image is not None or not self.reuse_intermediates:
+            return image
+
+        path = self.work_dir / name
+        if not path.exists():
+            return None
+
+        image = self.images.open(path)
+        with self._lock:
+            return self._intermediates.setdefault(name, image)
+
+    def save_output(self, name: str, image: Image.Image, max_size: Optional[int] = None) -> EncodedImage:
+        """
+        编码并保存拼图
+
+        Args:
+            name: 输出文件名，如 mobile-combined.png（PNG 超出大小限制时实际保存为 .jpg）
+            image: 拼图
+            max_size: JPEG 的最大文件大小（字节），默认 500KB
+
+        Returns:
+            编码结果
+        """
+        result = encode_output(image, name, max_size)
+        name = Path(name).with_suffix(result.extension).name
+        self.write_output(name, result)
+        with self._lock:
+            self.outputs[name] = result
+        if self.on_output is not None:
+            self.on_output(name, result)
+        return result
+
+    def write_output(self, name: str, result: EncodedImage) -> None:
+        """
+        写入编码后的拼图（原子写入输出目录）
+
+        Args:
+            name: 实际的输出文件名
+            result: 编码结果
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        write_encoded(result, self.output_dir / name)
+
+
+class MemoryPuzzleContext(PuzzleContext):
+    """
+    完全在内存中处理的上下文：输入图片来自内存（字节或图片对象），拼图只编码不写入磁盘
+
+    编码后的拼图保存在 outputs 中，并在完成后调用 on_output。
+    """
+
+    def __init__(
+        self,
+        inputs: Mapping[str, ImageInput],
+        on_output: Optional[OutputCallback] = None
+    ):
+        """
+        Args:
+            inputs: {基础文件名: 输入图片}，如 {'mobile': b'...', 'mobile-lock': Image}
+            on_output: 每张拼图完成后的回调
+        """
+        super().__init__(None, keep_intermediates=False, on_output=on_output)
+        self.inputs = dict(inputs)
+        self.images = LRUImageCache(MEMORY_IMAGE_CACHE_BYTES)
+
+    def find_input(self, base_name: str) -> Optional[Hashable]:
+        return base_name if base_name in self.inputs else None
+
+    def open_input(self, ref: Hashable, min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        value = self.inputs[ref]
+        if isinstance(value, Image.Image):
+            return value
+
+        key = (ref, min_size)
+        image = self.images.get(key)
+        if image is not None:
+            return image
+        source = value if isinstance(value, Path) else io.BytesIO(value)
+        return self.images.put(key, decode_image(source, min_size))
+
+    def input_source_size(self, ref: Hashable) -> Tuple[int, int]:
+        value = self.inputs[ref]
+        if isinstance(value, Image.Image):
+            return value.size
+        with Image.open(value if isinstance(value, Path) else io.BytesIO(value)) as image:
+            return image.size
+
+    def has_intermediate(self, name: str) -> bool:
+        with self._lock:
+            return name in self._intermediates
+
+    def get_intermediate(self, name: str) -> Optional[Image.Image]:
+        with self._lock:
+            return self._intermediates.get(name)
+
+    def write_output(self, name: str, result: EncodedImage) -> None:
+        pass
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片编码模块
+在内存中完成输出图片的编码和文件大小搜索，确定最终结果后再一次性写入磁盘
+"""
+
+import io
+import logging
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+from PIL import Image
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .instrument import count_encode, instrumented
+except ImportError:
+    from instrument import count_encode, instrumented
+
+logger = logging.getLogger(__name__)
+
+# JPEG 质量搜索的默认上下限
+JPEG_MAX_QUALITY = 95
+JPEG_MIN_QUALITY = 30
+
+# JPEG 质量搜索的候选质量间隔
+JPEG_QUALITY_STEP = 5
+
+# 质量降到下限仍超出大小限制时，缩小尺寸后重新搜索的质量上限
+JPEG_RESIZED_MAX_QUALITY = 75
+
+# PNG 超出大小限制时转为 JPEG 的质量下限
+PNG_FALLBACK_MIN_QUALITY = 55
+
+# 估算优化 PNG 大小时抽样的行条带：抽样行数占总高度的比例和每个条带的行数
+PNG_SAMPLE_FRACTION = 1 / 16
+PNG_SAMPLE_STRIP_ROWS = 32
+
+# 估算大小超出限制该比例以上时，不再尝试优化 PNG 编码
+# （照片类画布的估算误差在几个百分点以内；误判只会让本可保存为 PNG 的结果保存为高质量 JPEG）
+PNG_ESTIMATE_TOLERANCE = 0.05
+
+# 编码格式对应的文件扩展名
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png'
+}
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """
+    编码后的图片
+    """
+    data: bytes
+    format: str
+    size: Tuple[int, int]
+    quality: Optional[int] = None
+    encodes: int = 1
+    resized: bool = False
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    @property
+    def extension(self) -> str:
+        return FORMAT_EXTENSIONS[self.format]
+
+
+def flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """
+    转换为 RGB 模式，透明区域填充白色背景（JPEG 不支持透明通道）
+
+    Args:
+        image: 图片对象
+
+    Returns:
+        RGB 模式的图片
+    """
+    if image.mode == 'RGBA':
+        bg = Image.new('RGB', image.size, (255, 255, 255))
+        bg.paste(image, mask=image.split()[3])
+        return bg
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+@instrumented
+def encode_image(image: Image.Image, format: str, **params) -> bytes:
+    """
+    在内存中编码图片
+
+    Args:
+        image: 图片对象
+        format: 编码格式，如 JPEG、PNG
+        **params: 传递给 Image.save 的编码参数
+
+    Returns:
+        编码后的字节
+    """
+    count_encode()
+    buffer = io.BytesIO()
+    image.save(buffer, format, **params)
+    return buffer.getvalue()
+
+
+def search_jpeg_quality(
+    image: Image.Image,
+    max_size: int,
+    max_quality: int = JPEG_MAX_QUALITY,
+    min_quality: int = JPEG_MIN_QUALITY
+) -> Tuple[bytes, int, int, bool]:
+    """
+    查找不超过指定大小的最高 JPEG 质量
+
+    候选质量为从 max_quality 开始按 JPEG_QUALITY_STEP 递减到 min_quality 的序列。JPEG 文件大小随质量
+    单调增长，且满足条件的质量通常接近上限，因此先按 1、2、4... 的步数向下试探出区间，
+    再在区间内二分。所有编码都在内存中完成。
+
+    Args:
+        image: RGB 图片
+        max_size: 最大文件大小（字节）
+        max_quality: 质量上限
+        min_quality: 质量下限
+
+    Returns:
+        (编码结果, 质量, 编码次数, 是否满足大小限制)；
+        最低质量仍超出限制时返回最低质量的编码结果
+    """
+    qualities = list(range(max_quality, min_quality, -JPEG_QUALITY_STEP)) + [min_quality]
+    results = {}
+
+    def fits(index: int) -> bool:
+        results[index] = encode_image(image, 'JPEG', quality=qualities[index], optimize=True)
+        return len(results[index]) <= max_size
+
+    # 向下试探：too_large 为已知超出限制的下标，found 为已知满足限制的下标
+    too_large, found = -1, None
+    step = 1
+    while found is None:
+        index = min(too_large + step, len(qualities) - 1)
+        if fits(index):
+            found = index
+        elif index == len(qualities) - 1:
+            return results[index], qualities[index], len(results), False
+        else:
+            too_large = index
+            step *= 2
+
+    # 在 (too_large, found] 区间内二分
+    while found - too_large > 1:
+        index = (too_large + found) // 2
+        if fits(index):
+            found = index
+        else:
+            too_large = index
+
+    return results[found], qualities[found], len(results), True
+
+
+def encode_jpeg_within(
+    image: Image.Image,
+    max_size: int,
+    quality: int = JPEG_MAX_QUALITY,
+    min_quality: int = JPEG_MIN_QUALITY
+) -> EncodedImage:
+    """
+    将图片编码为不超过指定大小的 JPEG
+
+    先在原尺寸下查找质量；最低质量仍超出限制时，按文件大小比例缩小尺寸后重新查找，
+    还是超出则使用最低质量的结果。
+
+    Args:
+        image: 图片对象
+        max_size: 最大文件大小（字节）
+        quality: 质量上限
+        min_quality: 质量下限
+
+    Returns:
+        编码结果
+    """
+    image = flatten_to_rgb(image)
+    data, chosen, encodes, fits = search_jpeg_quality(image, max_size, quality, min_quality)
+    if fits:
+        return EncodedImage(data, 'JPEG', image.size, chosen, encodes)
+
+    # 按文件大小比例缩小尺寸
+    scale = (max_size / len(data)) ** 0.5
+    new_size = (int(image.width * scale), int(image.height * scale))
+    image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    data, chosen, resized_encodes, _ = search_jpeg_quality(
+        image, max_size, min(JPEG_RESIZED_MAX_QUALITY, quality), min_quality
+    )
+    return EncodedImage(data, 'JPEG', image.size, chosen, encodes + resized_encodes, resized=True)
+
+
+def sample_rows(image: Image.Image, fraction: float = PNG_SAMPLE_FRACTION, strip_rows: int = PNG_SAMPLE_STRIP_ROWS) -> Image.Image:
+    """
+    从图片中均匀抽取若干整行条带拼成一张小图
+
+    PNG 按行过滤和压缩，保留连续的整行才能反映原图的压缩特性
+
+    Args:
+        image: 图片对象
+        fraction: 抽样行数占总高度的比例
+        strip_rows: 每个条带的行数
+
+    Returns:
+        抽样图片
+    """
+    strips = max(1, int(image.height * fraction / strip_rows))
+    if strips * strip_rows >= image.height:
+        return image
+
+    step = image.height / strips
+    sample = Image.new(image.mode, (image.width, strips * strip_rows))
+    for i in range(strips):
+        top = int(i * step)
+        sample.paste(image.crop((0, top, image.width, top + strip_rows)), (0, i * strip_rows))
+    return sample
+
+
+def estimate_optimized_png_size(image: Image.Image, fast_size: int) -> int:
+    """
+    估算 optimize=True 编码的 PNG 大小
+
+    优化编码是 Pillow 最慢的编码方式。先用抽样图片比较优化编码和最快编码（compress_level=1）的压缩率，
+    再按该比例换算整张图片最快编码的大小。
+
+    Args:
+        image: 图片对象
+        fast_size: 整张图片最快编码的字节数
+
+    Returns:
+        估算的字节数
+    """
+    sample = sample_rows(image)
+    sample_fast = len(encode_image(sample, 'PNG', compress_level=1))
+    sample_optimized = len(encode_image(sample, 'PNG', optimize=True))
+    return int(fast_size * sample_optimized / max(1, sample_fast))
+
+
+def encode_optimized(
+    image: Image.Image,
+    max_size: int,
+    quality: int = JPEG_MAX_QUALITY,
+    min_quality: int = PNG_FALLBACK_MIN_QUALITY
+) -> EncodedImage:
+    """
+    优先编码为优化的 PNG，超出大小限制时改为 JPEG
+
+    先做一次最快的 PNG 编码：不超出限制时优化编码必然也不超出；超出时估算优化编码的大小，
+    估算值明显超出限制则跳过优化编码，直接查找 JPEG 质量。所有编码都在内存中完成。
+
+    Args:
+        image: 图片对象
+        max_size: 最大文件大小（字节）
+        quality: JPEG 质量上限
+        min_quality: JPEG 质量下限
+
+    Returns:
+        编码结果
+    """
+    fast_size = len(encode_image(image, 'PNG', compress_level=1))
+    encodes = 1
+
+    png_size = None
+    if fast_size > max_size:
+        png_size = estimate_optimized_png_size(image, fast_size)
+        encodes += 2
+        if png_size > max_size * (1 + PNG_ESTIMATE_TOLERANCE):
+            logger.info(f"  PNG 预计大小 {png_size / 1024 / 1024:.2f}MB 超过限制，跳过 PNG 优化编码")
+        else:
+            png_size = None
+
+    if png_size is None:
+        data = encode_image(image, 'PNG', optimize=True)
+        encodes += 1
+        if len(data) <= max_size:
+            return EncodedImage(data, 'PNG', image.size, encodes=encodes)
+        logger.info(f"  PNG 大小 {len(data) / 1024 / 1024:.2f}MB 超过限制")
+
+    result = encode_jpeg_within(image, max_size, quality, min_quality)
+    return replace(result, encodes=result.encodes + encodes)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片缓存模块
+缓存已解码的图片，避免同一张图片在多个拼图步骤中被重复解码
+"""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, Hashable, Optional, Tuple, Union
+from PIL import Image
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .instrument import count_decode, instrumented
+except ImportError:
+    from instrument import count_decode, instrumented
+
+# 单个目录图片缓存的默认容量（按解码后的像素字节数计算）
+DEFAULT_IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+# 支持的输入图片格式
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.webp']
+
+
+def find_image_file(work_dir: Path, base_name: str) -> Optional[Path]:
+    """
+    查找图片文件（支持多种格式）
+
+    Args:
+        work_dir: 工作目录
+        base_name: 基础文件名（不含扩展名）
+
+    Returns:
+        图片文件路径，如果不存在则返回 None
+    """
+    for ext in IMAGE_EXTENSIONS:
+        file_path = work_dir / f"{base_name}{ext}"
+        if file_path.exists():
+            return file_path
+    return None
+
+
+def reduction_factor(size: Tuple[int, int], min_size: Tuple[int, int]) -> int:
+    """
+    计算在不小于 min_size 的前提下可以整数倍缩小的最大倍数
+
+    Args:
+        size: 图片尺寸
+        min_size: 缩小后至少需要的尺寸 (width, height)
+
+    Returns:
+        缩小倍数，1 表示不缩小
+    """
+    return max(1, min(size[0] // max(1, min_size[0]), size[1] // max(1, min_size[1])))
+
+
+@instrumented
+def decode_image(path: Union[Path, BinaryIO], min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    解码图片，提供 min_size 时只解码到布局需要的分辨率
+
+    JPEG 使用 draft 模式在解码时直接按 1/2、1/4、1/8 缩小；其他格式完整解码后按整数倍 reduce。
+    结果的宽高都不小于 min_size，后续仍由调用方做最终的高质量缩放。
+
+    Args:
+        path: 图片路径或文件对象（如内存中的 BytesIO）
+        min_size: 布局需要的最小尺寸 (width, height)，为 None 时按原始分辨率解码
+
+    Returns:
+        已解码的图片对象
+    """
+    count_decode()
+    image = Image.open(path)
+    if min_size is None:
+        image.load()
+        return image
+
+    if image.format == 'JPEG':
+        image.draft(image.mode, min_size)
+    image.load()
+
+    factor = reduction_factor(image.size, min_size)
+    if factor > 1:
+        image = image.reduce(factor)
+    return image
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """
+    估算图片解码后占用的内存字节数
+
+    Args:
+        image: 图片对象
+
+    Returns:
+        字节数
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+class LRUImageCache:
+    """
+    按内存容量限制的 LRU 图片缓存（线程安全）
+
+    缓存中的图片对象会被多个调用方共享，调用方不能原地修改
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: 缓存容量（字节），超出时淘汰最久未使用的图片
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: 'OrderedDict[Hashable, Image.Image]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        """
+        获取缓存的图片
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            图片对象，未命中时返回 None
+        """
+        with self._lock:
+            image = self._items.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Hashable, image: Image.Image) -> Image.Image:
+        """
+        放入图片，如果其他线程已经放入了同一个键，则返回已有的图片
+
+        单张超过缓存容量的图片不会被缓存
+
+        Args:
+            key: 缓存键
+            image: 图片对象
+
+        Returns:
+            缓存中的图片对象
+        """
+        size = image_nbytes(image)
+        with self._lock:
+            existing = self._items.get(key)
+            if existing is not None:
+                self._items.move_to_end(key)
+                return existing
+            if size > self.max_bytes:
+                return image
+
+            self._items[key] = image
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= image_nbytes(evicted)
+            return image
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+
+class DirectoryImageCache(LRUImageCache):
+    """
+    单个目录的图片缓存
+
+    以 (文件路径, 修改时间, 解码尺寸) 为键缓存解码后的图片，文件被修改后会重新解码；
+    同时缓存按基础文件名查找图片文件的结果
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_IMAGE_CACHE_BYTES):
+        super().__init__(max_bytes)
+        self._files: Dict[Tuple[Path, str], Optional[Path]] = {}
+        self._source_sizes: Dict[Tuple[Path, int], Tuple[int, int]] = {}
+
+    def find(self, work_dir: Path, base_name: str) -> Optional[Path]:
+        """
+        查找图片文件（支持多种格式），结果会被缓存
+
+        Args:
+            work_dir: 工作目录
+            base_name: 基础文件名（不含扩展名）
+
+        Returns:
+            图片文件路径，如果不存在则返回 None
+        """
+        key = (work_dir, base_name)
+        with self._lock:
+            if key in self._files:
+                return self._files[key]
+
+        found = find_image_file(work_dir, base_name)
+        with self._lock:
+            return self._files.setdefault(key, found)
+
+    def source_size(self, path: Path) -> Tuple[int, int]:
+        """
+        读取图片文件头中的原始尺寸（不解码像素），结果会被缓存
+
+        Args:
+            path: 图片路径
+
+        Returns:
+            原始尺寸 (width, height)
+        """
+        key = (path, path.stat().st_mtime_ns)
+        with self._lock:
+            size = self._source_sizes.get(key)
+        if size is None:
+            with Image.open(path) as image:
+                size = image.size
+            with self._lock:
+                self._source_sizes[key] = size
+        return size
+
+    def open(self, path: Path, min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        """
+        打开并解码图片，命中缓存时直接返回已解码的图片
+
+        Args:
+            path: 图片路径
+            min_size: 布局需要的最小尺寸，提供时按需降低解码分辨率（见 decode_image）
+
+        Returns:
+            已解码的图片对象（只读）
+        """
+        key = (path, path.stat().st_mtime_ns, min_size)
+        image = self.get(key)
+        if image is not None:
+            return image
+
+        return self.put(key, decode_image(path, min_size))
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理耗时和内存统计模块
+记录每个目录中每个阶段的墙钟时间、CPU 时间、解码/编码次数和内存峰值，以及阶段内热点函数的调用次数和耗时，
+按目录输出为 JSON 行，并在批量处理结束时汇总成表格
+
+阶段在线程池中并行执行，统计通过线程局部变量归属到当前线程正在执行的阶段；不在阶段中的调用不做统计。
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar('F', bound=Callable)
+
+MB = 1024 * 1024
+
+# --profile 输出中列出的函数和内存分配位置数量
+PROFILE_TOP = 30
+
+# 当前线程正在执行的阶段
+_local = threading.local()
+
+# 正在执行的阶段数量（整个进程），只有没有其他阶段运行时才重置内存峰值
+_active_stages = 0
+_active_lock = threading.Lock()
+
+
+
+def read_proc_status(field_name: str) -> Optional[int]:
+    """
+    读取 /proc/self/status 中的内存字段（如 VmRSS、VmHWM）
+
+    Args:
+        field_name: 字段名
+
+    Returns:
+        字节数，不支持的平台返回 None
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(f"{field_name}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _malloc_trim() -> Optional[Callable[[int], int]]:
+    """
+    glibc 的 malloc_trim，不可用时返回 None（首次使用时才加载 ctypes）
+    """
+    import ctypes
+
+    # 进程自身已链接的 C 库中查找，不需要 find_library（会启动子进程）
+    return getattr(ctypes.CDLL(None), 'malloc_trim', None)
+
+
+def release_free_memory() -> None:
+    """
+    将 malloc 缓存的空闲内存归还给系统（glibc），之后的分配才会体现为常驻内存增长
+    """
+    malloc_trim = _malloc_trim()
+    if malloc_trim is not None:
+        malloc_trim(0)
+
+
+def reset_peak_rss() -> bool:
+    """
+    重置进程的常驻内存峰值 VmHWM（Linux 4.0+）
+
+    Returns:
+        是否支持
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+@dataclass
+class StageStats:
+    """
+    单个阶段的统计
+
+    Attributes:
+        name: 阶段名称
+        chain: 所属处理链（mobile / pc / pad）
+        ok: 是否成功
+        wall_ms: 墙钟时间（毫秒）
+        cpu_ms: 执行阶段的线程的 CPU 时间（毫秒）
+        decodes: 图片解码次数
+        encodes: 图片编码次数（包括 JPEG 质量查找中的每次尝试）
+        peak_mb: 阶段期间进程常驻内存峰值相对阶段开始时的增长（MB），与其他阶段并行时包含同时运行的阶段；不支持的平台为 None
+        calls: 热点函数 {名称: {'count': 次数, 'ms': 累计耗时}}，耗时包含嵌套调用
+    """
+    name: str
+    chain: str = ''
+    ok: bool = False
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    decodes: int = 0
+    encodes: int = 0
+    peak_mb: Optional[float] = None
+    calls: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+    def add_call(self, name: str, seconds: float) -> None:
+        call = self.calls.setdefault(name, {'count': 0, 'ms': 0.0})
+        call['count'] += 1
+        call['ms'] += seconds * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'chain': self.chain,
+            'ok': self.ok,
+            'wall_ms': round(self.wall_ms, 1),
+            'cpu_ms': round(self.cpu_ms, 1),
+            'decodes': self.decodes,
+            'encodes': self.encodes,
+            'peak_mb': None if self.peak_mb is None else round(self.peak_mb, 1),
+            'calls': {name: {'count': call['count'], 'ms': round(call['ms'], 1)} for name, call in self.calls.items()}
+        }
+
+
+class DirectoryStats:
+    """
+    单个目录的统计，由 process_directory 在每个阶段外层调用 stage 收集
+    """
+
+    def __init__(self, work_dir: Path):
+        """
+        Args:
+            work_dir: 工作目录
+        """
+        self.work_dir = work_dir
+        self.stages: List[StageStats] = []
+        self.outputs: List[dict] = []
+        self.success = False
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+        self.peak_rss_mb: Optional[float] = None
+        self._lock = threading.Lock()
+        self._peak_rss = 0
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    @contextmanager
+    def stage(self, name: str, chain: str = '') -> Iterator[StageStats]:
+        """
+        统计一个阶段：在阶段所在线程中执行 with 语句块
+
+        Args:
+            name: 阶段名称
+            chain: 所属处理链
+
+        Yields:
+            阶段统计，语句块成功完成后由调用方设置 ok
+        """
+        global _active_stages
+        stats = StageStats(name, chain)
+        with _active_lock:
+            if _active_stages == 0:
+                release_free_memory()
+                reset_peak_rss()
+            _active_stages += 1
+        rss_before = read_proc_status('VmRSS')
+
+        _local.stage = stats
+        start_wall, start_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield stats
+        finally:
+            stats.wall_ms = (time.perf_counter() - start_wall) * 1000
+            stats.cpu_ms = (time.thread_time() - start_cpu) * 1000
+            _local.stage = None
+
+            peak_rss = read_proc_status('VmHWM')
+            with _active_lock:
+                _active_stages -= 1
+            with self._lock:
+                if peak_rss is not None and rss_before is not None:
+                    stats.peak_mb = max(peak_rss - rss_before, 0) / MB
+                    self._peak_rss = max(self._peak_rss, peak_rss)
+                self.stages.append(stats)
+
+    def add_output(self, name: str, chain: str, result) -> None:
+        """
+        记录一张生成的拼图
+
+        Args:
+            name: 输出文件名
+            chain: 所属处理链
+            result: 编码结果（EncodedImage）
+        """
+        with self._lock:
+            self.outputs.append({
+                'name': name,
+                'chain': chain,
+                'format': result.format,
+                'bytes': result.nbytes,
+                'quality': result.quality,
+                'encodes': result.encodes
+            })
+
+    def finish(self, success: bool) -> None:
+        """
+        结束目录统计
+
+        Args:
+            success: 目录是否处理成功
+        """
+        self.success = success
+        self.wall_ms = (time.perf_counter() - self._start_wall) * 1000
+        self.cpu_ms = (time.process_time() - self._start_cpu) * 1000
+        peak_rss = read_proc_status('VmHWM')
+        if peak_rss is not None:
+            self.peak_rss_mb = max(self._peak_rss, peak_rss) / MB
+
+    def crashed(self, error: BaseException) -> dict:
+        """
+        工作进程异常退出（如 BrokenProcessPool）、没有返回统计时，在提交目录的进程中生成失败记录
+
+        Args:
+            error: future.result() 抛出的异常
+
+        Returns:
+            目录统计，耗时从提交时开始计算，没有阶段、CPU 和内存统计
+        """
+        self.success = False
+        self.wall_ms = (time.perf_counter() - self._start_wall) * 1000
+        record = self.to_dict()
+        record.update(pid=None, error=f"{type(error).__name__}: {error}")
+        return record
+
+    def to_dict(self) -> dict:
+        """
+        转换为可以序列化为 JSON 的字典（一条 JSON 行）
+
+        Returns:
+            目录统计，peak_rss_mb 为处理期间进程常驻内存的峰值
+        """
+        return {
+            'directory': self.work_dir.name,
+            'path': str(self.work_dir),
+            'pid': os.getpid(),
+            'success': self.success,
+            'wall_ms': round(self.wall_ms, 1),
+            'cpu_ms': round(self.cpu_ms, 1),
+            'peak_rss_mb': None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+            'stages': [stage.to_dict() for stage in self.stages],
+            'outputs': self.outputs
+        }
+
+
+def instrumented(func: F) -> F:
+    """
+    热点函数装饰器：在阶段中调用时记录调用次数和耗时，不在阶段中时直接调用
+
+    Args:
+        func: 被统计的函数
+
+    Returns:
+        包装后的函数
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = getattr(_local, 'stage', None)
+        if stats is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.add_call(name, time.perf_counter() - start)
+    return wrapper
+
+
+def count_decode() -> None:
+    """
+    记录一次图片解码
+    """
+    stats = getattr(_local, 'stage', None)
+    if stats is not None:
+        stats.decodes += 1
+
+
+def count_encode() -> None:
+    """
+    记录一次图片编码
+    """
+    stats = getattr(_local, 'stage', None)
+    if stats is not None:
+        stats.encodes += 1
+
+
+@contextmanager
+def profile_directory(work_dir: Path, profile_dir: Path, top: int = PROFILE_TOP) -> Iterator[None]:
+    """
+    用 cProfile 和 tracemalloc 分析一个目录的处理（--profile）
+
+    cProfile 同一时间只能有一个分析器，并且只统计启用它的线程，调用方需要在当前线程中串行执行所有阶段。
+    输出 <目录名>.prof（可用 python -m pstats 或 snakeviz 查看）和 <目录名>.txt（按累计耗时排序的函数、
+    tracemalloc 峰值和处理后新增的内存分配位置）。tracemalloc 只统计 Python 和 numpy 分配的内存，
+    不包含 Pillow 的像素缓冲，并且会明显拖慢处理速度。
+
+    Args:
+        work_dir: 工作目录
+        profile_dir: 输出目录
+        top: 列出的函数和内存分配位置数量
+    """
+    # 只在分析时导入，不增加正常运行的启动耗时
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+        if started:
+            tracemalloc.stop()
+
+        profiler.dump_stats(profile_dir / f"{work_dir.name}.prof")
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+        report.write(f"tracemalloc 峰值: {traced_peak / MB:.1f}MB\n\n处理后新增的内存分配（前 {top} 个位置）:\n")
+        for stat in after.compare_to(before, 'lineno')[:top]:
+            report.write(f"{stat}\n")
+        (profile_dir / f"{work_dir.name}.txt").write_text(report.getvalue(), encoding='utf-8')
+        logger.info(f"  性能分析已写入: {profile_dir / work_dir.name}.prof、.txt")
+
+
+class RunSummary:
+    """
+    汇总一次批量处理中所有目录的统计：每个目录写入一条 JSON 行，结束时输出汇总表格
+    """
+
+    def __init__(self, stats_file: Optional[Path] = None, metrics=None, show_table: bool = True):
+        """
+        Args:
+            stats_file: JSON 行输出文件（追加写入），为 None 时只汇总不写文件
+            metrics: 同时更新的指标（PuzzleMetrics）
+            show_table: log_table 是否输出汇总表格
+        """
+        self.stats_file = stats_file
+        self.metrics = metrics
+        self.show_table = show_table
+        self.directories: List[dict] = []
+
+    def add(self, record: Optional[dict]) -> None:
+        """
+        添加一个目录的统计
+
+        Args:
+            record: DirectoryStats.to_dict() 的结果（工作进程崩溃时为 DirectoryStats.crashed() 的失败记录），为 None 时忽略
+        """
+        if record is None:
+            return
+        self.directories.append(record)
+        if self.metrics is not None:
+            self.metrics.observe_directory(record)
+        if self.stats_file is not None:
+            with open(self.stats_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def table(self) -> List[str]:
+        """
+        生成汇总表格：每个阶段和每个热点函数的累计统计
+
+        Returns:
+            表格的各行
+        """
+        stages: Dict[str, dict] = {}
+        calls: Dict[str, Dict[str, float]] = {}
+        for record in self.directories:
+            for stage in record['stages']:
+                total = stages.setdefault(stage['name'], {'count': 0, 'failed': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0,
+                                                          'decodes': 0, 'encodes': 0, 'peak_mb': None})
+                total['count'] += 1
+                total['failed'] += 0 if stage['ok'] else 1
+                for key in ('wall_ms', 'cpu_ms', 'decodes', 'encodes'):
+                    total[key] += stage[key]
+                if stage['peak_mb'] is not None:
+                    total['peak_mb'] = max(total['peak_mb'] or 0.0, stage['peak_mb'])
+                for name, call in stage['calls'].items():
+                    call_total = calls.setdefault(name, {'count': 0, 'ms': 0.0})
+                    call_total['count'] += call['count']
+                    call_total['ms'] += call['ms']
+
+        lines = [f"{'阶段':<32}{'次数':>6}{'失败':>6}{'平均耗时(ms)':>14}{'平均CPU(ms)':>13}{'最大内存增长(MB)':>18}{'解码总数':>10}{'编码总数':>10}"]
+        for name, total in sorted(stages.items(), key=lambda item: -item[1]['wall_ms']):
+            peak = '-' if total['peak_mb'] is None else f"{total['peak_mb']:.1f}"
+            lines.append(f"{name:<32}{total['count']:>6}{total['failed']:>6}{total['wall_ms'] / total['count']:>14.1f}"
+                         f"{total['cpu_ms'] / total['count']:>13.1f}{peak:>18}{total['decodes']:>10}{total['encodes']:>10}")
+
+        lines.append(f"{'热点函数（耗时含嵌套调用）':<32}{'次数':>6}{'累计耗时(ms)':>14}{'平均耗时(ms)':>14}")
+        for name, call in sorted(calls.items(), key=lambda item: -item[1]['ms']):
+            lines.append(f"{name:<32}{call['count']:>6}{call['ms']:>14.1f}{call['ms'] / call['count']:>14.1f}")
+
+        wall = sum(record['wall_ms'] for record in self.directories)
+        peaks = [record['peak_rss_mb'] for record in self.directories if record['peak_rss_mb'] is not None]
+        summary = f"目录: {len(self.directories)} 个，累计耗时 {wall / 1000:.1f}s"
+        if peaks:
+            summary += f"，单进程常驻内存峰值 {max(peaks):.1f}MB"
+        lines.append(summary)
+        return lines
+
+    def log_table(self) -> None:
+        """
+        输出汇总表格
+        """
+        if not self.show_table or not self.directories:
+            return
+        logger.info("处理统计:")
+        for line in self.table():
+            logger.info(f"  {line}")
+        if self.stats_file is not None:
+            logger.info(f"  每个目录的统计已写入: {self.stats_file}")
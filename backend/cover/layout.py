@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼图布局规划模块
+根据画布尺寸、间距、阴影边距和输入图片比例，预先计算每张图片的最终尺寸和位置，
+保证每张图片只需要缩放和添加阴影一次
+"""
+
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .utils import (
+        OUTPUT_RATIO,
+        SPACING,
+        SHADOW_OFFSET,
+        SHADOW_BLUR,
+        MOBILE_SPRITE_BOX,
+        PC_SPRITE_BOX,
+        PAD_SPRITE_BOX,
+        fit_size,
+        ratio_fit_size
+    )
+    from .shadow import shadow_margin
+except ImportError:
+    from utils import (
+        OUTPUT_RATIO,
+        SPACING,
+        SHADOW_OFFSET,
+        SHADOW_BLUR,
+        MOBILE_SPRITE_BOX,
+        PC_SPRITE_BOX,
+        PAD_SPRITE_BOX,
+        fit_size,
+        ratio_fit_size
+    )
+    from shadow import shadow_margin
+
+# 画布基准高度
+CANVAS_HEIGHT = 2000
+
+# 各拼图输入图片的目标比例
+MOBILE_RATIO = 9 / 19
+PC_RATIO = 16 / 9
+PAD_RATIO = 4 / 3
+
+# 原实现先用 resize_to_fit_ratio 把输入缩放到该尺寸内的目标比例，再放入单张图片的最大尺寸；
+# 内容尺寸按同样的中间尺寸取整计算，与原实现完全一致
+PC_RATIO_BOX = (4000, 2000)
+PAD_RATIO_BOX = (3000, 2250)
+
+
+@dataclass(frozen=True)
+class SpritePlan:
+    """
+    单张图片的布局
+    """
+    name: str
+    content_size: Tuple[int, int]  # 图片内容尺寸（不含阴影）
+    position: Tuple[int, int]  # 带阴影图片在画布上的左上角
+
+    @property
+    def sprite_size(self) -> Tuple[int, int]:
+        """
+        带阴影图片的尺寸
+        """
+        margin = shadow_margin(SHADOW_OFFSET, SHADOW_BLUR)
+        return (self.content_size[0] + margin * 2, self.content_size[1] + margin * 2)
+
+
+@dataclass(frozen=True)
+class LayoutPlan:
+    """
+    一张拼图的布局
+    """
+    output: str
+    canvas_size: Tuple[int, int]
+    sprites: Tuple[SpritePlan, ...]
+    scale: float = 1.0  # 小于 1 表示为放入画布而整体缩小了目标尺寸
+
+    def sprite(self, name: str) -> SpritePlan:
+        """
+        按名称获取图片布局
+        """
+        for sprite in self.sprites:
+            if sprite.name == name:
+                return sprite
+        raise KeyError(name)
+
+    def describe(self) -> str:
+        """
+        生成可读的布局说明
+        """
+        lines = [f"{self.output}: 画布 {self.canvas_size[0]}x{self.canvas_size[1]}"
+                 + (f"，整体缩小到 {self.scale:.3f}" if self.scale < 1 else "")]
+        for sprite in self.sprites:
+            width, height = sprite.sprite_size
+            lines.append(f"  {sprite.name}: 内容 {sprite.content_size[0]}x{sprite.content_size[1]}，"
+                         f"带阴影 {width}x{height}，位置 ({sprite.position[0]}, {sprite.position[1]})")
+        return '\n'.join(lines)
+
+
+def canvas_size() -> Tuple[int, int]:
+    """
+    拼图画布尺寸（按 OUTPUT_RATIO 计算）
+    """
+    return (int(CANVAS_HEIGHT * (OUTPUT_RATIO[0] / OUTPUT_RATIO[1])), CANVAS_HEIGHT)
+
+
+def plan_row(output: str, names: Sequence[str], content_size: Tuple[int, int]) -> LayoutPlan:
+    """
+    规划水平排列、尺寸相同的若干张图片（Mobile 拼图）
+
+    总宽度（含阴影和间距）超出画布时，按比例缩小内容尺寸，使其刚好放入画布
+
+    Args:
+        output: 输出文件名
+        names: 图片名称（从左到右）
+        content_size: 单张图片的目标内容尺寸
+
+    Returns:
+        布局
+    """
+    canvas = canvas_size()
+    margin = shadow_margin(SHADOW_OFFSET, SHADOW_BLUR)
+    count = len(names)
+    fixed = margin * 2 * count + SPACING * (count - 1)
+
+    scale = 1.0
+    if content_size[0] * count + fixed > canvas[0]:
+        scale = (canvas[0] - fixed) / (content_size[0] * count)
+        content_size = (int(content_size[0] * scale), int(content_size[1] * scale))
+
+    sprite_w, sprite_h = content_size[0] + margin * 2, content_size[1] + margin * 2
+    total_width = sprite_w * count + SPACING * (count - 1)
+    x = (canvas[0] - total_width) // 2
+    y = (canvas[1] - sprite_h) // 2
+
+    sprites = []
+    for name in names:
+        sprites.append(SpritePlan(name, content_size, (x, y)))
+        x += sprite_w + SPACING
+    return LayoutPlan(output, canvas, tuple(sprites), scale)
+
+
+def plan_column(
+    output: str,
+    sources: Sequence[Tuple[str, Tuple[int, int]]],
+    target_ratio: float,
+    max_content_size: Tuple[int, int],
+    ratio_box: Tuple[int, int]
+) -> LayoutPlan:
+    """
+    规划垂直排列的若干张图片（PC、Pad 拼图）
+
+    每张图片按目标比例居中裁剪（尺寸按 ratio_fit_size 在 ratio_box 内取整）后保持比例放入 max_content_size；
+    总高度（含阴影和间距）超出画布时，按比例缩小 max_content_size，使其刚好放入画布
+
+    Args:
+        output: 输出文件名
+        sources: (图片名称, 原图尺寸) 列表（从上到下），只使用尺寸的比例
+        target_ratio: 目标宽高比
+        max_content_size: 单张图片内容的最大尺寸
+        ratio_box: 按目标比例裁剪时的中间尺寸上限
+
+    Returns:
+        布局
+    """
+    canvas = canvas_size()
+    margin = shadow_margin(SHADOW_OFFSET, SHADOW_BLUR)
+    count = len(sources)
+    fixed = margin * 2 * count + SPACING * (count - 1)
+
+    def fit_all(box: Tuple[int, int]) -> List[Tuple[int, int]]:
+        sizes = []
+        for _, size in sources:
+            sizes.append(fit_size(ratio_fit_size(size, target_ratio, ratio_box), box))
+        return sizes
+
+    scale = 1.0
+    content_sizes = fit_all(max_content_size)
+    content_height = sum(height for _, height in content_sizes)
+    if content_height + fixed > canvas[1]:
+        scale = (canvas[1] - fixed) / content_height
+        content_sizes = fit_all((int(max_content_size[0] * scale), int(max_content_size[1] * scale)))
+
+    total_height = sum(height + margin * 2 for _, height in content_sizes) + SPACING * (count - 1)
+    max_width = max(width for width, _ in content_sizes) + margin * 2
+    x_offset = (canvas[0] - max_width) // 2
+    y = (canvas[1] - total_height) // 2
+
+    sprites = []
+    for (name, _), (width, height) in zip(sources, content_sizes):
+        x = x_offset + (max_width - (width + margin * 2)) // 2
+        sprites.append(SpritePlan(name, (width, height), (x, y)))
+        y += height + margin * 2 + SPACING
+    return LayoutPlan(output, canvas, tuple(sprites), scale)
+
+
+def plan_mobile_puzzle(output: str, desktop_name: str = 'desktop') -> LayoutPlan:
+    """
+    Mobile 拼图布局：锁屏和桌面两张 9:19 图片水平排列，内容高度占画布的 70%
+
+    Args:
+        output: 输出文件名
+        desktop_name: 桌面图片的名称
+
+    Returns:
+        布局
+    """
+    return plan_row(output, ['lock', desktop_name], MOBILE_SPRITE_BOX)
+
+
+def plan_pc_puzzle(pc_size: Tuple[int, int], desktop_size: Tuple[int, int]) -> LayoutPlan:
+    """
+    PC 拼图布局：pc.png 和 pc-desktop-mac.png 两张 16:9 图片垂直排列，宽度不超过 80%，高度不超过 40%
+
+    Args:
+        pc_size: pc.png 尺寸
+        desktop_size: pc-desktop-mac.png 尺寸
+
+    Returns:
+        布局
+    """
+    return plan_column('pc-combined.jpg', [('pc', pc_size), ('desktop', desktop_size)], PC_RATIO, PC_SPRITE_BOX, PC_RATIO_BOX)
+
+
+def plan_pad_puzzle(lock_size: Tuple[int, int], desktop_size: Tuple[int, int]) -> LayoutPlan:
+    """
+    Pad 拼图布局：锁屏和桌面两张 4:3 图片垂直排列，宽度不超过 70%，高度不超过 40%
+
+    Args:
+        lock_size: pad-lock 图片尺寸
+        desktop_size: pad-desktop.png 尺寸
+
+    Returns:
+        布局
+    """
+    return plan_column('pad-combined.jpg', [('lock', lock_size), ('desktop', desktop_size)], PAD_RATIO, PAD_SPRITE_BOX, PAD_RATIO_BOX)
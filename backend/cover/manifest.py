@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建清单模块
+在输出目录中记录每张拼图的输入文件哈希和参数，重新运行时只重建输入发生变化的拼图；
+输出文件先写入临时文件再重命名，中途崩溃不会留下不完整的文件
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 清单文件名（位于输出目录 intr 下）
+MANIFEST_NAME = '.manifest.json'
+
+# 清单格式版本，输出的生成方式发生不兼容的变化时递增，使旧清单全部失效
+# 版本 2：中间图片不再作为输入，重建时总是由原图重新生成（版本 1 的拼图可能使用了由旧输入生成的中间图片）
+MANIFEST_VERSION = 2
+
+# 计算文件哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 文件哈希缓存，键为 (路径, 修改时间, 文件大小)；覆盖图片等公共文件在每个进程中只计算一次
+_file_digests: Dict[Tuple[Path, int, int], str] = {}
+_digest_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class OutputSpec:
+    """
+    一张拼图的输出文件和依赖的输入
+
+    Attributes:
+        output: 输出文件名（不含扩展名，实际扩展名由编码结果决定）
+        images: 依赖的工作目录图片（基础文件名，不包括每次重建都重新生成的中间图片）
+        assets: 依赖的覆盖图片等公共文件
+        uses_blur: 是否受模糊模式影响
+        chain: 所属处理链（mobile / pc / pad）
+    """
+    output: str
+    images: Tuple[str, ...]
+    assets: Tuple[Path, ...] = ()
+    uses_blur: bool = False
+    chain: str = ''
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """
+    原子写入文件：先写入同目录下的临时文件，再重命名为目标文件
+
+    Args:
+        path: 目标文件路径
+        data: 文件内容
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def file_digest(path: Path) -> str:
+    """
+    计算文件内容的 SHA-256（按修改时间和大小缓存）
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        十六进制哈希值
+    """
+    stat = path.stat()
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _digest_lock:
+        digest = _file_digests.get(key)
+    if digest is not None:
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digest_lock:
+        _file_digests[key] = digest
+    return digest
+
+
+def build_key(inputs: Dict[str, Optional[str]], params: Dict[str, object]) -> str:
+    """
+    由输入文件哈希和参数计算构建键，任意一项变化都会得到不同的键
+
+    Args:
+        inputs: {输入名称: 文件哈希}，文件不存在时为 None
+        params: 影响输出的参数（需要可以序列化为 JSON）
+
+    Returns:
+        构建键
+    """
+    payload = json.dumps({'version': MANIFEST_VERSION, 'inputs': inputs, 'params': params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """
+    单个输出目录的构建清单
+
+    以阶段名称为键记录构建键、生成的文件以及当时的输入和参数（用于说明重建原因）。
+    每个拼图完成后立即保存，中途崩溃时已完成的拼图不需要重建，未完成的拼图没有记录，下次会重建。
+    多个阶段线程可以同时调用 record。
+    """
+
+    def __init__(self, output_dir: Path, entries: Optional[Dict[str, dict]] = None):
+        """
+        Args:
+            output_dir: 输出目录
+            entries: 已有的清单记录
+        """
+        self.output_dir = output_dir
+        self.path = output_dir / MANIFEST_NAME
+        self._entries: Dict[str, dict] = entries or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_dir: Path) -> 'BuildManifest':
+        """
+        读取输出目录中的清单，不存在、无法解析或版本不一致时返回空清单
+
+        Args:
+            output_dir: 输出目录
+
+        Returns:
+            构建清单
+        """
+        path = output_dir / MANIFEST_NAME
+        try:
+            data = json.loads(path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return cls(output_dir)
+        except (OSError, ValueError) as e:
+            logger.warning(f"  构建清单无法读取，全部重建: {e}")
+            return cls(output_dir)
+
+        if data.get('version') != MANIFEST_VERSION:
+            return cls(output_dir)
+        return cls(output_dir, data.get('outputs', {}))
+
+    def has_record(self, name: str) -> bool:
+        """
+        检查是否有该阶段的构建记录
+
+        Args:
+            name: 阶段名称
+
+        Returns:
+            是否有记录
+        """
+        with self._lock:
+            return name in self._entries
+
+    def is_fresh(self, name: str, key: str) -> bool:
+        """
+        检查拼图是否为最新：构建键一致且记录的文件都存在
+
+        Args:
+            name: 阶段名称
+            key: 本次的构建键
+
+        Returns:
+            是否为最新
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None or entry.get('key') != key:
+            return False
+        return all((self.output_dir / file).exists() for file in entry.get('files', []))
+
+    def changed_inputs(self, name: str, inputs: Dict[str, Optional[str]], params: Dict[str, object]) -> List[str]:
+        """
+        列出与上次构建相比发生变化的输入和参数名称
+
+        Args:
+            name: 阶段名称
+            inputs: 本次的输入文件哈希
+            params: 本次的参数
+
+        Returns:
+            发生变化的名称列表；没有上次记录时为空
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            return []
+        old = {**entry.get('inputs', {}), **entry.get('params', {})}
+        new = {**inputs, **params}
+        return sorted(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+
+    def record(
+        self,
+        name: str,
+        key: str,
+        files: List[str],
+        inputs: Dict[str, Optional[str]],
+        params: Dict[str, object]
+    ) -> None:
+        """
+        记录一次成功的构建并立即保存清单
+
+        Args:
+            name: 阶段名称
+            key: 构建键
+            files: 生成的文件名（相对于输出目录）
+            inputs: 输入文件哈希
+            params: 参数
+        """
+        with self._lock:
+            self._entries[name] = {'key': key, 'files': sorted(files), 'inputs': inputs, 'params': params}
+            data = json.dumps({'version': MANIFEST_VERSION, 'outputs': self._entries},
+                              indent=2, sort_keys=True, ensure_ascii=False)
+            atomic_write_bytes(self.path, data.encode('utf-8'))
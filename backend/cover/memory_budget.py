@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存预算模块
+只读取图片文件头（尺寸和颜色模式）估算处理一个目录时的内存峰值，并按 --memory-budget 控制同时处理的目录：
+已接纳目录的预估之和加上新目录的预估不超过预算时才开始处理，避免多个目录同时处理时内存不足被系统终止
+
+估算模型（字节）：
+- 输入图片：按布局需要的解码分辨率计算，整个目录处理期间保留在目录图片缓存中
+- 中间图片：prepare_* 生成的图片（mobile-desktop.png 等，Pillow 中 RGB 和 RGBA 每像素都占 4 字节），保留到目录处理结束
+- 覆盖图：按中间图片尺寸缩放后的 RGBA 覆盖图，保留在进程级缓存中
+- 阶段临时内存：prepare_* 为中间图片的若干倍（磨玻璃阶段更多），create_* 为画布的若干倍；
+  按单个目录内并行执行的线程数，取临时内存最大的若干个阶段之和
+系数按 1290x2796 手机、2880x1620 PC、2048x1536 平板截图实测的常驻内存增长标定，整体偏保守。
+估算包括目录中所有拼图（不考虑构建清单中输入未变化而跳过的拼图）。
+"""
+
+import io
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from PIL import Image
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .api import CHAINS, DEFAULT_STAGE_THREADS
+    from .image_cache import find_image_file, reduction_factor
+    from .layout import MOBILE_RATIO, PAD_RATIO, PC_RATIO, canvas_size
+    from .utils import MOBILE_SPRITE_BOX, PAD_SPRITE_BOX, PC_SPRITE_BOX, ratio_corrected_size
+except ImportError:
+    from api import CHAINS, DEFAULT_STAGE_THREADS
+    from image_cache import find_image_file, reduction_factor
+    from layout import MOBILE_RATIO, PAD_RATIO, PC_RATIO, canvas_size
+    from utils import MOBILE_SPRITE_BOX, PAD_SPRITE_BOX, PC_SPRITE_BOX, ratio_corrected_size
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# 工作进程初始化后（导入模块、加载覆盖图）的常驻内存，按每个工作进程计入预算
+WORKER_BASELINE_BYTES = 128 * MB
+
+# prepare_* 阶段的临时内存（缩放、转换为 RGBA、叠加覆盖图）相对于中间图片大小的倍数
+PREPARE_FACTOR = 5
+# 带磨玻璃模糊的 prepare_* 阶段（模糊需要额外的副本）
+BLUR_PREPARE_FACTOR = 6
+# create_* 阶段的临时内存（背景、阴影图层、编码）相对于画布大小的倍数
+CREATE_FACTOR = 3
+
+# 放不下的目录为自己保留预算的时间（秒）：期间没有重试（请求已放弃、目录已删除）且没有目录完成时取消预留，
+# 避免一直占着预算；--watch 按轮询间隔延长
+RESERVATION_HOLD_SECONDS = 10
+
+# 内存大小的单位
+SIZE_UNITS = {'': MB, 'K': 1024, 'M': MB, 'G': 1024 * MB}
+
+
+def parse_size(value: str) -> int:
+    """
+    解析内存大小，如 512M、4G、1.5G，不带单位时按 MB 计算
+
+    Args:
+        value: 内存大小
+
+    Returns:
+        字节数
+
+    Raises:
+        ValueError: 格式不正确或不大于 0
+    """
+    text = value.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    unit = text[-1:] if text[-1:] in ('K', 'M', 'G') else ''
+    number = text[:len(text) - len(unit)]
+    try:
+        size = int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"无效的内存大小: {value}（如 512M、4G）")
+    if size <= 0:
+        raise ValueError(f"内存大小必须大于 0: {value}")
+    return size
+
+
+@dataclass
+class MemoryEstimate:
+    """
+    单个目录的内存峰值预估
+
+    Attributes:
+        work_dir: 工作目录
+        inputs: 解码后的输入图片
+        intermediates: 中间图片
+        covers: 缩放后的覆盖图
+        working: 并行执行阶段的临时内存
+        stages: {阶段名称: 临时内存}
+    """
+    work_dir: Path
+    inputs: int = 0
+    intermediates: int = 0
+    covers: int = 0
+    working: int = 0
+    stages: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return self.inputs + self.intermediates + self.covers + self.working
+
+    @property
+    def total_mb(self) -> float:
+        return round(self.total / MB, 1)
+
+    def describe(self) -> str:
+        """
+        生成可读的预估说明
+        """
+        return (f"预估内存峰值 {self.total / MB:.0f}MB（输入 {self.inputs / MB:.0f}MB，中间图片 {self.intermediates / MB:.0f}MB，"
+                f"覆盖图 {self.covers / MB:.0f}MB，并行阶段 {self.working / MB:.0f}MB）")
+
+
+def decoded_input(
+    work_dir: Path,
+    base_name: str,
+    min_size: Tuple[int, int],
+    uploads: Optional[Mapping[str, bytes]] = None
+) -> Optional[Tuple[Tuple[int, int], int]]:
+    """
+    读取输入图片的文件头，计算按布局需要解码后的尺寸和字节数（与 decode_image 的降低分辨率规则一致）
+
+    Args:
+        work_dir: 工作目录
+        base_name: 基础文件名
+        min_size: 布局需要的最小尺寸
+        uploads: 内存中的输入图片 {基础文件名: 编码后的字节}，提供时不读取 work_dir
+
+    Returns:
+        (解码尺寸, 字节数)，图片不存在时返回 None
+    """
+    if uploads is not None:
+        source = io.BytesIO(uploads[base_name]) if base_name in uploads else None
+    else:
+        source = find_image_file(work_dir, base_name)
+    if source is None:
+        return None
+    with Image.open(source) as image:
+        size, bands = image.size, Image.getmodebands(image.mode)
+    factor = reduction_factor(size, min_size)
+    size = (size[0] // factor, size[1] // factor)
+    return size, size[0] * size[1] * bands
+
+
+def rgba_bytes(size: Tuple[int, int]) -> int:
+    return size[0] * size[1] * 4
+
+
+def estimate_directory_memory(
+    work_dir: Path,
+    chains: Optional[List[str]] = None,
+    threads: int = DEFAULT_STAGE_THREADS,
+    uploads: Optional[Mapping[str, bytes]] = None
+) -> MemoryEstimate:
+    """
+    估算处理一个目录的内存峰值（只读取图片文件头）
+
+    Args:
+        work_dir: 工作目录（uploads 提供时只用于日志中的名称）
+        chains: 处理链，默认全部
+        threads: 单个目录内并行执行阶段的线程数
+        uploads: 内存中的输入图片 {基础文件名: 编码后的字节}（渲染服务上传的图片）
+
+    Returns:
+        内存预估
+    """
+    chains = chains or CHAINS
+    estimate = MemoryEstimate(work_dir)
+    covers = {}
+    canvas = rgba_bytes(canvas_size())
+
+    def add_prepare(stage: str, cover: str, size: Tuple[int, int], count: int = 1, factor: int = PREPARE_FACTOR) -> None:
+        nbytes = rgba_bytes(size) * count
+        estimate.intermediates += nbytes
+        estimate.stages[stage] = nbytes * factor
+        covers[(cover, size)] = nbytes
+
+    if 'mobile' in chains:
+        for name, prepare_stages in (('mobile', ('prepare_mobile_desktop', 'prepare_mobile_desktop_2')),
+                                     ('mobile-2', ('prepare_mobile_desktop_3',))):
+            decoded = decoded_input(work_dir, name, MOBILE_SPRITE_BOX, uploads)
+            if decoded is None:
+                continue
+            estimate.inputs += decoded[1]
+            size = ratio_corrected_size(decoded[0], MOBILE_RATIO)
+            for stage in prepare_stages:
+                factor = PREPARE_FACTOR if stage == 'prepare_mobile_desktop' else BLUR_PREPARE_FACTOR
+                add_prepare(stage, 'mobile', size, factor=factor)
+        lock = decoded_input(work_dir, 'mobile-lock', MOBILE_SPRITE_BOX, uploads)
+        if lock is not None:
+            estimate.inputs += lock[1]
+        for stage in ('create_mobile_puzzle', 'create_mobile_puzzle_2', 'create_mobile_puzzle_3'):
+            if stage != 'create_mobile_puzzle_3' or 'prepare_mobile_desktop_3' in estimate.stages:
+                estimate.stages[stage] = canvas * CREATE_FACTOR
+
+    if 'pc' in chains:
+        decoded = decoded_input(work_dir, 'pc', PC_SPRITE_BOX, uploads)
+        if decoded is not None:
+            estimate.inputs += decoded[1]
+            add_prepare('prepare_pc_desktop_mac', 'pc', ratio_corrected_size(decoded[0], PC_RATIO))
+            estimate.stages['create_pc_puzzle'] = canvas * CREATE_FACTOR
+
+    if 'pad' in chains:
+        decoded = decoded_input(work_dir, 'pad', PAD_SPRITE_BOX, uploads)
+        if decoded is not None:
+            estimate.inputs += decoded[1]
+            # pad-desktop.png 和 pad-lock.png 尺寸相同，分别使用两张覆盖图
+            add_prepare('prepare_pad_images', 'pad', ratio_corrected_size(decoded[0], PAD_RATIO), count=2)
+            estimate.stages['create_pad_puzzle'] = canvas * CREATE_FACTOR
+
+    estimate.covers = sum(covers.values())
+    estimate.working = sum(sorted(estimate.stages.values(), reverse=True)[:max(1, threads)])
+    return estimate
+
+
+class MemoryBudget:
+    """
+    内存预算：已接纳目录的预估之和加上工作进程的基线不超过预算
+
+    单个目录的预估超出整个可用预算时，只在没有其他目录处理时接纳（单独处理，避免永远无法处理）。
+    第一个放不下的目录为自己保留预估的内存：之后较小的目录只能使用保留之外的预算，不能一直插队，
+    已接纳的目录处理完成后它（或至少同样大的目录）重试时即可接纳；超出整个预算的目录等正在处理的目录全部完成。
+    保留的目录超过 hold 秒没有重试（期间也没有目录完成）时取消保留。
+    线程安全（渲染服务在多个请求线程中使用）。
+    """
+
+    def __init__(self, budget: int, workers: int = 1, hold: float = RESERVATION_HOLD_SECONDS):
+        """
+        Args:
+            budget: 内存预算（字节），包括所有工作进程
+            workers: 工作进程数量
+            hold: 放不下的目录保留预算的秒数（需要大于它的重试间隔）
+
+        Raises:
+            ValueError: 预算不足以容纳工作进程的基线
+        """
+        self.budget = budget
+        self.available = budget - workers * WORKER_BASELINE_BYTES
+        if self.available <= 0:
+            raise ValueError(f"内存预算 {budget / MB:.0f}MB 不足以容纳 {workers} 个工作进程的基线"
+                             f"（每个 {WORKER_BASELINE_BYTES / MB:.0f}MB）")
+        self.used = 0
+        self.in_flight = 0
+        self.hold = hold
+        self.reserved = 0
+        self._reserved_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, nbytes: int) -> bool:
+        """
+        尝试接纳一个目录
+
+        Args:
+            nbytes: 目录的内存预估
+
+        Returns:
+            是否接纳（接纳后处理完成时需要调用 release）
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.reserved and now > self._reserved_until:
+                logger.info(f"等待中的目录（{self.reserved / MB:.0f}MB）{self.hold:g} 秒未重试，取消预留")
+                self.reserved = 0
+
+            waiting = self.reserved and nbytes >= self.reserved
+            if self.reserved and not waiting:
+                # 较小的目录只能使用预留之外的预算
+                fits = self.used + nbytes + self.reserved <= self.available
+            else:
+                fits = not self.in_flight or self.used + nbytes <= self.available
+            if not fits:
+                if not self.reserved:
+                    self.reserved = nbytes
+                if nbytes >= self.reserved:
+                    self._reserved_until = now + self.hold
+                return False
+
+            if waiting:
+                self.reserved = 0
+            self.used += nbytes
+            self.in_flight += 1
+            return True
+
+    def admit(self, estimate: MemoryEstimate) -> bool:
+        """
+        尝试接纳一个目录，接纳时输出预估和当前占用
+
+        Args:
+            estimate: 目录的内存预估
+
+        Returns:
+            是否接纳（接纳后处理完成时需要调用 release(estimate.total)）
+        """
+        if not self.try_acquire(estimate.total):
+            return False
+        if estimate.total > self.available:
+            logger.warning(f"{estimate.work_dir.name}: {estimate.describe()}，超出可用内存预算 "
+                           f"{self.available / MB:.0f}MB，单独处理")
+        else:
+            logger.info(f"{estimate.work_dir.name}: {estimate.describe()}，预算占用 {self.usage()}")
+        return True
+
+    def release(self, nbytes: int) -> None:
+        """
+        目录处理完成，释放预估占用的预算
+        """
+        with self._lock:
+            self.used -= nbytes
+            self.in_flight -= 1
+            if self.reserved:
+                # 给等待中的目录留出重试的时间
+                self._reserved_until = time.monotonic() + self.hold
+
+    def usage(self) -> str:
+        """
+        当前占用说明，如 1086/3584MB，有目录等待时附带预留，如 1086/3584MB（预留 2900MB）
+        """
+        with self._lock:
+            usage = f"{self.used / MB:.0f}/{self.available / MB:.0f}MB"
+            if self.reserved:
+                usage += f"（预留 {self.reserved / MB:.0f}MB）"
+            return usage
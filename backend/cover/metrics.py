@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标模块
+按 Prometheus 文本格式导出处理指标：处理的目录数、每个阶段的耗时和失败次数、输出文件大小、编码尝试次数和 JPEG 质量等，
+按处理链（mobile / pc / pad，即设备类型）区分，便于在看板上观察质量和文件大小的变化并设置告警
+
+指标由每个目录的处理统计（DirectoryStats.to_dict() 的结果）更新，可以写入 node_exporter 的 textfile 目录，
+也可以在常驻模式下通过 HTTP 的 /metrics 接口抓取。不依赖 prometheus_client。
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .manifest import atomic_write_bytes
+except ImportError:
+    from manifest import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 各直方图的桶上限
+DIRECTORY_SECONDS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+STAGE_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+OUTPUT_BYTES_BUCKETS = tuple(kb * 1024 for kb in (100, 200, 300, 400, 450, 500, 750, 1024, 2048, 4096))
+JPEG_QUALITY_BUCKETS = (50, 60, 70, 75, 80, 85, 90, 95, 100)
+ENCODE_ATTEMPTS_BUCKETS = (1, 2, 3, 4, 5, 6, 8)
+PEAK_RSS_BUCKETS = tuple(mb * MB for mb in (128, 256, 384, 512, 768, 1024, 1536, 2048, 4096))
+
+
+def escape_label_value(value: str) -> str:
+    """
+    转义标签值中的反斜杠、双引号和换行
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    """
+    格式化样本值（整数不带小数点）
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(round(float(value), 6))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """
+    格式化标签，如 {chain="pc",format="jpeg"}
+    """
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(str(value))}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """
+    一个指标（counter / gauge / histogram）及其所有标签组合的样本
+
+    线程安全：所有更新都在同一把锁中完成。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Optional[Sequence[float]] = None
+    ):
+        """
+        Args:
+            name: 指标名称
+            kind: 指标类型（counter、gauge 或 histogram）
+            help_text: 指标说明
+            labels: 标签名称
+            buckets: 直方图的桶上限（升序，不包括 +Inf）
+        """
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets or ())
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"指标 {self.name} 的标签应为 {', '.join(self.labels) or '（无）'}，实际为 {', '.join(labels) or '（无）'}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        计数器增加（counter / gauge）
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        设置当前值（gauge）
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        记录一次观测值（histogram）
+        """
+        key = self._key(labels)
+        with self._lock:
+            # [各桶的计数（非累计）, 总和, 次数]
+            sample = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[0][i] += 1
+                    break
+            sample[1] += value
+            sample[2] += 1
+
+    def render(self) -> List[str]:
+        """
+        生成 Prometheus 文本格式的各行
+
+        Returns:
+            HELP、TYPE 和所有样本行
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            if self.kind == 'histogram':
+                values = {key: (list(sample[0]), sample[1], sample[2]) for key, sample in self._values.items()}
+            else:
+                values = dict(self._values)
+        for key in sorted(values):
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(values[key])}")
+                continue
+            counts, total, count = values[key]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, ('le', format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class PuzzleMetrics:
+    """
+    拼图处理的指标集合
+
+    每处理完一个目录调用 observe_directory 更新；提供 textfile 时每次更新后都原子重写该文件，
+    批量处理进行中也能看到进度。
+    """
+
+    def __init__(self, textfile: Optional[Path] = None):
+        """
+        Args:
+            textfile: Prometheus textfile 输出路径（如 node_exporter 的 textfile 目录下的 puzzle.prom）
+        """
+        self.textfile = textfile
+        self._write_lock = threading.Lock()
+        self.directories = Metric(
+            'puzzle_directories_total', 'counter',
+            '处理的目录数（result 为 success、unchanged 或 failure）', ('result',))
+        self.directory_seconds = Metric(
+            'puzzle_directory_duration_seconds', 'histogram',
+            '单个目录的处理耗时（秒）', buckets=DIRECTORY_SECONDS_BUCKETS)
+        self.directory_peak_rss = Metric(
+            'puzzle_directory_peak_rss_bytes', 'histogram',
+            '处理单个目录时进程的内存峰值（字节）', buckets=PEAK_RSS_BUCKETS)
+        self.stage_seconds = Metric(
+            'puzzle_stage_duration_seconds', 'histogram',
+            '每个处理阶段的耗时（秒）', ('chain', 'stage'), STAGE_SECONDS_BUCKETS)
+        self.stage_failures = Metric(
+            'puzzle_stage_failures_total', 'counter',
+            '处理阶段失败次数', ('chain', 'stage'))
+        self.outputs = Metric(
+            'puzzle_outputs_total', 'counter',
+            '生成的拼图数', ('chain', 'format'))
+        self.output_bytes = Metric(
+            'puzzle_output_bytes_total', 'counter',
+            '写入的拼图总字节数', ('chain',))
+        self.output_size = Metric(
+            'puzzle_output_size_bytes', 'histogram',
+            '单张拼图的文件大小（字节）', ('chain',), OUTPUT_BYTES_BUCKETS)
+        self.encode_attempts = Metric(
+            'puzzle_encode_attempts', 'histogram',
+            '生成单张拼图的编码尝试次数（JPEG 按质量二分搜索时大于 1）', ('chain',), ENCODE_ATTEMPTS_BUCKETS)
+        self.jpeg_quality = Metric(
+            'puzzle_jpeg_quality', 'histogram',
+            'JPEG 拼图最终使用的质量', ('chain',), JPEG_QUALITY_BUCKETS)
+        self.last_directory = Metric(
+            'puzzle_last_directory_timestamp_seconds', 'gauge',
+            '最近一个目录处理完成的时间（Unix 时间戳）')
+        self.requests = Metric(
+            'puzzle_render_requests_total', 'counter',
+            '渲染服务的 /render 请求数（按 HTTP 状态码）', ('code',))
+
+    @property
+    def all_metrics(self) -> List[Metric]:
+        return [self.directories, self.directory_seconds, self.directory_peak_rss, self.stage_seconds,
+                self.stage_failures, self.outputs, self.output_bytes, self.output_size, self.encode_attempts,
+                self.jpeg_quality, self.last_directory, self.requests]
+
+    def observe_directory(self, record: Optional[dict]) -> None:
+        """
+        根据一个目录的处理统计更新指标
+
+        Args:
+            record: DirectoryStats.to_dict() 的结果（工作进程崩溃时为 DirectoryStats.crashed() 的失败记录），为 None 时忽略
+        """
+        if record is None:
+            return
+        if not record['success']:
+            result = 'failure'
+        elif not record['stages']:
+            result = 'unchanged'
+        else:
+            result = 'success'
+        self.directories.inc(result=result)
+        self.directory_seconds.observe(record['wall_ms'] / 1000)
+        if record.get('peak_rss_mb') is not None:
+            self.directory_peak_rss.observe(record['peak_rss_mb'] * MB)
+
+        for stage in record['stages']:
+            labels = {'chain': stage.get('chain', ''), 'stage': stage['name']}
+            self.stage_seconds.observe(stage['wall_ms'] / 1000, **labels)
+            if not stage['ok']:
+                self.stage_failures.inc(**labels)
+
+        for output in record.get('outputs', ()):
+            chain = output['chain']
+            self.outputs.inc(chain=chain, format=output['format'].lower())
+            self.output_bytes.inc(output['bytes'], chain=chain)
+            self.output_size.observe(output['bytes'], chain=chain)
+            self.encode_attempts.observe(output['encodes'], chain=chain)
+            if output['quality'] is not None:
+                self.jpeg_quality.observe(output['quality'], chain=chain)
+
+        self.last_directory.set(time.time())
+        if self.textfile is not None:
+            self.write_textfile()
+
+    def observe_request(self, code: int) -> None:
+        """
+        记录一次渲染请求的响应状态码
+        """
+        self.requests.inc(code=str(int(code)))
+
+    def render(self) -> bytes:
+        """
+        生成 Prometheus 文本格式
+
+        Returns:
+            UTF-8 编码的文本
+        """
+        lines = []
+        for metric in self.all_metrics:
+            lines.extend(metric.render())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def write_textfile(self, path: Optional[Path] = None) -> None:
+        """
+        原子写入 textfile（node_exporter 不会读到写了一半的文件）
+
+        Args:
+            path: 输出路径，默认为 self.textfile
+        """
+        path = path or self.textfile
+        with self._write_lock:
+            try:
+                atomic_write_bytes(path, self.render())
+            except OSError as e:
+                logger.warning(f"写入指标文件失败: {path}: {e}")
+
+
+def start_metrics_server(metrics: PuzzleMetrics, host: str, port: int):
+    """
+    在后台线程中启动只提供 GET /metrics 的 HTTP 服务（用于 --watch 等常驻模式）
+
+    Args:
+        metrics: 指标集合
+        host: 监听地址
+        port: 监听端口（0 为随机端口）
+
+    Returns:
+        HTTP 服务对象，调用 shutdown() 和 server_close() 停止
+    """
+    # 按需导入，不影响普通运行的启动耗时
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            send_metrics(self, metrics)
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(f"{self.address_string()} {format % args}")
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"指标接口已启动: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def send_metrics(handler, metrics: PuzzleMetrics) -> None:
+    """
+    在 HTTP 请求处理中返回指标
+
+    Args:
+        handler: BaseHTTPRequestHandler
+        metrics: 指标集合
+    """
+    data = metrics.render()
+    handler.send_response(200)
+    handler.send_header('Content-Type', CONTENT_TYPE)
+    handler.send_header('Content-Length', str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
@@ -14,51 +14,50 @@ from PIL import Image
 try:
     from .utils import (
         PC_MAC_COVER,
-        OUTPUT_RATIO,
-        SPACING,
-        SHADOW_OFFSET,
-        SHADOW_BLUR,
+        PC_SPRITE_BOX,
         overlay_images,
-        add_shadow_and_rounded_corners,
-        resize_to_fit_ratio,
+        paste_with_shadow,
+        crop_resize,
         create_background,
-        get_image_file,
-        save_optimized_jpeg
+        get_cover_overlay,
+        ratio_corrected_size
     )
+    from .context import PuzzleContext
+    from .layout import PC_RATIO, plan_pc_puzzle
 except ImportError:
     from utils import (
         PC_MAC_COVER,
-        OUTPUT_RATIO,
-        SPACING,
-        SHADOW_OFFSET,
-        SHADOW_BLUR,
+        PC_SPRITE_BOX,
         overlay_images,
-        add_shadow_and_rounded_corners,
-        resize_to_fit_ratio,
+        paste_with_shadow,
+        crop_resize,
         create_background,
-        get_image_file,
-        save_optimized_jpeg
+        get_cover_overlay,
+        ratio_corrected_size
     )
+    from context import PuzzleContext
+    from layout import PC_RATIO, plan_pc_puzzle
 
 logger = logging.getLogger(__name__)
 
 
-def prepare_pc_desktop_mac(work_dir: Path) -> bool:
+def prepare_pc_desktop_mac(work_dir: Optional[Path], ctx: Optional[PuzzleContext] = None) -> bool:
     """
     准备 PC desktop mac 图片
 
     Args:
         work_dir: 工作目录
+        ctx: 处理上下文（为 None 时从工作目录读取输入，中间图片直接写入工作目录）
 
     Returns:
         是否成功
     """
-    pc_desktop_mac = work_dir / 'pc-desktop-mac.png'
-    if pc_desktop_mac.exists():
+    ctx = ctx or PuzzleContext(work_dir)
+    if ctx.has_intermediate('pc-desktop-mac.png'):
         logger.info(f"  pc-desktop-mac.png 已存在，跳过")
         return True
 
-    pc = get_image_file(work_dir, 'pc')
+    pc = ctx.find_input('pc')
     if not pc:
         logger.info(f"  未找到 pc.png，跳过 pc-desktop-mac.png 生成")
         return True
@@ -68,39 +67,31 @@ def prepare_pc_desktop_mac(work_dir: Path) -> bool:
         return False
 
     try:
-        base_img = Image.open(pc)
-        cover_img = Image.open(PC_MAC_COVER)
+        base_img = ctx.open_input(pc, PC_SPRITE_BOX)
 
-        # 确保两张图片都是 16:9 比例
+        # 确保底图是 16:9 比例
         target_ratio = 16 / 9
-        base_ratio = base_img.width / base_img.height
-        cover_ratio = cover_img.width / cover_img.height
+        base_size = ratio_corrected_size(base_img.size, target_ratio)
+        if base_size != base_img.size:
+            base_img = base_img.resize(base_size, Image.Resampling.LANCZOS)
 
-        # 调整底图尺寸
-        if abs(base_ratio - target_ratio) > 0.01:
-            new_height = base_img.height
-            new_width = int(new_height * target_ratio)
-            base_img = base_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # 调整覆盖图尺寸
-        if abs(cover_ratio - target_ratio) > 0.01:
-            new_height = cover_img.height
-            new_width = int(new_height * target_ratio)
-            cover_img = cover_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # 确保两张图片尺寸一致
-        if base_img.size != cover_img.size:
-            cover_img = cover_img.resize(base_img.size, Image.Resampling.LANCZOS)
+        # 覆盖图调整到底图尺寸（进程内缓存，相同尺寸只处理一次）
+        cover_img = get_cover_overlay(PC_MAC_COVER, base_img.size)
 
         result = overlay_images(base_img, cover_img)
-        result.save(pc_desktop_mac, 'PNG')
+        ctx.put_intermediate('pc-desktop-mac.png', result)
         logger.info(f"  已生成 pc-desktop-mac.png")
         return True
     except Exception as e:
         logger.error(f"  生成 pc-desktop-mac.png 失败: {e}")
         return False
 
-def create_pc_puzzle(work_dir: Path, output_dir: Path, main_color: Optional[str] = None) -> bool:
+def create_pc_puzzle(
+    work_dir: Optional[Path],
+    output_dir: Optional[Path],
+    main_color: Optional[str] = None,
+    ctx: Optional[PuzzleContext] = None
+) -> bool:
     """
     创建 PC 拼图
     要求：
@@ -109,145 +100,51 @@ def create_pc_puzzle(work_dir: Path, output_dir: Path, main_color: Optional[str]
 
     Args:
         work_dir: 工作目录
-        output_dir: 输出目录
+        output_dir: 输出目录（只在 ctx 为 None 时使用，否则写入 ctx.output_dir）
         main_color: 主色调
+        ctx: 处理上下文（为 None 时从工作目录读取输入和中间图片）
 
     Returns:
         是否成功
     """
-    pc_file = get_image_file(work_dir, 'pc')
+    ctx = ctx or PuzzleContext(work_dir, output_dir=output_dir)
+    pc_file = ctx.find_input('pc')
 
     # 如果不存在 pc.png，跳过 PC 壁纸拼接
     if not pc_file:
         logger.info(f"  未找到 pc.png，跳过 PC 壁纸拼接")
         return True
 
-    pc_desktop_mac_file = work_dir / 'pc-desktop-mac.png'
+    pc_desktop_mac_img = ctx.get_intermediate('pc-desktop-mac.png')
 
     # 检查是否有 pc-desktop-mac.png
-    if not pc_desktop_mac_file.exists():
+    if pc_desktop_mac_img is None:
         logger.error(f"  缺少 PC 拼图所需文件（需要 pc-desktop-mac.png）")
         return False
 
     try:
-        # 先确定画布尺寸（1:1 比例）
-        # 使用一个基准高度来计算画布尺寸
-        base_height = 2000
-        canvas_width = int(base_height * (OUTPUT_RATIO[0] / OUTPUT_RATIO[1]))
-        canvas_height = base_height
-
-        # 准备原始图片文件路径和图片对象
-        image_files = []
-        source_img = None
-
         # 使用 pc.png 和 pc-desktop-mac.png 进行拼图
-        # 宽度占80%
-        width_ratio = 0.8
-        
-        if pc_file:
-            image_files.append(('pc', pc_file))
-            if source_img is None:
-                source_img = Image.open(pc_file)
-
-        if pc_desktop_mac_file.exists():
-            image_files.append(('desktop', pc_desktop_mac_file))
-            if source_img is None:
-                source_img = Image.open(pc_desktop_mac_file)
-
-        # 计算单张图片的目标尺寸
-        target_content_width = int(canvas_width * width_ratio)
-        target_content_height = int(canvas_height * 0.4)
-
-        # 目标输入比例是 16:9
-        target_input_ratio = 16 / 9
-
-        if not image_files:
-            return False
-
-        # 处理每张图片的函数
-        def process_image(img_file_path: Path, target_w: int, target_h: int) -> Image.Image:
-            """处理单张图片到目标尺寸"""
-            img = Image.open(img_file_path)
-            # 先调整图片到 16:9 比例
-            img = resize_to_fit_ratio(img, target_input_ratio, (4000, 2000))
-
-            # 计算缩放比例，确保图片能放入目标区域
-            # 按宽度缩放
-            scale_by_width = target_w / img.width
-            scaled_height_by_width = img.height * scale_by_width
+        pc_img = ctx.open_input(pc_file, PC_SPRITE_BOX)
+        source_images = [('pc', pc_img), ('desktop', pc_desktop_mac_img)]
 
-            # 按高度缩放
-            scale_by_height = target_h / img.height
-            scaled_width_by_height = img.width * scale_by_height
+        # 预先规划布局（尺寸和位置），每张图片只缩放和添加阴影一次
+        plan = plan_pc_puzzle(pc_img.size, pc_desktop_mac_img.size)
 
-            # 选择较小的缩放比例，确保图片完全放入目标区域
-            if scaled_height_by_width <= target_h:
-                # 按宽度缩放，高度不会超出
-                final_width = target_w
-                final_height = int(scaled_height_by_width)
-            else:
-                # 按高度缩放，宽度不会超出
-                final_width = int(scaled_width_by_height)
-                final_height = target_h
-
-            # 调整图片尺寸
-            img = img.resize((final_width, final_height), Image.Resampling.LANCZOS)
-
-            # 添加阴影和圆角（这会使图片尺寸变大，因为增加了边距）
-            img = add_shadow_and_rounded_corners(img)
-            return img
-
-        # 第一次处理图片
-        processed_images = []
-        for name, img_file in image_files:
-            img = process_image(img_file, target_content_width, target_content_height)
-            processed_images.append(img)
-
-        # 计算两张图片的总高度（包括阴影边距）和间隔
-        total_content_height = sum(img.height for img in processed_images) + SPACING * (len(processed_images) - 1)
-
-        # 如果总高度超过画布，需要按比例缩小
-        if total_content_height > canvas_height:
-            # 计算缩放比例（基于总高度，包括阴影和间隔）
-            max_available_height = canvas_height
-            spacing_total = SPACING * (len(processed_images) - 1)
-            images_total_height = total_content_height - spacing_total
-            if images_total_height > 0:
-                scale = (max_available_height - spacing_total) / images_total_height
-            else:
-                scale = 1.0
-
-            # 重新处理图片，按比例缩小目标尺寸
-            new_target_content_width = int(target_content_width * scale)
-            new_target_content_height = int(target_content_height * scale)
-
-            processed_images = []
-            for name, img_file in image_files:
-                img = process_image(img_file, new_target_content_width, new_target_content_height)
-                processed_images.append(img)
-
-            total_content_height = sum(img.height for img in processed_images) + SPACING * (len(processed_images) - 1)
         # 创建背景
         # main_color = None: 使用默认背景（back.jpg）
         # main_color = "": 自动提取主色调
         # main_color = "#ffffff": 使用纯色背景
-        bg = create_background((canvas_width, canvas_height), main_color, source_img)
-
-        # 计算居中位置（水平居中，垂直居中）
-        x_offset = (canvas_width - max(img.width for img in processed_images)) // 2
-        y_start = (canvas_height - total_content_height) // 2
+        bg = create_background(plan.canvas_size, main_color, pc_img)
 
-        # 粘贴图片
-        current_y = y_start
-        for img in processed_images:
-            # 水平居中
-            x_pos = x_offset + (max(img.width for img in processed_images) - img.width) // 2
-            bg.paste(img, (x_pos, current_y), img)
-            current_y += img.height + SPACING
+        for name, source in source_images:
+            sprite = plan.sprite(name)
+            # 按 16:9 比例居中裁剪并缩放到目标尺寸（裁剪和缩放在同一次重采样中完成）
+            img = crop_resize(source, PC_RATIO, sprite.content_size)
+            # 添加阴影和圆角，直接绘制到背景上
+            paste_with_shadow(bg, img, sprite.position)
 
         # 保存并优化文件大小（压缩到500KB以内）
-        output_file = output_dir / 'pc-combined.jpg'
-        save_optimized_jpeg(bg, output_file, max_size=500 * 1024)
+        ctx.save_output('pc-combined.jpg', bg, max_size=500 * 1024)
 
         logger.info(f"  已生成 pc-combined.jpg")
         return True
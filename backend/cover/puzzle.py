@@ -8,20 +8,47 @@
 import sys
 import argparse
 import logging
+import logging.handlers
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import replace
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Dict, Iterator, Optional, Tuple, List
 
 # 尝试相对导入，如果失败则使用绝对导入
 try:
-    from .mobile_puzzle import prepare_mobile_desktop, create_mobile_puzzle, prepare_mobile_desktop_2, create_mobile_puzzle_2, prepare_mobile_desktop_3, create_mobile_puzzle_3
-    from .pad_puzzle import prepare_pad_images, create_pad_puzzle
-    from .pc_puzzle import prepare_pc_desktop_mac, create_pc_puzzle
-    from .utils import get_image_file
+    from .api import CHAINS, CHAIN_REQUIRED_FILES, DEFAULT_STAGE_THREADS, build_stages
+    from .utils import BACK_IMAGE, MOBILE_BLOCK_COVER, PAD_BLOCK_COVER, PAD_LOCK_COVER, PC_MAC_COVER, get_image_file, load_cover_assets, warm_cover_overlays, parse_color, ratio_corrected_size, uses_default_background
+    from .scheduler import Stage, run_stages
+    from .context import PuzzleContext
+    from .color_extract import COLOR_EXTRACTORS, DEFAULT_COLOR_EXTRACTOR, get_color_extractor, set_color_extractor
+    from .shadow import shadow_cache_stats
+    from .blur import BLUR_MODES, DEFAULT_BLUR_MODE, get_blur_mode, set_blur_mode
+    from .manifest import BuildManifest, OutputSpec, build_key, file_digest
+    from .watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, DirectoryWatcher
+    from .image_cache import DirectoryImageCache
+    from .instrument import DirectoryStats, RunSummary, profile_directory, release_free_memory
+    from .memory_budget import RESERVATION_HOLD_SECONDS, MemoryBudget, MemoryEstimate, estimate_directory_memory, parse_size
+    from .metrics import PuzzleMetrics, start_metrics_server
+    from .layout import LayoutPlan, PC_RATIO, PAD_RATIO, plan_mobile_puzzle, plan_pc_puzzle, plan_pad_puzzle
 except ImportError:
-    from mobile_puzzle import prepare_mobile_desktop, create_mobile_puzzle, prepare_mobile_desktop_2, create_mobile_puzzle_2, prepare_mobile_desktop_3, create_mobile_puzzle_3
-    from pad_puzzle import prepare_pad_images, create_pad_puzzle
-    from pc_puzzle import prepare_pc_desktop_mac, create_pc_puzzle
-    from utils import get_image_file
+    from api import CHAINS, CHAIN_REQUIRED_FILES, DEFAULT_STAGE_THREADS, build_stages
+    from utils import BACK_IMAGE, MOBILE_BLOCK_COVER, PAD_BLOCK_COVER, PAD_LOCK_COVER, PC_MAC_COVER, get_image_file, load_cover_assets, warm_cover_overlays, parse_color, ratio_corrected_size, uses_default_background
+    from scheduler import Stage, run_stages
+    from context import PuzzleContext
+    from color_extract import COLOR_EXTRACTORS, DEFAULT_COLOR_EXTRACTOR, get_color_extractor, set_color_extractor
+    from shadow import shadow_cache_stats
+    from blur import BLUR_MODES, DEFAULT_BLUR_MODE, get_blur_mode, set_blur_mode
+    from manifest import BuildManifest, OutputSpec, build_key, file_digest
+    from watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, DirectoryWatcher
+    from image_cache import DirectoryImageCache
+    from instrument import DirectoryStats, RunSummary, profile_directory, release_free_memory
+    from memory_budget import RESERVATION_HOLD_SECONDS, MemoryBudget, MemoryEstimate, estimate_directory_memory, parse_size
+    from metrics import PuzzleMetrics, start_metrics_server
+    from layout import LayoutPlan, PC_RATIO, PAD_RATIO, plan_mobile_puzzle, plan_pc_puzzle, plan_pad_puzzle
 
 # 配置日志
 logging.basicConfig(
@@ -29,11 +56,30 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+# 多进程模式下的日志格式（带上工作进程名，便于区分不同目录的输出）
+WORKER_LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(processName)s] %(message)s'
 logger = logging.getLogger(__name__)
 
 # 常量定义
 IMGS_DIR = Path(__file__).parent / 'imgs'
 
+# 每个拼图阶段的输出文件和依赖的输入
+# （中间图片在重建时总是由原图重新生成，不使用磁盘上已存在的文件，因此不是输入）
+OUTPUT_SPECS = {
+    'create_mobile_puzzle': OutputSpec('mobile-combined', ('mobile', 'mobile-lock'),
+                                       (MOBILE_BLOCK_COVER,), chain='mobile'),
+    'create_mobile_puzzle_2': OutputSpec('mobile-combined-2', ('mobile', 'mobile-lock'),
+                                         (MOBILE_BLOCK_COVER,), uses_blur=True, chain='mobile'),
+    'create_mobile_puzzle_3': OutputSpec('mobile-combined-3', ('mobile-2', 'mobile-lock'),
+                                         (MOBILE_BLOCK_COVER,), uses_blur=True, chain='mobile'),
+    'create_pc_puzzle': OutputSpec('pc-combined', ('pc',), (PC_MAC_COVER,), chain='pc'),
+    'create_pad_puzzle': OutputSpec('pad-combined', ('pad', 'pad-lock'),
+                                    (PAD_BLOCK_COVER, PAD_LOCK_COVER), chain='pad')
+}
+
+# 冷启动导入 puzzle 模块的耗时预算（毫秒），超出时 --profile-startup 以非零状态退出
+DEFAULT_STARTUP_BUDGET_MS = 250
+
 # 临时文件列表（在拼图完成后需要清理）
 # 注意：mobile-desktop.png、mobile-desktop-2.png 和 mobile-desktop-3.png 已移除，保留这些文件
 TEMP_FILES = [
@@ -65,22 +111,20 @@ def cleanup_temp_files(work_dir: Path) -> None:
         logger.info(f"  已清理 {cleaned_count} 个临时文件")
 
 
-def check_files_completeness(work_dir: Path) -> Tuple[bool, List[str]]:
+def check_files_completeness(work_dir: Path, chains: Optional[List[str]] = None) -> Tuple[bool, List[str]]:
     """
     检查文件完整性
     
     Args:
         work_dir: 工作目录
+        chains: 需要检查的处理链，默认检查全部
     
     Returns:
         (是否完整, 缺失文件列表)
     """
-    required_files = [
-        'mobile.png',
-        'mobile-lock.png',
-        'pc.png',
-        'pad.png'
-    ]
+    required_files = []
+    for chain in chains or CHAINS:
+        required_files.extend(CHAIN_REQUIRED_FILES[chain])
     
     missing_files = []
     for file in required_files:
@@ -98,51 +142,243 @@ def check_files_completeness(work_dir: Path) -> Tuple[bool, List[str]]:
 
 
 
-def process_directory(work_dir: Path, main_color: Optional[str] = None) -> bool:
+def plan_directory(work_dir: Path, chains: Optional[List[str]] = None) -> List[LayoutPlan]:
+    """
+    只读取图片文件头中的尺寸，规划目录下每张拼图的布局（不解码、不写入任何文件）
+
+    Args:
+        work_dir: 工作目录
+        chains: 需要规划的处理链，默认全部
+
+    Returns:
+        布局列表
+    """
+    images = DirectoryImageCache()
+    chains = chains or CHAINS
+    plans = []
+
+    if 'mobile' in chains:
+        plans.append(plan_mobile_puzzle('mobile-combined.png'))
+        plans.append(plan_mobile_puzzle('mobile-combined-2.jpg'))
+        plans.append(plan_mobile_puzzle('mobile-combined-3.jpg'))
+
+    pc_file = get_image_file(work_dir, 'pc', images)
+    if 'pc' in chains and pc_file:
+        # pc-desktop-mac.png 由 pc.png 调整到 16:9 后生成，布局只与比例有关
+        pc_size = images.source_size(pc_file)
+        plans.append(plan_pc_puzzle(pc_size, ratio_corrected_size(pc_size, PC_RATIO)))
+
+    pad_file = get_image_file(work_dir, 'pad', images)
+    if 'pad' in chains and pad_file:
+        # pad-desktop.png 和 pad-lock.png 由 pad.png 调整到 4:3 后生成
+        desktop_size = ratio_corrected_size(images.source_size(pad_file), PAD_RATIO)
+        lock_size = desktop_size
+        pad_lock_file = get_image_file(work_dir, 'pad-lock', images)
+        if not PAD_LOCK_COVER.exists() and pad_lock_file:
+            lock_size = images.source_size(pad_lock_file)
+        plans.append(plan_pad_puzzle(lock_size, desktop_size))
+
+    return plans
+
+
+def dry_run(subdirs: List[Path], chains: Optional[List[str]] = None, threads: int = DEFAULT_STAGE_THREADS) -> int:
+    """
+    输出每个目录的拼图布局和内存峰值预估（--dry-run）
+
+    Args:
+        subdirs: 图片目录列表
+        chains: 需要规划的处理链，默认全部
+        threads: 单个目录内并行执行阶段的线程数（用于内存预估）
+
+    Returns:
+        文件完整的目录数
+    """
+    complete_count = 0
+    for work_dir in subdirs:
+        is_complete, missing_files = check_files_completeness(work_dir, chains)
+        if not is_complete:
+            print(f"{work_dir.name}: 文件不完整，缺少 {', '.join(missing_files)}")
+            continue
+        complete_count += 1
+        print(f"{work_dir.name}:")
+        for plan in plan_directory(work_dir, chains):
+            print('\n'.join(f"  {line}" for line in plan.describe().splitlines()))
+        print(f"  {estimate_directory_memory(work_dir, chains, threads).describe()}")
+    return complete_count
+
+
+def list_outputs(work_dir: Path, chains: Optional[List[str]] = None) -> List[Path]:
+    """
+    列出目录下已生成的拼图文件
+
+    Args:
+        work_dir: 工作目录
+        chains: 处理链，默认全部
+
+    Returns:
+        拼图文件路径（按 OUTPUT_SPECS 的顺序）
+    """
+    intr_dir = work_dir / 'intr'
+    chains = chains or CHAINS
+    outputs = []
+    for spec in OUTPUT_SPECS.values():
+        if spec.chain in chains:
+            outputs.extend(sorted(intr_dir.glob(f"{spec.output}.*")))
+    return outputs
+
+
+def output_build_inputs(
+    work_dir: Path,
+    spec: OutputSpec,
+    main_color: Optional[str],
+    images: DirectoryImageCache,
+    plans: Dict[str, LayoutPlan]
+) -> Tuple[Dict[str, Optional[str]], Dict[str, object]]:
+    """
+    收集一张拼图的输入文件哈希和参数，用于判断是否需要重建
+
+    Args:
+        work_dir: 工作目录
+        spec: 拼图的输出和输入定义
+        main_color: 主色调
+        images: 目录图片缓存
+        plans: {输出文件名（不含扩展名）: 布局}
+
+    Returns:
+        (输入文件哈希, 参数)
+    """
+    inputs: Dict[str, Optional[str]] = {}
+    for name in spec.images:
+        if name == 'pad-lock' and PAD_LOCK_COVER.exists():
+            # 有锁屏覆盖图时 pad-lock.png 是由 pad.png 生成的中间图片，只在缺少覆盖图时才使用原图目录中的 pad-lock
+            continue
+        path = get_image_file(work_dir, name, images)
+        inputs[name] = file_digest(path) if path else None
+    # 只有使用默认背景时 back.jpg 才是输入（纯色背景和自动提取的主色调不读取它）
+    assets = spec.assets + (BACK_IMAGE,) if uses_default_background(main_color) else spec.assets
+    for asset in assets:
+        inputs[asset.name] = file_digest(asset) if asset.exists() else None
+
+    plan = plans.get(spec.output)
+    params: Dict[str, object] = {
+        'main_color': main_color,
+        'layout': plan.describe() if plan else None
+    }
+    if main_color == '':
+        params['color_extractor'] = get_color_extractor()
+    if spec.uses_blur:
+        params['blur_mode'] = get_blur_mode()
+    return inputs, params
+
+
+def process_directory(
+    work_dir: Path,
+    main_color: Optional[str] = None,
+    only: Optional[List[str]] = None,
+    threads: int = DEFAULT_STAGE_THREADS,
+    keep_intermediates: bool = False,
+    stats: Optional[DirectoryStats] = None,
+    profile_dir: Optional[Path] = None
+) -> bool:
     """
     处理单个目录
     
     Args:
         work_dir: 工作目录
         main_color: 主色调
+        only: 只执行指定的处理链（mobile / pc / pad），默认全部执行
+        threads: 并行执行阶段的线程数
+        keep_intermediates: 是否将中间图片（如 mobile-desktop.png）写入工作目录
+        stats: 收集每个阶段的耗时、CPU 时间、解码/编码次数和内存峰值
+        profile_dir: 提供时用 cProfile 和 tracemalloc 分析处理过程并写入该目录（阶段改为串行执行）
     
     Returns:
         是否成功
     """
     logger.info(f"处理目录: {work_dir}")
     
-    # 检查是否已处理
-    intr_dir = work_dir / 'intr'
-    if intr_dir.exists():
-        logger.info(f"  目录已处理（存在 intr 文件夹），跳过")
-        return True
-    
     # 检查文件完整性
-    is_complete, missing_files = check_files_completeness(work_dir)
+    is_complete, missing_files = check_files_completeness(work_dir, only)
     if not is_complete:
         logger.error(f"  文件不完整，缺少: {', '.join(missing_files)}")
         return False
-    
+
     # 创建输出目录
+    intr_dir = work_dir / 'intr'
     intr_dir.mkdir(exist_ok=True)
-    
-    # 图片预处理
-    logger.info(f"  开始图片预处理...")
-    prepare_mobile_desktop(work_dir)
-    prepare_mobile_desktop_2(work_dir)
-    prepare_mobile_desktop_3(work_dir)
-    prepare_pad_images(work_dir)
-    prepare_pc_desktop_mac(work_dir)
-    
-    # 执行拼图
-    logger.info(f"  开始拼图处理...")
-    success = True
-    
-    success &= create_mobile_puzzle(work_dir, intr_dir, main_color)
-    success &= create_mobile_puzzle_2(work_dir, intr_dir, main_color)
-    success &= create_mobile_puzzle_3(work_dir, intr_dir, main_color)
-    success &= create_pc_puzzle(work_dir, intr_dir, main_color)
-    success &= create_pad_puzzle(work_dir, intr_dir, main_color)
+
+    chains = only or CHAINS
+    # 磁盘上的中间图片可能由旧的输入生成（上次运行或旧版本保留下来），需要重建的拼图总是从原图重新生成
+    ctx = PuzzleContext(work_dir, keep_intermediates, output_dir=intr_dir, reuse_intermediates=False)
+    stages = [stage for stage in build_stages(ctx, main_color) if stage.chain in chains]
+
+    # 对比构建清单，只重建输入（图片、覆盖图、参数、布局）发生变化或输出文件缺失的拼图
+    manifest = BuildManifest.load(intr_dir)
+    plans = {Path(plan.output).stem: plan for plan in plan_directory(work_dir, chains)}
+    builds = {}
+    stale = []
+    for stage in stages:
+        if not stage.output:
+            continue
+        spec = OUTPUT_SPECS[stage.name]
+        inputs, params = output_build_inputs(work_dir, spec, main_color, ctx.images, plans)
+        key = build_key(inputs, params)
+        if manifest.is_fresh(stage.name, key):
+            logger.info(f"  {spec.output} 输入未变化，跳过")
+            continue
+        changed = manifest.changed_inputs(stage.name, inputs, params)
+        if changed:
+            logger.info(f"  {spec.output} 需要重建（变化: {', '.join(changed)}）")
+        elif manifest.has_record(stage.name):
+            logger.info(f"  {spec.output} 输出文件缺失，需要重建")
+        builds[stage.name] = (key, inputs, params)
+        stale.append(stage)
+
+    if not stale:
+        logger.info(f"  所有拼图均为最新，跳过")
+        return True
+
+    def tracked(stage: Stage) -> Stage:
+        """成功后把生成的文件和构建键写入清单"""
+        def run() -> bool:
+            if not stage.func():
+                return False
+            key, inputs, params = builds[stage.name]
+            files = [path.name for path in intr_dir.glob(f"{OUTPUT_SPECS[stage.name].output}.*")]
+            manifest.record(stage.name, key, files, inputs, params)
+            return True
+        return replace(stage, func=run)
+
+    def measured(stage: Stage) -> Stage:
+        """在阶段所在线程中收集统计"""
+        def run() -> bool:
+            with stats.stage(stage.name, stage.chain) as stage_stats:
+                stage_stats.ok = bool(stage.func())
+            return stage_stats.ok
+        return replace(stage, func=run)
+
+    # 只执行需要重建的拼图及其预处理阶段（按依赖关系并行执行）
+    needed = {dep for stage in stale for dep in stage.deps}
+    stages = [tracked(stage) if stage.output else stage
+              for stage in stages if stage in stale or stage.name in needed]
+    if stats is not None:
+        stages = [measured(stage) for stage in stages]
+    logger.info(f"  开始图片预处理和拼图处理...")
+    if profile_dir is not None:
+        # cProfile 只统计当前线程，分析时所有阶段在当前线程中串行执行
+        with profile_directory(work_dir, profile_dir):
+            results = run_stages(stages, 1)
+    else:
+        results = run_stages(stages, threads)
+    success = all(results[stage.name] for stage in stages if stage.output)
+    if stats is not None:
+        output_chains = {spec.output: spec.chain for spec in OUTPUT_SPECS.values()}
+        for name, result in ctx.outputs.items():
+            stats.add_output(name, output_chains.get(Path(name).stem, ''), result)
+
+    cache_stats = shadow_cache_stats()
+    logger.debug(f"  阴影缓存（本进程累计）: 阴影层命中 {cache_stats['shadow_hits']}/未命中 {cache_stats['shadow_misses']}，"
+                 f"圆角遮罩命中 {cache_stats['mask_hits']}/未命中 {cache_stats['mask_misses']}")
     
     # 清理临时文件（暂时注释）
     # logger.info(f"  清理临时文件...")
@@ -156,6 +392,369 @@ def process_directory(work_dir: Path, main_color: Optional[str] = None) -> bool:
     return success
 
 
+def process_directory_safe(work_dir: Path, main_color: Optional[str] = None, **options) -> Tuple[Path, bool, dict]:
+    """
+    处理单个目录，捕获所有异常（用于批量处理和工作进程）
+
+    Args:
+        work_dir: 工作目录
+        main_color: 主色调
+        **options: 传递给 process_directory 的其他参数
+
+    Returns:
+        (工作目录, 是否成功, 处理统计)
+    """
+    stats = DirectoryStats(work_dir)
+    try:
+        success = process_directory(work_dir, main_color, stats=stats, **options)
+    except Exception as e:
+        logger.error(f"处理目录 {work_dir} 时发生错误: {e}")
+        success = False
+    stats.finish(success)
+    # 归还空闲内存，常驻工作进程在两个目录之间回到基线附近（内存预算按基线计算）
+    release_free_memory()
+    return work_dir, success, stats.to_dict()
+
+
+def init_runtime(
+    warm_covers: bool = False,
+    color_extractor: str = DEFAULT_COLOR_EXTRACTOR,
+    blur_mode: str = DEFAULT_BLUR_MODE
+) -> None:
+    """
+    初始化进程级运行环境：设置主色调提取算法和模糊模式，加载覆盖图片，并按需预热覆盖图缓存
+
+    Args:
+        warm_covers: 是否预热覆盖图缓存
+        color_extractor: 主色调提取算法
+        blur_mode: 磨玻璃效果的模糊模式
+    """
+    set_color_extractor(color_extractor)
+    set_blur_mode(blur_mode)
+    load_cover_assets()
+    if warm_covers:
+        count = warm_cover_overlays()
+        logger.info(f"已预热 {count} 个覆盖图")
+
+
+def init_worker(log_queue: multiprocessing.Queue, runtime: dict, ignore_interrupt: bool = False) -> None:
+    """
+    工作进程初始化：日志统一发送到主进程输出，并初始化运行环境
+
+    Args:
+        log_queue: 日志队列
+        runtime: 传递给 init_runtime 的参数
+        ignore_interrupt: 是否忽略 Ctrl+C（由主进程负责停止，正在处理的目录可以正常完成）
+    """
+    if ignore_interrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+    init_runtime(**runtime)
+
+
+@contextmanager
+def worker_pool(jobs: int, runtime: Optional[dict] = None, ignore_interrupt: bool = False) -> Iterator[ProcessPoolExecutor]:
+    """
+    创建工作进程池，工作进程启动时初始化运行环境，日志经队列汇总到主进程输出
+
+    Args:
+        jobs: 工作进程数量
+        runtime: 工作进程启动时传递给 init_runtime 的参数
+        ignore_interrupt: 工作进程是否忽略 Ctrl+C
+
+    Yields:
+        进程池
+    """
+    # 工作进程的日志经队列汇总到主进程，避免多进程同时写入导致输出交错
+    log_queue = multiprocessing.Queue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(WORKER_LOG_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(log_queue, runtime or {}, ignore_interrupt)) as executor:
+            yield executor
+    finally:
+        listener.stop()
+
+
+def estimate_memory(work_dir: Path, options: dict, uploads: Optional[Dict[str, bytes]] = None) -> MemoryEstimate:
+    """
+    按处理参数估算目录的内存峰值
+
+    Args:
+        work_dir: 工作目录
+        options: 传递给 process_directory 的参数（使用其中的 only 和 threads）
+        uploads: 内存中的输入图片 {基础文件名: 编码后的字节}，提供时不读取 work_dir
+
+    Returns:
+        内存预估
+    """
+    return estimate_directory_memory(work_dir, options.get('only'), options.get('threads', DEFAULT_STAGE_THREADS),
+                                     uploads)
+
+
+def add_record(summary: Optional[RunSummary], record: dict, estimate: Optional[MemoryEstimate]) -> None:
+    """
+    将目录的处理统计加入汇总，使用了内存预算时附带预估值，便于与实测峰值对比
+    """
+    if estimate is not None:
+        record['memory_estimate_mb'] = estimate.total_mb
+        if record.get('peak_rss_mb') is not None:
+            logger.debug(f"  {estimate.work_dir.name}: 预估内存峰值 {estimate.total_mb:.0f}MB，"
+                         f"实测进程峰值 {record['peak_rss_mb']:.0f}MB（含进程基线）")
+    if summary is not None:
+        summary.add(record)
+
+
+def process_directories_parallel(
+    subdirs: List[Path],
+    main_color: Optional[str],
+    jobs: int,
+    runtime: Optional[dict] = None,
+    summary: Optional[RunSummary] = None,
+    memory_budget: Optional[int] = None,
+    **options
+) -> int:
+    """
+    使用进程池并行处理多个目录
+
+    同时处理的目录不超过 jobs 个；提供 memory_budget 时还要求已接纳目录的内存预估之和不超过预算，
+    排在前面的目录放不下时为它预留内存，后面预估较小的目录只能使用预留之外的预算先处理。
+
+    Args:
+        subdirs: 待处理目录列表
+        main_color: 主色调
+        jobs: 工作进程数量
+        runtime: 工作进程启动时传递给 init_runtime 的参数
+        summary: 收集每个目录的处理统计
+        memory_budget: 内存预算（字节），包括所有工作进程
+        **options: 传递给 process_directory 的其他参数
+
+    Returns:
+        处理成功的目录数量
+    """
+    budget = MemoryBudget(memory_budget, jobs) if memory_budget else None
+    estimates: Dict[Path, MemoryEstimate] = {}
+    if budget is not None:
+        estimates = {subdir: estimate_memory(subdir, options) for subdir in subdirs}
+
+    success_count = 0
+    done_count = 0
+    pending = list(subdirs)
+    running = {}
+    with worker_pool(jobs, runtime) as executor:
+        while pending or running:
+            for subdir in list(pending):
+                if len(running) >= jobs:
+                    break
+                if budget is not None and not budget.admit(estimates[subdir]):
+                    continue
+                pending.remove(subdir)
+                future = executor.submit(process_directory_safe, subdir, main_color, **options)
+                running[future] = (subdir, DirectoryStats(subdir))
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                subdir, submitted = running.pop(future)
+                estimate = estimates.get(subdir)
+                if budget is not None:
+                    budget.release(estimate.total)
+                done_count += 1
+                try:
+                    _, success, record = future.result()
+                except Exception as e:
+                    # 工作进程异常退出等情况，没有返回统计，按失败目录计入汇总和指标
+                    logger.error(f"工作进程执行失败（{subdir.name}）: {e}")
+                    success, record = False, submitted.crashed(e)
+                add_record(summary, record, estimate)
+                if success:
+                    success_count += 1
+                logger.info(f"进度: {done_count}/{len(subdirs)}，{subdir.name} {'成功' if success else '失败'}")
+
+    return success_count
+
+
+def watch_directories(
+    root: Path,
+    main_color: Optional[str],
+    jobs: int,
+    runtime: Optional[dict] = None,
+    interval: float = DEFAULT_POLL_INTERVAL,
+    settle: float = DEFAULT_SETTLE_SECONDS,
+    summary: Optional[RunSummary] = None,
+    memory_budget: Optional[int] = None,
+    **options
+) -> None:
+    """
+    持续监视图片根目录，新目录的文件齐全且不再变化后立即处理（--watch），按 Ctrl+C 退出
+
+    运行环境（覆盖图、缓存）只初始化一次：jobs 为 1 时在当前进程中处理，否则使用常驻的工作进程池。
+    同一个目录不会同时被处理两次；处理期间目录内容发生变化时，处理完成后会再次处理
+    （构建清单保证只重建输入变化的拼图）。
+    提供 memory_budget 时，预估放不下的目录留到之后的轮询中再处理（为它预留内存，之后的目录不能一直插队）。
+
+    Args:
+        root: 图片根目录
+        main_color: 主色调
+        jobs: 工作进程数量
+        runtime: 传递给 init_runtime 的参数
+        interval: 轮询间隔（秒）
+        settle: 目录内容需要保持不变的秒数
+        summary: 收集每个目录的处理统计（每处理完一个目录写入一条 JSON 行）
+        memory_budget: 内存预算（字节），包括所有工作进程
+        **options: 传递给 process_directory 的其他参数
+    """
+    # 等待中的目录每次轮询重试一次，预留时间需要覆盖轮询间隔
+    budget = MemoryBudget(memory_budget, jobs, max(RESERVATION_HOLD_SECONDS, 3 * interval)) if memory_budget else None
+    watcher = DirectoryWatcher(root, lambda work_dir: check_files_completeness(work_dir, options.get('only')), settle)
+    logger.info(f"开始监视 {root}（每 {interval:g} 秒检查一次，按 Ctrl+C 退出）")
+
+    with ExitStack() as stack:
+        executor = None
+        if jobs > 1:
+            executor = stack.enter_context(worker_pool(jobs, runtime, ignore_interrupt=True))
+        else:
+            init_runtime(**(runtime or {}))
+
+        running = {}
+        try:
+            while True:
+                for future in [f for f in running if f.done()]:
+                    work_dir, estimate, submitted = running.pop(future)
+                    if budget is not None:
+                        budget.release(estimate.total)
+                    try:
+                        _, success, record = future.result()
+                    except Exception as e:
+                        # 工作进程异常退出等情况，没有返回统计，按失败目录计入汇总和指标
+                        logger.error(f"工作进程执行失败（{work_dir.name}）: {e}")
+                        success, record = False, submitted.crashed(e)
+                    add_record(summary, record, estimate)
+                    logger.info(f"{work_dir.name} {'处理成功' if success else '处理失败'}")
+
+                for work_dir, signature in watcher.poll():
+                    if work_dir in [running_dir for running_dir, _, _ in running.values()]:
+                        continue
+                    estimate = None
+                    if budget is not None:
+                        # 同时处理的目录不超过 jobs 个，预算放不下时不标记为已处理，下次轮询再尝试
+                        if len(running) >= jobs:
+                            continue
+                        estimate = estimate_memory(work_dir, options)
+                        if not budget.admit(estimate):
+                            continue
+                    watcher.mark_processed(work_dir, signature)
+                    if executor is None:
+                        _, success, record = process_directory_safe(work_dir, main_color, **options)
+                        if budget is not None:
+                            budget.release(estimate.total)
+                        add_record(summary, record, estimate)
+                        logger.info(f"{work_dir.name} {'处理成功' if success else '处理失败'}")
+                    else:
+                        future = executor.submit(process_directory_safe, work_dir, main_color, **options)
+                        running[future] = (work_dir, estimate, DirectoryStats(work_dir))
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            unfinished = [work_dir.name for future, (work_dir, _, _) in running.items() if not future.done()]
+            if unfinished:
+                logger.info(f"停止监视，等待正在处理的目录完成: {', '.join(unfinished)}")
+            else:
+                logger.info(f"停止监视")
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            if summary is not None:
+                summary.log_table()
+
+
+def profile_startup_and_check(budget_ms: float) -> int:
+    """
+    输出冷启动导入耗时报告，并检查是否超出预算
+
+    Args:
+        budget_ms: 耗时预算（毫秒）
+
+    Returns:
+        进程退出码，超出预算时为 1
+    """
+    # 只在需要时导入，不增加正常运行的启动耗时
+    try:
+        from .startup_profile import profile_startup, format_startup_report
+    except ImportError:
+        from startup_profile import profile_startup, format_startup_report
+
+    profile = profile_startup(Path(__file__).stem)
+    print(format_startup_report(profile))
+
+    total_ms = profile.total_us / 1000
+    if total_ms > budget_ms:
+        print(f"\n冷启动导入耗时 {total_ms:.1f} ms 超出预算 {budget_ms:.0f} ms")
+        return 1
+    print(f"\n冷启动导入耗时 {total_ms:.1f} ms，未超出预算 {budget_ms:.0f} ms")
+    return 0
+
+
+def parse_chains(value: str) -> List[str]:
+    """
+    解析 --only 参数
+
+    Args:
+        value: 逗号分隔的处理链名称
+
+    Returns:
+        处理链列表
+    """
+    chains = [chain.strip() for chain in value.split(',') if chain.strip()]
+    invalid = [chain for chain in chains if chain not in CHAINS]
+    if invalid or not chains:
+        raise argparse.ArgumentTypeError(f"无效的处理链: {value}（可选: {', '.join(CHAINS)}）")
+    return chains
+
+
+def parse_main_color(value: str) -> str:
+    """
+    解析并校验 --main-color 参数（只在参数解析时校验一次）
+
+    Args:
+        value: 颜色代码
+
+    Returns:
+        规范化后的颜色代码（#rrggbb），空字符串（自动提取主色调）原样返回
+    """
+    # 只提供 --main-color 不带值时，argparse 也会用 const='' 调用本函数
+    if value == '':
+        return value
+
+    color = parse_color(value)
+    if color is None:
+        raise argparse.ArgumentTypeError(f"无效的颜色代码: {value}（应为 #fff 或 #ffffff 格式）")
+    return '#{:02x}{:02x}{:02x}'.format(*color)
+
+
+def parse_memory_budget(value: str) -> int:
+    """
+    解析 --memory-budget 参数
+
+    Args:
+        value: 内存大小，如 4G、512M
+
+    Returns:
+        字节数
+    """
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
     """
     主函数
@@ -163,13 +762,144 @@ def main():
     parser = argparse.ArgumentParser(description='图片拼图工具')
     parser.add_argument(
         '--main-color',
-        type=str,
+        type=parse_main_color,
         nargs='?',
         const='',
         help='主色调（16进制颜色代码，如 #fff 或 #ffffff）。如果不提供值，则自动提取图片主色调'
     )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='并行处理目录的进程数（默认 1，即串行处理）'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=DEFAULT_STAGE_THREADS,
+        help=f'单个目录内并行执行处理阶段的线程数（默认 {DEFAULT_STAGE_THREADS}）'
+    )
+    parser.add_argument(
+        '--only',
+        type=parse_chains,
+        help='只执行指定的处理链，逗号分隔，如 mobile,pc,pad（默认全部执行）'
+    )
+    parser.add_argument(
+        '--keep-intermediates',
+        action='store_true',
+        help='将中间图片（mobile-desktop.png、pc-desktop-mac.png 等）写入图片目录（默认只在内存中传递）'
+    )
+    parser.add_argument(
+        '--color-extractor',
+        choices=sorted(COLOR_EXTRACTORS),
+        default=DEFAULT_COLOR_EXTRACTOR,
+        help=f'自动提取主色调使用的算法：fast 为缩略图直方图聚类，kmeans 为全分辨率 KMeans（默认 {DEFAULT_COLOR_EXTRACTOR}）'
+    )
+    parser.add_argument(
+        '--blur-mode',
+        choices=BLUR_MODES,
+        default=DEFAULT_BLUR_MODE,
+        help=f'磨玻璃效果的模糊方式：exact 为整图高斯模糊，fast 为缩小后模糊再放大（默认 {DEFAULT_BLUR_MODE}）'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='持续监视图片目录，新目录的文件齐全后立即处理（常驻进程，按 Ctrl+C 退出）'
+    )
+    parser.add_argument(
+        '--watch-interval',
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f'配合 --watch 使用，轮询间隔秒数（默认 {DEFAULT_POLL_INTERVAL:g}）'
+    )
+    parser.add_argument(
+        '--watch-settle',
+        type=float,
+        default=DEFAULT_SETTLE_SECONDS,
+        help=f'配合 --watch 使用，目录内容保持不变多少秒后才开始处理（默认 {DEFAULT_SETTLE_SECONDS:g}）'
+    )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        help='启动本地 HTTP 渲染服务（POST /render），使用 --jobs 个常驻工作进程，按 Ctrl+C 退出'
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='配合 --serve 或 --metrics-port 使用，监听地址（默认 127.0.0.1）'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8765,
+        help='配合 --serve 使用，监听端口（默认 8765）'
+    )
+    parser.add_argument(
+        '--memory-budget',
+        type=parse_memory_budget,
+        metavar='SIZE',
+        help='所有工作进程的内存预算，如 4G、512M：根据图片文件头预估每个目录的内存峰值，'
+             '只在预估之和不超过预算时开始处理下一个目录（配合 --jobs、--watch、--serve 使用）'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='只读取图片文件头，输出每张拼图的画布、图片尺寸和位置后退出（不解码、不写入文件）'
+    )
+    parser.add_argument(
+        '--stats',
+        type=Path,
+        metavar='FILE',
+        help='将每个目录的处理统计（每个阶段的耗时、CPU 时间、解码/编码次数、内存峰值和热点函数耗时）以 JSON 行追加写入该文件，结束时输出汇总表格'
+    )
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        metavar='DIR',
+        help='用 cProfile 和 tracemalloc 分析每个目录的处理，结果写入该目录（单个目录内的阶段改为串行执行，处理明显变慢）'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        type=Path,
+        metavar='FILE',
+        help='以 Prometheus 文本格式写入处理指标（目录数、阶段耗时和失败次数、输出大小、编码尝试次数、JPEG 质量等），'
+             '每处理完一个目录原子重写一次，可放在 node_exporter 的 textfile 目录中'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        metavar='PORT',
+        help='配合 --watch 使用，在该端口提供 GET /metrics 指标接口（--serve 模式直接使用服务端口的 /metrics）'
+    )
+    parser.add_argument(
+        '--warm-covers',
+        action='store_true',
+        help='启动时按常见手机、平板、Mac 分辨率预先生成覆盖图缓存（适合大批量处理）'
+    )
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help='在新进程中冷启动导入本工具，输出每个模块的导入耗时后退出（不处理图片）'
+    )
+    parser.add_argument(
+        '--startup-budget-ms',
+        type=float,
+        default=DEFAULT_STARTUP_BUDGET_MS,
+        help=f'配合 --profile-startup 使用，冷启动导入耗时超过该值（毫秒）时以非零状态退出（默认 {DEFAULT_STARTUP_BUDGET_MS}）'
+    )
     
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs 必须大于等于 1')
+    if args.threads < 1:
+        parser.error('--threads 必须大于等于 1')
+    if args.watch_interval <= 0 or args.watch_settle < 0:
+        parser.error('--watch-interval 必须大于 0，--watch-settle 不能小于 0')
+    if args.metrics_port is not None and not args.watch:
+        parser.error('--metrics-port 只能配合 --watch 使用')
+
+    if args.profile_startup:
+        sys.exit(profile_startup_and_check(args.startup_budget_ms))
     
     # 处理主色调参数
     main_color = None
@@ -186,6 +916,56 @@ def main():
         logger.error(f"图片目录不存在: {IMGS_DIR}")
         sys.exit(1)
     
+    options = {
+        'only': args.only,
+        'threads': args.threads,
+        'keep_intermediates': args.keep_intermediates,
+        'profile_dir': args.profile
+    }
+    if args.memory_budget:
+        try:
+            MemoryBudget(args.memory_budget, args.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+    runtime = {
+        'warm_covers': args.warm_covers,
+        'color_extractor': args.color_extractor,
+        'blur_mode': args.blur_mode
+    }
+
+    # 运行指标：渲染服务始终提供 /metrics，其他模式只在指定 --metrics-file 或 --metrics-port 时收集
+    metrics = None
+    if args.serve or args.metrics_file or args.metrics_port is not None:
+        metrics = PuzzleMetrics(args.metrics_file)
+
+    # 处理统计：指定 --stats 或 --profile 时写入 JSON 行并在结束时输出汇总表格
+    summary = None
+    if args.stats or args.profile or metrics is not None:
+        summary = RunSummary(args.stats, metrics, show_table=bool(args.stats or args.profile))
+
+    # 渲染服务模式：按需导入，不影响普通运行的启动耗时
+    if args.serve:
+        try:
+            from .server import serve
+        except ImportError:
+            from server import serve
+        serve(IMGS_DIR, args.host, args.port, args.jobs, runtime, summary, args.memory_budget, **options)
+        return
+
+    # 监视模式：常驻运行，不需要等到子目录出现
+    if args.watch:
+        metrics_server = None
+        if args.metrics_port is not None:
+            metrics_server = start_metrics_server(metrics, args.host, args.metrics_port)
+        try:
+            watch_directories(IMGS_DIR, main_color, args.jobs, runtime, args.watch_interval, args.watch_settle,
+                              summary, args.memory_budget, **options)
+        finally:
+            if metrics_server is not None:
+                metrics_server.shutdown()
+                metrics_server.server_close()
+        return
+
     # 遍历所有子目录
     subdirs = [d for d in IMGS_DIR.iterdir() if d.is_dir()]
     
@@ -194,17 +974,38 @@ def main():
         return
     
     logger.info(f"找到 {len(subdirs)} 个子目录")
+
+    if args.dry_run:
+        complete_count = dry_run(subdirs, args.only, args.threads)
+        logger.info(f"规划完成: {complete_count}/{len(subdirs)} 个目录文件完整")
+        return
     
-    success_count = 0
-    for subdir in subdirs:
-        try:
-            if process_directory(subdir, main_color):
+    if args.jobs > 1:
+        success_count = process_directories_parallel(subdirs, main_color, args.jobs, runtime, summary,
+                                                     args.memory_budget, **options)
+    else:
+        init_runtime(**runtime)
+        budget = MemoryBudget(args.memory_budget) if args.memory_budget else None
+        success_count = 0
+        for subdir in subdirs:
+            # 串行处理时预算总能接纳，只输出预估（超出预算时给出警告）
+            estimate = None
+            if budget is not None:
+                estimate = estimate_memory(subdir, options)
+                budget.admit(estimate)
+            _, success, record = process_directory_safe(subdir, main_color, **options)
+            if budget is not None:
+                budget.release(estimate.total)
+            add_record(summary, record, estimate)
+            if success:
                 success_count += 1
-        except Exception as e:
-            logger.error(f"处理目录 {subdir} 时发生错误: {e}")
-    
-    logger.info(f"处理完成: {success_count}/{len(subdirs)} 个目录成功")
 
+    logger.info(f"处理完成: {success_count}/{len(subdirs)} 个目录成功")
+    if metrics is not None and metrics.textfile is not None:
+        metrics.write_textfile()
+        logger.info(f"指标已写入: {metrics.textfile}")
+    if summary is not None:
+        summary.log_table()
 
 if __name__ == '__main__':
     main()
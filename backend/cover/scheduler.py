@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理阶段调度模块
+将目录处理拆分为带依赖关系的阶段（DAG），在线程池中并行执行互不依赖的阶段
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    处理阶段
+
+    Attributes:
+        name: 阶段名称（在同一个 DAG 中唯一）
+        func: 阶段执行函数，返回是否成功
+        deps: 依赖的阶段名称，这些阶段完成后才会执行本阶段
+        chain: 所属处理链（mobile / pc / pad）
+        output: 是否产出最终拼图（只有这些阶段的结果计入目录处理是否成功）
+    """
+    name: str
+    func: Callable[[], bool]
+    deps: Tuple[str, ...] = ()
+    chain: str = ''
+    output: bool = False
+
+
+def validate_stages(stages: List[Stage]) -> None:
+    """
+    检查阶段名称唯一、依赖存在且不存在环
+
+    Args:
+        stages: 阶段列表
+
+    Raises:
+        ValueError: 阶段定义不合法
+    """
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError(f"阶段名称重复: {names}")
+
+    deps = {stage.name: stage.deps for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in deps:
+                raise ValueError(f"阶段 {stage.name} 依赖不存在的阶段 {dep}")
+
+    # 拓扑排序检查环
+    visited = set()
+    visiting = set()
+
+    def visit(name: str) -> None:
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"阶段依赖存在环: {name}")
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+
+    for name in names:
+        visit(name)
+
+
+def run_stage(stage: Stage) -> bool:
+    """
+    执行单个阶段，异常视为失败
+
+    Args:
+        stage: 阶段
+
+    Returns:
+        是否成功
+    """
+    try:
+        return bool(stage.func())
+    except Exception as e:
+        logger.error(f"  阶段 {stage.name} 执行失败: {e}")
+        return False
+
+
+def run_stages(stages: List[Stage], max_workers: int = 1) -> Dict[str, bool]:
+    """
+    按依赖关系执行所有阶段
+
+    依赖只约束执行顺序：依赖的阶段失败时，后续阶段仍会执行（由阶段自身检查所需文件），
+    与原先串行执行的行为保持一致。
+
+    Args:
+        stages: 阶段列表
+        max_workers: 线程池大小，为 1 时在当前线程中按拓扑顺序串行执行
+
+    Returns:
+        {阶段名称: 是否成功}
+    """
+    validate_stages(stages)
+    results = {}
+    pending = list(stages)
+
+    def pop_ready() -> List[Stage]:
+        ready = [stage for stage in pending if all(dep in results for dep in stage.deps)]
+        for stage in ready:
+            pending.remove(stage)
+        return ready
+
+    if max_workers <= 1:
+        while pending:
+            for stage in pop_ready():
+                results[stage.name] = run_stage(stage)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage') as executor:
+        running = {executor.submit(run_stage, stage): stage for stage in pop_ready()}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+            for stage in pop_ready():
+                running[executor.submit(run_stage, stage)] = stage
+
+    return results
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP 渲染服务模块
+常驻进程接收渲染请求，在有界的工作进程池中执行拼图处理（覆盖图等缓存只初始化一次），以 JSON 返回结果
+
+接口：
+- GET  /health：服务状态和当前负载
+- GET  /metrics：Prometheus 文本格式的处理指标
+- POST /render：请求体为 JSON
+    {"dir": "set0"}                              处理图片根目录下的子目录（也可以是根目录内的绝对路径）
+    {"images": {"mobile.png": "<base64>", ...}}  处理上传的图片（在内存中处理，不写入磁盘），结果以 base64 返回
+    可选字段：main_color（null 为默认背景，"" 为自动提取，"#ffffff" 为纯色）、only（处理链列表）
+  满载（或内存预估超出 --memory-budget 的剩余预算）时立即返回 503 {"error": "busy"}，不排队等待
+"""
+
+import base64
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import ExitStack
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .api import CHAINS, CHAIN_REQUIRED_FILES, DEFAULT_STAGE_THREADS, iter_puzzles
+    from .puzzle import check_files_completeness, estimate_memory, init_runtime, list_outputs, parse_chains, parse_main_color, process_directory, worker_pool
+    from .instrument import DirectoryStats, RunSummary
+    from .memory_budget import MB, MemoryBudget
+    from .metrics import PuzzleMetrics, send_metrics
+except ImportError:
+    from api import CHAINS, CHAIN_REQUIRED_FILES, DEFAULT_STAGE_THREADS, iter_puzzles
+    from puzzle import check_files_completeness, estimate_memory, init_runtime, list_outputs, parse_chains, parse_main_color, process_directory, worker_pool
+    from instrument import DirectoryStats, RunSummary
+    from memory_budget import MB, MemoryBudget
+    from metrics import PuzzleMetrics, send_metrics
+
+logger = logging.getLogger(__name__)
+
+# 默认监听地址和端口（只监听本机）
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 请求体大小上限（上传图片以 base64 编码后的总大小）
+MAX_REQUEST_BYTES = 200 * 1024 * 1024
+
+# 允许上传的图片（基础文件名）和扩展名
+UPLOAD_NAMES = {'mobile', 'mobile-lock', 'mobile-2', 'pc', 'pad', 'pad-lock'}
+UPLOAD_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp'}
+
+# 上传请求在日志、处理统计和内存预估中使用的目录名（上传的图片不写入磁盘）
+UPLOAD_DIR = Path('upload')
+
+
+class RequestError(Exception):
+    """
+    请求参数错误（返回 400）
+    """
+
+
+class BusyError(Exception):
+    """
+    内存预算不足以接纳请求（返回 503，由调用方稍后重试）
+    """
+
+
+def render_result(
+    success: bool,
+    error: Optional[str],
+    outputs: List[dict],
+    stats: DirectoryStats,
+    start: float,
+    submitted_at: Optional[float]
+) -> dict:
+    """
+    组装渲染结果
+
+    Args:
+        success: 是否成功
+        error: 异常信息
+        outputs: 生成的拼图
+        stats: 处理统计（已调用 finish）
+        start: 开始处理的时间（time.time()）
+        submitted_at: 提交时间（time.time()），用于计算排队耗时
+
+    Returns:
+        结果（可以直接序列化为 JSON），stats 为处理统计，由服务进程取出用于更新指标
+    """
+    result = {
+        'success': success,
+        'outputs': outputs,
+        'timings': {
+            'queue_ms': round((start - submitted_at) * 1000, 1) if submitted_at else 0.0,
+            'render_ms': round((time.time() - start) * 1000, 1)
+        },
+        'stats': stats.to_dict()
+    }
+    if error:
+        result['error'] = error
+    return result
+
+
+def render_directory(
+    work_dir: Path,
+    main_color: Optional[str] = None,
+    only: Optional[List[str]] = None,
+    submitted_at: Optional[float] = None,
+    **options
+) -> dict:
+    """
+    处理单个目录并收集结果（在工作进程中执行）
+
+    Args:
+        work_dir: 工作目录
+        main_color: 主色调
+        only: 只执行指定的处理链
+        submitted_at: 提交时间（time.time()），用于计算排队耗时
+        **options: 传递给 process_directory 的其他参数
+
+    Returns:
+        结果（可以直接序列化为 JSON），stats 为处理统计，由服务进程取出用于更新指标
+    """
+    start = time.time()
+    stats = DirectoryStats(work_dir)
+    try:
+        success = process_directory(work_dir, main_color, only=only, stats=stats, **options)
+        error = None
+    except Exception as e:
+        success, error = False, str(e)
+    stats.finish(success)
+
+    outputs = [{'name': path.name, 'path': str(path), 'bytes': path.stat().st_size}
+               for path in list_outputs(work_dir, only)]
+    return render_result(success, error, outputs, stats, start, submitted_at)
+
+
+def render_uploads(
+    images: Dict[str, bytes],
+    main_color: Optional[str] = None,
+    only: Optional[List[str]] = None,
+    submitted_at: Optional[float] = None,
+    threads: int = DEFAULT_STAGE_THREADS
+) -> dict:
+    """
+    在内存中处理上传的图片并收集结果（在工作进程中执行），不写入临时目录
+
+    Args:
+        images: {基础文件名: 编码后的图片}
+        main_color: 主色调
+        only: 只执行指定的处理链
+        submitted_at: 提交时间（time.time()），用于计算排队耗时
+        threads: 并行执行阶段的线程数
+
+    Returns:
+        结果（可以直接序列化为 JSON），拼图内容以 base64 编码附带在 outputs 中
+    """
+    start = time.time()
+    stats = DirectoryStats(UPLOAD_DIR)
+    outputs = []
+    try:
+        for output in iter_puzzles(images, main_color, only, threads, stats=stats):
+            outputs.append({'name': output.name, 'bytes': output.nbytes,
+                            'data': base64.b64encode(output.data).decode('ascii')})
+        success, error = True, None
+    except Exception as e:
+        success, error = False, str(e)
+    stats.finish(success)
+    return render_result(success, error, outputs, stats, start, submitted_at)
+
+
+class PuzzleServer(ThreadingHTTPServer):
+    """
+    拼图渲染服务
+
+    请求线程只负责解析请求和等待结果，渲染在执行器（工作进程池，jobs 为 1 时为当前进程中的单个线程）中完成。
+    同时处理的请求数不超过执行器的容量，超出时立即返回 busy。
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        executor: Executor,
+        capacity: int,
+        root: Path,
+        options: Optional[dict] = None,
+        summary: Optional[RunSummary] = None,
+        budget: Optional[MemoryBudget] = None
+    ):
+        """
+        Args:
+            address: 监听地址 (host, port)
+            executor: 执行渲染的执行器
+            capacity: 同时处理的请求数上限
+            root: 图片根目录，dir 参数只能指向该目录内
+            options: 传递给 process_directory 的其他参数（only 作为请求未指定处理链时的默认值）
+            summary: 收集每次渲染的处理统计和指标，默认只收集指标
+            budget: 内存预算，提供时内存预估放不下的请求返回 busy
+        """
+        super().__init__(address, PuzzleRequestHandler)
+        self.executor = executor
+        self.capacity = capacity
+        self.root = root.resolve()
+        self.options = dict(options or {})
+        self.default_only = self.options.pop('only', None)
+        self.summary = summary or RunSummary(show_table=False)
+        if self.summary.metrics is None:
+            self.summary.metrics = PuzzleMetrics()
+        self.metrics = self.summary.metrics
+        self.budget = budget
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # 同一个目录的请求依次处理，避免同时写入同一个输出目录和构建清单
+        self._dir_locks: Dict[Path, threading.Lock] = {}
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    def try_acquire(self) -> bool:
+        """
+        占用一个处理名额，满载时返回 False
+        """
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def release(self) -> None:
+        """
+        释放处理名额
+        """
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def directory_lock(self, work_dir: Path) -> threading.Lock:
+        """
+        获取目录对应的锁
+        """
+        with self._lock:
+            return self._dir_locks.setdefault(work_dir, threading.Lock())
+
+    def resolve_directory(self, value: str) -> Path:
+        """
+        解析 dir 参数，只允许图片根目录内已存在的目录
+
+        Args:
+            value: 相对于图片根目录的路径或绝对路径
+
+        Returns:
+            目录路径
+
+        Raises:
+            RequestError: 路径不在图片根目录内或不存在
+        """
+        path = (self.root / value).resolve()
+        if path != self.root and self.root not in path.parents:
+            raise RequestError(f"目录不在图片根目录内: {value}")
+        if not path.is_dir():
+            raise RequestError(f"目录不存在: {value}")
+        return path
+
+    def submit(self, work_dir: Path, main_color: Optional[str], only: Optional[List[str]], submitted_at: float,
+               uploads: Optional[Dict[str, bytes]] = None) -> dict:
+        """
+        在执行器中处理目录（或上传的图片）并等待结果，提供内存预算时先按预估占用预算
+
+        Args:
+            work_dir: 工作目录，处理上传的图片时为 UPLOAD_DIR
+            main_color: 主色调
+            only: 只执行指定的处理链
+            submitted_at: 提交时间（time.time()）
+            uploads: 上传的图片 {基础文件名: 编码后的图片}，提供时在内存中处理
+
+        Raises:
+            BusyError: 剩余内存预算放不下该目录
+        """
+        estimate = None
+        if self.budget is not None:
+            estimate = estimate_memory(work_dir, dict(self.options, only=only), uploads)
+            if not self.budget.admit(estimate):
+                raise BusyError(f"内存预算不足（{estimate.describe()}，预算占用 {self.budget.usage()}）")
+        try:
+            submitted = DirectoryStats(work_dir)
+            if uploads is not None:
+                future = self.executor.submit(render_uploads, uploads, main_color, only, submitted_at,
+                                              self.options.get('threads', DEFAULT_STAGE_THREADS))
+            else:
+                future = self.executor.submit(render_directory, work_dir, main_color, only, submitted_at,
+                                              **self.options)
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程异常退出等情况，没有返回统计，按失败目录计入指标后返回 500
+                self.summary.add(submitted.crashed(e))
+                raise
+        finally:
+            if estimate is not None:
+                self.budget.release(estimate.total)
+        if estimate is not None:
+            result['memory_estimate_mb'] = estimate.total_mb
+            result['stats']['memory_estimate_mb'] = estimate.total_mb
+        return result
+
+    def render(self, request: dict) -> dict:
+        """
+        执行一次渲染请求（调用前需要已占用处理名额）
+
+        Args:
+            request: 请求 JSON
+
+        Returns:
+            结果
+
+        Raises:
+            RequestError: 请求参数错误
+        """
+        main_color = request.get('main_color')
+        if main_color is not None:
+            try:
+                main_color = parse_main_color(main_color)
+            except Exception as e:
+                raise RequestError(str(e))
+
+        only = request.get('only', self.default_only)
+        if only is not None and only is not self.default_only:
+            try:
+                only = parse_chains(','.join(only) if isinstance(only, list) else str(only))
+            except Exception as e:
+                raise RequestError(str(e))
+
+        submitted_at = time.time()
+        if 'images' in request:
+            uploads = decode_uploads(request['images'])
+            check_uploads_complete(uploads, only)
+            result = self.submit(UPLOAD_DIR, main_color, only, submitted_at, uploads)
+        elif 'dir' in request:
+            work_dir = self.resolve_directory(str(request['dir']))
+            check_complete(work_dir, only)
+            with self.directory_lock(work_dir):
+                result = self.submit(work_dir, main_color, only, submitted_at)
+        else:
+            raise RequestError("请求需要包含 dir 或 images")
+
+        self.summary.add(result.pop('stats', None))
+        result['timings']['total_ms'] = round((time.time() - submitted_at) * 1000, 1)
+        return result
+
+
+def check_complete(work_dir: Path, only: Optional[List[str]]) -> None:
+    """
+    检查所选处理链需要的图片是否齐全
+
+    Raises:
+        RequestError: 缺少图片
+    """
+    is_complete, missing_files = check_files_completeness(work_dir, only)
+    if not is_complete:
+        raise RequestError(f"文件不完整，缺少: {', '.join(missing_files)}")
+
+
+def check_uploads_complete(uploads: Dict[str, bytes], only: Optional[List[str]]) -> None:
+    """
+    检查所选处理链需要的图片是否都已上传
+
+    Raises:
+        RequestError: 缺少图片
+    """
+    missing = [file for chain in only or CHAINS for file in CHAIN_REQUIRED_FILES[chain] if Path(file).stem not in uploads]
+    if missing:
+        raise RequestError(f"文件不完整，缺少: {', '.join(missing)}")
+
+
+def decode_uploads(images: Dict[str, str]) -> Dict[str, bytes]:
+    """
+    解码上传的图片
+
+    Args:
+        images: {文件名: base64 编码的内容}
+
+    Returns:
+        {基础文件名: 编码后的图片}
+
+    Raises:
+        RequestError: 文件名不合法、重复或内容无法解码
+    """
+    if not isinstance(images, dict) or not images:
+        raise RequestError("images 需要是非空的 {文件名: base64} 对象")
+    uploads = {}
+    for name, content in images.items():
+        path = Path(name)
+        if path.name != name or path.stem not in UPLOAD_NAMES or path.suffix.lower() not in UPLOAD_EXTENSIONS:
+            raise RequestError(f"不支持的文件名: {name}（可选: {', '.join(sorted(UPLOAD_NAMES))}，"
+                               f"扩展名: {', '.join(sorted(UPLOAD_EXTENSIONS))}）")
+        if path.stem in uploads:
+            raise RequestError(f"重复的图片: {path.stem}")
+        try:
+            uploads[path.stem] = base64.b64decode(content, validate=True)
+        except (binascii.Error, TypeError) as e:
+            raise RequestError(f"{name} 不是合法的 base64 内容: {e}")
+    return uploads
+
+
+class PuzzleRequestHandler(BaseHTTPRequestHandler):
+    """
+    渲染服务的请求处理
+    """
+
+    server: PuzzleServer
+
+    def send_json(self, status: HTTPStatus, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        if self.path == '/render':
+            self.server.metrics.observe_request(status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics':
+            send_metrics(self, self.server.metrics)
+            return
+        if self.path != '/health':
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+            return
+        self.send_json(HTTPStatus.OK, {
+            'status': 'ok',
+            'capacity': self.server.capacity,
+            'in_flight': self.server.in_flight
+        })
+
+    def do_POST(self) -> None:
+        if self.path != '/render':
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+            return
+
+        # 负数的长度会让 rfile.read 一直读到客户端关闭连接，占住处理线程
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': f"无效的 Content-Length: {self.headers.get('Content-Length')}"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': f"请求体超过 {MAX_REQUEST_BYTES} 字节"})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("请求体需要是 JSON 对象")
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': f"无法解析请求: {e}"})
+            return
+
+        # 满载时立即拒绝，由调用方稍后重试
+        if not self.server.try_acquire():
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE,
+                           {'error': 'busy', 'capacity': self.server.capacity},
+                           {'Retry-After': '1'})
+            return
+        try:
+            result = self.server.render(request)
+        except RequestError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        except BusyError as e:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE,
+                           {'error': 'busy', 'reason': str(e), 'capacity': self.server.capacity},
+                           {'Retry-After': '1'})
+            return
+        except Exception as e:
+            logger.error(f"渲染请求失败: {e}")
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+            return
+        finally:
+            self.server.release()
+        self.send_json(HTTPStatus.OK, result)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def serve(
+    root: Path,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    jobs: int = 1,
+    runtime: Optional[dict] = None,
+    summary: Optional[RunSummary] = None,
+    memory_budget: Optional[int] = None,
+    **options
+) -> None:
+    """
+    启动渲染服务（--serve），按 Ctrl+C 退出
+
+    Args:
+        root: 图片根目录
+        host: 监听地址
+        port: 监听端口
+        jobs: 工作进程数量，同时也是同时处理的请求数上限
+        runtime: 传递给 init_runtime 的参数
+        summary: 收集每次渲染的处理统计和指标
+        memory_budget: 内存预算（字节），包括所有工作进程
+        **options: 传递给 process_directory 的其他参数（only 为请求未指定处理链时的默认值）
+    """
+    with ExitStack() as stack:
+        if jobs > 1:
+            executor = stack.enter_context(worker_pool(jobs, runtime, ignore_interrupt=True))
+            # 预先启动工作进程并初始化运行环境，第一个请求不需要等待
+            for future in [executor.submit(os.getpid) for _ in range(jobs)]:
+                future.result()
+        else:
+            init_runtime(**(runtime or {}))
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=1, thread_name_prefix='render'))
+
+        budget = MemoryBudget(memory_budget, jobs) if memory_budget else None
+        server = PuzzleServer((host, port), executor, jobs, root, options, summary, budget)
+        stack.callback(server.server_close)
+        logger.info(f"渲染服务已启动: http://{host}:{server.server_address[1]}（图片根目录 {server.root}，"
+                    f"同时处理 {jobs} 个请求"
+                    + (f"，内存预算 {memory_budget / MB:.0f}MB" if budget is not None else "") + "）")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info(f"停止渲染服务")
+        server.summary.log_table()
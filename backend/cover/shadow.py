@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阴影和圆角遮罩模块
+按尺寸缓存模糊后的阴影层和圆角遮罩，同尺寸的图片复用同一份结果；
+阴影层由预先模糊好的九宫格模板拼接而成，耗时只与周长有关，与面积无关
+"""
+
+from functools import lru_cache
+from typing import Dict, Tuple
+from PIL import Image, ImageDraw, ImageFilter
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .image_cache import LRUImageCache
+except ImportError:
+    from image_cache import LRUImageCache
+
+# 阴影层和圆角遮罩缓存的容量（按像素字节数计算）
+SHADOW_CACHE_BYTES = 192 * 1024 * 1024
+MASK_CACHE_BYTES = 64 * 1024 * 1024
+
+# 阴影颜色（半透明黑色）
+SHADOW_COLOR = (0, 0, 0, 100)
+
+# 九宫格模板中阴影矩形的边缘到中心线的距离需要超过 圆角半径 + 模糊半径 × 该倍数，
+# 保证中心行列不受圆角和模糊影响，可以直接拉伸
+NINE_SLICE_BLUR_EXTENT = 4
+
+# 键为 (尺寸, 圆角半径, 阴影偏移, 模糊半径)
+_shadow_layers = LRUImageCache(SHADOW_CACHE_BYTES)
+
+# 键为 (尺寸, 圆角半径)
+_rounded_masks = LRUImageCache(MASK_CACHE_BYTES)
+
+
+def shadow_margin(offset: Tuple[int, int], blur: int) -> int:
+    """
+    计算阴影层四周需要预留的边距
+
+    Args:
+        offset: 阴影偏移
+        blur: 模糊半径
+
+    Returns:
+        边距（像素）
+    """
+    return max(offset) + blur
+
+
+def create_rounded_rectangle_mask(size: Tuple[int, int], radius: int) -> Image.Image:
+    """
+    创建圆角矩形遮罩
+
+    Args:
+        size: 图片尺寸 (width, height)
+        radius: 圆角半径
+
+    Returns:
+        遮罩图片
+    """
+    mask = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(mask)
+
+    # 绘制圆角矩形
+    draw.rounded_rectangle(
+        [(0, 0), size],
+        radius=radius,
+        fill=255
+    )
+
+    return mask
+
+
+def render_shadow_layer(
+    size: Tuple[int, int],
+    radius: int,
+    offset: Tuple[int, int],
+    blur: int,
+    color: Tuple[int, int, int, int] = SHADOW_COLOR
+) -> Image.Image:
+    """
+    绘制并模糊整个阴影层（精确结果，耗时与面积成正比）
+
+    Args:
+        size: 图片尺寸 (width, height)
+        radius: 圆角半径
+        offset: 阴影偏移
+        blur: 模糊半径
+        color: 阴影颜色
+
+    Returns:
+        阴影层（RGBA，四周各比图片多出 shadow_margin 像素）
+    """
+    margin = shadow_margin(offset, blur)
+    canvas_size = (size[0] + margin * 2, size[1] + margin * 2)
+    shadow = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
+    shadow_draw = ImageDraw.Draw(shadow)
+
+    shadow_rect = [
+        (margin + offset[0], margin + offset[1]),
+        (margin + size[0] + offset[0], margin + size[1] + offset[1])
+    ]
+    shadow_draw.rounded_rectangle(shadow_rect, radius=radius, fill=color)
+
+    return shadow.filter(ImageFilter.GaussianBlur(radius=blur))
+
+
+@lru_cache(maxsize=16)
+def _shadow_template(radius: int, offset: Tuple[int, int], blur: int, color: Tuple[int, int, int, int]) -> Image.Image:
+    """
+    绘制九宫格模板：一个刚好足够大的阴影层，中心行列在拉伸方向上完全均匀
+
+    Args:
+        radius: 圆角半径
+        offset: 阴影偏移
+        blur: 模糊半径
+        color: 阴影颜色
+
+    Returns:
+        模板阴影层（宽高为奇数，中心行列即拉伸用的切片）
+    """
+    half = radius + blur * NINE_SLICE_BLUR_EXTENT + max(offset)
+    return render_shadow_layer((half * 2 + 1, half * 2 + 1), radius, offset, blur, color)
+
+
+def render_shadow_nine_slice(
+    size: Tuple[int, int],
+    radius: int,
+    offset: Tuple[int, int],
+    blur: int,
+    color: Tuple[int, int, int, int] = SHADOW_COLOR
+) -> Image.Image:
+    """
+    用九宫格模板拼接任意尺寸的阴影层
+
+    四个角直接复制模板的四个角，四条边由模板的中心行列拉伸而成，中间填充模板中心的颜色。
+    结果与 render_shadow_layer 逐像素基本一致（模糊算法的舍入误差以内）。
+    尺寸小于模板时直接调用 render_shadow_layer。
+
+    Args:
+        size: 图片尺寸 (width, height)
+        radius: 圆角半径
+        offset: 阴影偏移
+        blur: 模糊半径
+        color: 阴影颜色
+
+    Returns:
+        阴影层（RGBA，四周各比图片多出 shadow_margin 像素）
+    """
+    template = _shadow_template(radius, offset, blur, color)
+    margin = shadow_margin(offset, blur)
+    width, height = size[0] + margin * 2, size[1] + margin * 2
+    if width < template.width or height < template.height:
+        return render_shadow_layer(size, radius, offset, blur, color)
+
+    # 模板宽高为奇数，cx、cy 为中心列、中心行，两侧的角宽高均为 cx、cy
+    cx, cy = template.width // 2, template.height // 2
+    stretch_w, stretch_h = width - cx * 2, height - cy * 2
+
+    shadow = Image.new('RGBA', (width, height), template.getpixel((cx, cy)))
+
+    # 四个角
+    shadow.paste(template.crop((0, 0, cx, cy)), (0, 0))
+    shadow.paste(template.crop((cx + 1, 0, template.width, cy)), (width - cx, 0))
+    shadow.paste(template.crop((0, cy + 1, cx, template.height)), (0, height - cy))
+    shadow.paste(template.crop((cx + 1, cy + 1, template.width, template.height)), (width - cx, height - cy))
+
+    # 四条边（中心行列在拉伸方向上是均匀的，最近邻拉伸即可）
+    nearest = Image.Resampling.NEAREST
+    shadow.paste(template.crop((cx, 0, cx + 1, cy)).resize((stretch_w, cy), nearest), (cx, 0))
+    shadow.paste(template.crop((cx, cy + 1, cx + 1, template.height)).resize((stretch_w, cy), nearest), (cx, height - cy))
+    shadow.paste(template.crop((0, cy, cx, cy + 1)).resize((cx, stretch_h), nearest), (0, cy))
+    shadow.paste(template.crop((cx + 1, cy, template.width, cy + 1)).resize((cx, stretch_h), nearest), (width - cx, cy))
+
+    return shadow
+
+
+def get_rounded_mask(size: Tuple[int, int], radius: int) -> Image.Image:
+    """
+    获取圆角矩形遮罩（缓存，只读）
+
+    Args:
+        size: 图片尺寸 (width, height)
+        radius: 圆角半径
+
+    Returns:
+        遮罩图片
+    """
+    key = (size, radius)
+    mask = _rounded_masks.get(key)
+    if mask is None:
+        mask = _rounded_masks.put(key, create_rounded_rectangle_mask(size, radius))
+    return mask
+
+
+def get_shadow_layer(size: Tuple[int, int], radius: int, offset: Tuple[int, int], blur: int) -> Image.Image:
+    """
+    获取模糊后的阴影层（缓存，只读，使用前需要复制）
+
+    Args:
+        size: 图片尺寸 (width, height)
+        radius: 圆角半径
+        offset: 阴影偏移
+        blur: 模糊半径
+
+    Returns:
+        阴影层
+    """
+    key = (size, radius, offset, blur)
+    shadow = _shadow_layers.get(key)
+    if shadow is None:
+        shadow = _shadow_layers.put(key, render_shadow_nine_slice(size, radius, offset, blur))
+    return shadow
+
+
+def shadow_cache_stats() -> Dict[str, int]:
+    """
+    获取阴影层和圆角遮罩缓存的命中统计
+
+    Returns:
+        统计信息
+    """
+    return {
+        'shadow_hits': _shadow_layers.hits,
+        'shadow_misses': _shadow_layers.misses,
+        'shadow_bytes': _shadow_layers.current_bytes,
+        'mask_hits': _rounded_masks.hits,
+        'mask_misses': _rounded_masks.misses,
+        'mask_bytes': _rounded_masks.current_bytes
+    }
+
+
+def clear_shadow_cache() -> None:
+    """
+    清空阴影层和圆角遮罩缓存
+    """
+    _shadow_layers.clear()
+    _rounded_masks.clear()
+    _shadow_template.cache_clear()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时分析模块
+在新的解释器进程中使用 -X importtime 冷启动导入指定模块，统计每个模块的导入耗时
+"""
+
+import re
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# -X importtime 输出行格式：import time: <自身耗时 us> | <累计耗时 us> | <缩进的模块名>
+IMPORTTIME_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+
+@dataclass(frozen=True)
+class ImportTiming:
+    """
+    单个模块的导入耗时（微秒）
+    """
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+@dataclass(frozen=True)
+class StartupProfile:
+    """
+    一次冷启动导入的分析结果
+    """
+    module: str
+    total_us: int
+    wall_ms: float
+    timings: List[ImportTiming]
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """
+    解析 -X importtime 的输出
+
+    Args:
+        output: 子进程的标准错误输出
+
+    Returns:
+        按导入完成顺序排列的模块耗时列表
+    """
+    timings = []
+    for line in output.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        timings.append(ImportTiming(module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return timings
+
+
+def profile_startup(module: str = 'puzzle', cwd: Optional[Path] = None) -> StartupProfile:
+    """
+    在新的解释器进程中冷启动导入模块并统计导入耗时
+
+    Args:
+        module: 要导入的模块名
+        cwd: 子进程工作目录，默认为本模块所在目录
+
+    Returns:
+        启动耗时分析结果
+    """
+    cwd = cwd or Path(__file__).parent
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd,
+        capture_output=True,
+        text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败: {result.stderr.strip().splitlines()[-1:]}")
+
+    timings = parse_importtime(result.stderr)
+    total_us = next((t.cumulative_us for t in reversed(timings) if t.module == module and t.depth == 0), 0)
+    return StartupProfile(module, total_us, wall_ms, timings)
+
+
+def format_startup_report(profile: StartupProfile, top: int = 15) -> str:
+    """
+    生成启动耗时报告
+
+    Args:
+        profile: 启动耗时分析结果
+        top: 列出自身耗时最长的模块数量
+
+    Returns:
+        报告文本
+    """
+    # 按顶层包汇总自身耗时
+    packages: Dict[str, int] = {}
+    for timing in profile.timings:
+        package = timing.module.split('.')[0]
+        packages[package] = packages.get(package, 0) + timing.self_us
+
+    lines = [
+        f"冷启动导入 {profile.module}: {profile.total_us / 1000:.1f} ms（进程总耗时 {profile.wall_ms:.1f} ms，共导入 {len(profile.timings)} 个模块）",
+        "",
+        f"按顶层包汇总（前 {top} 个）:"
+    ]
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  {self_us / 1000:8.1f} ms  {package}")
+
+    lines.append("")
+    lines.append(f"自身耗时最长的模块（前 {top} 个）:")
+    lines.append(f"  {'自身(ms)':>8}  {'累计(ms)':>8}  模块")
+    for timing in sorted(profile.timings, key=lambda t: t.self_us, reverse=True)[:top]:
+        lines.append(f"  {timing.self_us / 1000:8.1f}  {timing.cumulative_us / 1000:8.1f}  {timing.module}")
+    return '\n'.join(lines)
@@ -0,0 +1,907 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼图处理测试
+运行方式：make test（或在本目录执行 python -m pytest test_puzzle.py）
+"""
+
+import base64
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+import puzzle
+import shadow
+import utils
+from blur import FAST_BLUR_MIN_RADIUS, fast_blur_plan, gaussian_blur
+from color_extract import extract_main_color
+from context import MemoryPuzzleContext
+from encoding import (
+    JPEG_MAX_QUALITY,
+    JPEG_MIN_QUALITY,
+    JPEG_QUALITY_STEP,
+    PNG_ESTIMATE_TOLERANCE,
+    encode_image,
+    encode_jpeg_within,
+    estimate_optimized_png_size,
+    search_jpeg_quality
+)
+from image_cache import DirectoryImageCache, LRUImageCache
+from layout import plan_mobile_puzzle, plan_pad_puzzle, plan_pc_puzzle
+from instrument import RunSummary
+from manifest import MANIFEST_NAME
+from memory_budget import MB, WORKER_BASELINE_BYTES, MemoryBudget
+from metrics import PuzzleMetrics
+from api import build_puzzles, iter_puzzles, missing_inputs
+from puzzle import OUTPUT_SPECS, output_build_inputs, process_directories_parallel, process_directory
+from server import MAX_REQUEST_BYTES, PuzzleServer, RequestError
+from shadow import get_rounded_mask, get_shadow_layer, render_shadow_layer, render_shadow_nine_slice, shadow_cache_stats
+from startup_profile import profile_startup
+from watch import DirectoryWatcher
+from utils import (
+    BACK_IMAGE,
+    BORDER_RADIUS,
+    MOBILE_BLOCK_COVER,
+    PAD_BLOCK_COVER,
+    PAD_LOCK_COVER,
+    PC_MAC_COVER,
+    SHADOW_BLUR,
+    SHADOW_OFFSET,
+    add_shadow_and_rounded_corners,
+    create_background,
+    get_cover_overlay,
+    overlay_images,
+    overlay_onto,
+    paste_with_shadow
+)
+
+# 只在自动提取主色调时才需要的重量级依赖，不应在启动时导入
+HEAVY_MODULES = ('numpy', 'sklearn')
+
+# 每条处理链的输入图片尺寸（缩小的截图，保持各设备的比例）
+CHAIN_INPUTS = {
+    'mobile': {'mobile': (387, 838), 'mobile-lock': (387, 838)},
+    'pc': {'pc': (960, 540)},
+    'pad': {'pad': (800, 600)}
+}
+
+# 九宫格阴影与整图模糊阴影允许的最大逐像素通道误差（模糊算法的舍入误差）
+SHADOW_TOLERANCE = 2
+
+# 快速模糊与精确高斯模糊允许的最大逐像素通道误差
+FAST_BLUR_TOLERANCE = 6
+
+# 直接绘制到画布上的阴影和覆盖图与原先先生成 RGBA 图片再粘贴/合成的结果允许的最大逐像素通道误差（舍入误差）
+COMPOSITE_TOLERANCE = 2
+
+
+def max_channel_error(a: Image.Image, b: Image.Image) -> int:
+    """
+    两张同尺寸、同模式图片的最大逐像素通道误差
+    """
+    assert a.size == b.size and a.mode == b.mode
+    return max(high for _, high in ImageChops.difference(a, b).getextrema())
+
+
+def make_screenshot(size: Tuple[int, int]) -> Image.Image:
+    """
+    生成合成截图：渐变底色 + 圆角色块
+    """
+    gradient = Image.linear_gradient('L')
+    image = Image.merge('RGB', [gradient.resize(size), gradient.rotate(90).resize(size), Image.new('L', size, 128)])
+    draw = ImageDraw.Draw(image)
+    for i in range(40):
+        x, y = (i % 5) * size[0] // 5 + 10, (i // 5) * size[1] // 8 + 10
+        color = ((i * 53) % 256, (i * 97) % 256, (i * 31) % 256)
+        draw.rounded_rectangle([x, y, x + size[0] // 8, y + size[1] // 12], radius=12, fill=color)
+    return image
+
+
+def make_canvas(with_sprite: bool) -> Image.Image:
+    """
+    生成照片背景的拼图画布，可选贴上一张合成截图
+    """
+    canvas = create_background((1200, 900))
+    if with_sprite:
+        canvas.paste(make_screenshot((700, 450)), (250, 220))
+    return canvas
+
+
+@pytest.mark.parametrize('module', ['puzzle', 'api', 'server'])
+def test_cold_import_skips_heavy_modules(module):
+    """
+    冷启动导入入口模块时不导入 numpy / sklearn（检查导入的模块而不是耗时，结果与机器快慢无关）
+    """
+    profile = profile_startup(module)
+    imported = {timing.module.split('.')[0] for timing in profile.timings}
+    assert not imported & set(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize('with_sprite', [False, True], ids=['background', 'composite'])
+def test_png_size_estimate_within_tolerance(with_sprite):
+    """
+    抽样估算的优化 PNG 大小与实际优化编码的大小相差不超过 PNG_ESTIMATE_TOLERANCE
+    """
+    canvas = make_canvas(with_sprite)
+    fast_size = len(encode_image(canvas, 'PNG', compress_level=1))
+    actual = len(encode_image(canvas, 'PNG', optimize=True))
+    estimate = estimate_optimized_png_size(canvas, fast_size)
+    assert abs(estimate - actual) <= actual * PNG_ESTIMATE_TOLERANCE
+
+
+@pytest.mark.parametrize('radius, offset, blur', [
+    (BORDER_RADIUS, SHADOW_OFFSET, SHADOW_BLUR),
+    (0, (0, 0), 4),
+    (40, (12, 3), 20)
+])
+@pytest.mark.parametrize('size', [(40, 40), (111, 111), (200, 90), (300, 200), (700, 1500), (1600, 900)])
+def test_nine_slice_shadow_matches_full_blur(size, radius, offset, blur):
+    """
+    九宫格拼接的阴影层与整图模糊的阴影层逐像素一致（舍入误差以内），
+    包括比九宫格模板（2 × half + 1）更小、回退到整图模糊的尺寸
+    """
+    exact = render_shadow_layer(size, radius, offset, blur)
+    sliced = render_shadow_nine_slice(size, radius, offset, blur)
+    assert max_channel_error(exact, sliced) <= SHADOW_TOLERANCE
+
+
+@pytest.mark.parametrize('radius', [2, 5, 7.5, FAST_BLUR_MIN_RADIUS * 2 - 0.5])
+def test_fast_blur_small_radius_is_exact(radius):
+    """
+    半径小于 2 × FAST_BLUR_MIN_RADIUS 时不缩小（缩小倍数为 1），fast 模式与 exact 模式结果完全相同
+    """
+    image = make_screenshot((400, 600))
+    assert fast_blur_plan(image.size, radius)[0] == 1
+    assert gaussian_blur(image, radius, 'fast').tobytes() == gaussian_blur(image, radius, 'exact').tobytes()
+
+
+@pytest.mark.parametrize('radius', [FAST_BLUR_MIN_RADIUS * 2, 70, 140, 280])
+@pytest.mark.parametrize('size', [(645, 1398), (1290, 2796)])
+def test_fast_blur_within_tolerance(size, radius):
+    """
+    快速模糊（缩小 → 模糊 → 放大）与精确高斯模糊的逐像素误差不超过 FAST_BLUR_TOLERANCE
+    """
+    image = make_screenshot(size)
+    assert fast_blur_plan(size, radius)[0] > 1
+    error = max_channel_error(gaussian_blur(image, radius, 'exact'), gaussian_blur(image, radius, 'fast'))
+    assert error <= FAST_BLUR_TOLERANCE
+
+
+def make_translucent(image: Image.Image) -> Image.Image:
+    """
+    为图片加上从左到右渐变的透明通道
+    """
+    image = image.convert('RGBA')
+    image.putalpha(Image.linear_gradient('L').rotate(90).resize(image.size))
+    return image
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('size, radius', [((300, 500), BORDER_RADIUS), ((120, 80), 40), ((20, 20), BORDER_RADIUS)])
+def test_paste_with_shadow_matches_shadowed_sprite_paste(mode, size, radius):
+    """
+    paste_with_shadow 直接绘制到画布上的结果与原先 add_shadow_and_rounded_corners 后以自身为遮罩粘贴的结果一致
+    （RGBA 截图自身的透明通道在两种方式中都被圆角遮罩替换）
+    """
+    sprite = make_screenshot(size)
+    if mode == 'RGBA':
+        sprite = make_translucent(sprite)
+    position = (37, 21)
+
+    expected = make_canvas(False)
+    shadowed = add_shadow_and_rounded_corners(sprite, radius)
+    expected.paste(shadowed, position, shadowed)
+
+    actual = make_canvas(False)
+    paste_with_shadow(actual, sprite, position, radius)
+    assert max_channel_error(expected, actual) <= COMPOSITE_TOLERANCE
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('position', [(0, 0), (150, 90)])
+def test_overlay_onto_matches_alpha_composite(mode, position):
+    """
+    overlay_onto 直接叠加到 RGB 画布上的结果与原先转换为 RGBA 后 alpha_composite 再转回 RGB 的结果一致，
+    覆盖图可以是不透明的 RGB 图片或带半透明区域的 RGBA 图片
+    """
+    overlay = make_screenshot((500, 400))
+    if mode == 'RGBA':
+        overlay = make_translucent(overlay)
+        # 完全透明的边框，overlay_onto 只处理不透明像素所在的区域
+        overlay.paste((0, 0, 0, 0), (0, 0, 500, 30))
+
+    base = make_canvas(False)
+    composite = base.convert('RGBA')
+    composite.alpha_composite(overlay.convert('RGBA'), position)
+    expected = composite.convert('RGB')
+
+    actual = overlay_onto(base.copy(), overlay, position)
+    assert actual.mode == 'RGB'
+    assert max_channel_error(expected, actual) <= COMPOSITE_TOLERANCE
+
+
+# 候选的 JPEG 质量（从高到低）
+JPEG_QUALITIES = list(range(JPEG_MAX_QUALITY, JPEG_MIN_QUALITY, -JPEG_QUALITY_STEP)) + [JPEG_MIN_QUALITY]
+
+
+def test_jpeg_quality_search_picks_highest_fitting_quality():
+    """
+    查找选出的质量是候选质量中满足大小限制的最高质量。原先逐级降低质量的线性查找在第 i 个候选质量满足时编码 i + 1 次：
+    指数试探 + 二分在靠近上限时最多多编码一次，总次数和最坏情况的次数（不到线性查找的一半）都更少
+    """
+    canvas = make_canvas(True)
+    sizes = [len(encode_image(canvas, 'JPEG', quality=quality, optimize=True)) for quality in JPEG_QUALITIES]
+
+    searched, linear = [], []
+    for target in range(len(JPEG_QUALITIES)):
+        max_size = sizes[target]
+        expected = next(i for i, size in enumerate(sizes) if size <= max_size)
+        data, quality, encodes, fits = search_jpeg_quality(canvas, max_size)
+        assert fits and quality == JPEG_QUALITIES[expected]
+        assert len(data) == sizes[expected]
+        assert encodes <= expected + 2
+        searched.append(encodes)
+        linear.append(expected + 1)
+    assert sum(searched) < sum(linear)
+    assert max(searched) * 2 <= max(linear)
+
+
+def test_jpeg_quality_search_falls_back_when_nothing_fits():
+    """
+    最低质量仍超出限制时返回最低质量的编码结果（不满足限制），encode_jpeg_within 缩小尺寸后重新查找
+    """
+    canvas = make_canvas(True)
+    min_size = len(encode_image(canvas, 'JPEG', quality=JPEG_MIN_QUALITY, optimize=True))
+    max_size = min_size // 2
+
+    data, quality, encodes, fits = search_jpeg_quality(canvas, max_size)
+    assert not fits and quality == JPEG_MIN_QUALITY and len(data) == min_size
+    # 线性查找要把全部候选质量都编码一遍
+    assert encodes < len(JPEG_QUALITIES)
+
+    result = encode_jpeg_within(canvas, max_size)
+    assert result.resized and result.size[0] < canvas.width and result.size[1] < canvas.height
+    assert result.encodes > encodes
+
+
+def read_outputs(work_dir: Path) -> dict:
+    """
+    读取目录下已生成的拼图（不包括构建清单）
+    """
+    return {path.name: path.read_bytes() for path in (work_dir / 'intr').iterdir() if path.name != MANIFEST_NAME}
+
+
+@pytest.mark.parametrize('chain', CHAIN_INPUTS)
+def test_changed_input_regenerates_intermediates(tmp_path, chain):
+    """
+    原图变化后重建拼图时，不使用上次运行留在磁盘上的中间图片（mobile-desktop.png 等），
+    结果与在新目录中从头处理完全相同
+    """
+    inputs = CHAIN_INPUTS[chain]
+    work_dir = tmp_path / 'set'
+    work_dir.mkdir()
+    for name, size in inputs.items():
+        make_screenshot(size).save(work_dir / f"{name}.png")
+    assert process_directory(work_dir, '#ffffff', only=[chain], keep_intermediates=True)
+
+    # 替换主输入图片，磁盘上仍保留由旧图片生成的中间图片
+    Image.new('RGB', inputs[chain], (255, 0, 0)).save(work_dir / f"{chain}.png")
+    assert process_directory(work_dir, '#ffffff', only=[chain])
+
+    fresh_dir = tmp_path / 'fresh'
+    fresh_dir.mkdir()
+    for name in inputs:
+        (fresh_dir / f"{name}.png").write_bytes((work_dir / f"{name}.png").read_bytes())
+    assert process_directory(fresh_dir, '#ffffff', only=[chain])
+
+    assert read_outputs(work_dir) == read_outputs(fresh_dir)
+
+
+def crash_worker(work_dir: Path, main_color, **options):
+    """
+    模拟工作进程异常退出（进程池随之变为 BrokenProcessPool）
+    """
+    os._exit(1)
+
+
+def test_crashed_worker_counts_as_failed_directory(tmp_path, monkeypatch):
+    """
+    工作进程崩溃时，目录按失败计入运行汇总和 puzzle_directories_total{result="failure"}
+    """
+    subdirs = [tmp_path / f"set{i}" for i in range(2)]
+    for subdir in subdirs:
+        subdir.mkdir()
+    monkeypatch.setattr(puzzle, 'process_directory_safe', crash_worker)
+    summary = RunSummary(metrics=PuzzleMetrics(), show_table=False)
+
+    assert process_directories_parallel(subdirs, None, jobs=2, summary=summary) == 0
+    assert sorted(record['directory'] for record in summary.directories) == ['set0', 'set1']
+    assert not any(record['success'] for record in summary.directories)
+    assert 'puzzle_directories_total{result="failure"} 2' in summary.metrics.render().decode()
+
+
+def make_budget(available_mb: int, hold: float = 10) -> MemoryBudget:
+    """
+    单个工作进程、可用预算为 available_mb 的内存预算
+    """
+    return MemoryBudget(WORKER_BASELINE_BYTES + available_mb * MB, 1, hold)
+
+
+def test_budget_reserves_for_skipped_directory():
+    """
+    放不下的目录为自己预留内存：之后较小的目录不能占用预留的部分，正在处理的目录完成后它即可接纳
+    """
+    budget = make_budget(1000)
+    assert budget.try_acquire(400 * MB)
+    assert budget.try_acquire(300 * MB)
+    assert not budget.try_acquire(600 * MB)
+    # 没有预留时放得下的较小目录不能插队
+    assert not budget.try_acquire(300 * MB)
+    budget.release(300 * MB)
+    assert not budget.try_acquire(200 * MB)
+    assert budget.try_acquire(600 * MB)
+    assert budget.reserved == 0
+    assert budget.try_acquire(0)
+
+
+def test_budget_oversized_directory_runs_after_drain():
+    """
+    超出整个预算的目录等待时不再接纳其他目录，正在处理的目录全部完成后单独处理
+    """
+    budget = make_budget(1000)
+    assert budget.try_acquire(100 * MB)
+    assert not budget.try_acquire(1500 * MB)
+    assert not budget.try_acquire(50 * MB)
+    budget.release(100 * MB)
+    assert budget.try_acquire(1500 * MB)
+
+
+def test_budget_reservation_expires_without_retry():
+    """
+    等待的目录 hold 秒内没有重试时取消预留（请求已放弃），其他目录不会一直被挡住
+    """
+    budget = make_budget(1000, hold=0.05)
+    assert budget.try_acquire(600 * MB)
+    assert not budget.try_acquire(700 * MB)
+    assert not budget.try_acquire(300 * MB)
+    time.sleep(0.1)
+    assert budget.try_acquire(300 * MB)
+    assert budget.reserved == 0
+
+
+@pytest.mark.parametrize('method', ['fast', 'kmeans'])
+def test_main_color_cache_follows_file_changes(tmp_path, method):
+    """
+    同一路径的图片被替换为同尺寸的其他图片后（--watch 中常驻的工作进程），主色调重新提取而不是使用缓存
+    """
+    def save(main: Tuple[int, int, int]) -> None:
+        # 主色调占大部分像素，另有两个小色块，保证三个聚类都不为空
+        image = Image.new('RGB', (64, 64), main)
+        image.paste((0, 255, 0), (0, 0, 8, 8))
+        image.paste((255, 255, 255), (56, 56, 64, 64))
+        image.save(path)
+
+    path = tmp_path / 'mobile-lock.png'
+    save((255, 0, 0))
+    with Image.open(path) as image:
+        assert extract_main_color(image, method=method) == (255, 0, 0)
+
+    save((0, 0, 255))
+    stat = path.stat()
+    # 保证修改时间变化（部分文件系统的时间精度较低）
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    with Image.open(path) as image:
+        assert extract_main_color(image, method=method) == (0, 0, 255)
+
+
+@pytest.mark.parametrize('main_color, uses_back', [(None, True), ('#ffffff', False), ('', False), ('nothex', True)])
+def test_back_image_is_input_only_for_default_background(tmp_path, main_color, uses_back):
+    """
+    只有使用默认背景（main_color 为 None 或无效颜色）时 back.jpg 才计入拼图的输入，替换它不会重建纯色背景的拼图
+    """
+    make_screenshot((960, 540)).save(tmp_path / 'pc.png')
+    inputs, _ = output_build_inputs(tmp_path, OUTPUT_SPECS['create_pc_puzzle'], main_color, DirectoryImageCache(), {})
+    assert (BACK_IMAGE.name in inputs) == uses_back
+
+
+def test_default_background_follows_back_image_changes(tmp_path, monkeypatch):
+    """
+    back.jpg 被替换后（--watch 常驻进程），默认背景重新解码而不是使用缓存
+    """
+    back = tmp_path / 'back.jpg'
+    monkeypatch.setattr(utils, 'BACK_IMAGE', back)
+    # 以 PNG 格式保存，颜色不受 JPEG 压缩影响
+    Image.new('RGB', (64, 64), (255, 0, 0)).save(back, 'PNG')
+    assert create_background((40, 30)).getpixel((20, 15)) == (255, 0, 0)
+
+    Image.new('RGB', (64, 64), (0, 0, 255)).save(back, 'PNG')
+    stat = back.stat()
+    os.utime(back, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert create_background((40, 30)).getpixel((20, 15)) == (0, 0, 255)
+
+
+@pytest.fixture
+def render_server(tmp_path):
+    """
+    在后台线程中运行的渲染服务（单个请求名额，渲染在当前进程的单个线程中执行），图片根目录为 tmp_path/imgs
+    """
+    root = tmp_path / 'imgs'
+    root.mkdir()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        server = PuzzleServer(('127.0.0.1', 0), executor, 1, root)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+
+def post_render(server: PuzzleServer, body: bytes = b'', headers: Optional[dict] = None) -> Tuple[int, dict, dict]:
+    """
+    向渲染服务发送 POST /render，headers 为 None 时按请求体设置 Content-Length
+
+    Returns:
+        (状态码, 响应 JSON, 响应头)
+    """
+    conn = http.client.HTTPConnection(*server.server_address, timeout=60)
+    try:
+        conn.putrequest('POST', '/render', skip_accept_encoding=True)
+        for name, value in (headers or {'Content-Length': str(len(body))}).items():
+            conn.putheader(name, value)
+        conn.endheaders(body or None)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read()), dict(response.getheaders())
+    finally:
+        conn.close()
+
+
+def render_request(request: dict) -> bytes:
+    return json.dumps(request).encode('utf-8')
+
+
+def png_bytes(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('length', ['abc', '-1', '1.5'])
+def test_server_rejects_invalid_content_length(render_server, length):
+    """
+    无法解析或为负数的 Content-Length 返回 400（负数会让 rfile.read 一直读到连接关闭）
+    """
+    status, body, _ = post_render(render_server, headers={'Content-Length': length})
+    assert status == 400
+    assert 'Content-Length' in body['error']
+
+
+def test_server_rejects_oversized_request(render_server):
+    """
+    超过 MAX_REQUEST_BYTES 的请求体在读取之前返回 413
+    """
+    status, _, _ = post_render(render_server, headers={'Content-Length': str(MAX_REQUEST_BYTES + 1)})
+    assert status == 413
+
+
+def test_server_busy_when_no_slot(render_server):
+    """
+    没有空闲的处理名额时立即返回 503 busy（带 Retry-After），不排队等待
+    """
+    assert render_server.try_acquire()
+    try:
+        status, body, headers = post_render(render_server, render_request({'dir': 'set0'}))
+    finally:
+        render_server.release()
+    assert status == 503
+    assert body['error'] == 'busy'
+    assert headers['Retry-After'] == '1'
+
+
+def test_server_busy_when_over_memory_budget(render_server):
+    """
+    内存预估超出剩余预算时返回 503 busy，reason 中给出预估
+    """
+    work_dir = render_server.root / 'set0'
+    work_dir.mkdir()
+    make_screenshot((960, 540)).save(work_dir / 'pc.png')
+    render_server.budget = make_budget(1000)
+    assert render_server.budget.try_acquire(990 * MB)
+
+    status, body, headers = post_render(render_server, render_request({'dir': 'set0', 'only': ['pc']}))
+    assert status == 503
+    assert body['error'] == 'busy' and '预估内存峰值' in body['reason']
+    assert headers['Retry-After'] == '1'
+    assert not (work_dir / 'intr').exists()
+
+
+@pytest.mark.parametrize('target', ['../outside', 'outside-link', 'absolute'])
+def test_server_rejects_directory_outside_root(render_server, tmp_path, target):
+    """
+    dir 指向图片根目录之外（.. 路径、指向外部的符号链接、绝对路径）时返回 400，不处理该目录
+    """
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    make_screenshot((960, 540)).save(outside / 'pc.png')
+    (render_server.root / 'outside-link').symlink_to(outside)
+    value = str(outside) if target == 'absolute' else target
+
+    with pytest.raises(RequestError):
+        render_server.resolve_directory(value)
+    status, body, _ = post_render(render_server, render_request({'dir': value, 'only': ['pc']}))
+    assert status == 400
+    assert '不在图片根目录内' in body['error']
+    assert not (outside / 'intr').exists()
+
+
+def test_server_renders_uploads_in_memory(render_server):
+    """
+    上传的图片在内存中处理，结果与库接口 build_puzzles 相同，处理统计计入服务的汇总
+    """
+    pc = png_bytes(make_screenshot((960, 540)))
+    request = {'images': {'pc.png': base64.b64encode(pc).decode('ascii')}, 'only': ['pc'], 'main_color': '#ffffff'}
+    status, body, _ = post_render(render_server, render_request(request))
+    assert status == 200 and body['success']
+
+    expected = build_puzzles({'pc': pc}, '#ffffff', ['pc'])
+    assert {output['name']: base64.b64decode(output['data']) for output in body['outputs']} == \
+        {name: output.data for name, output in expected.items()}
+    assert 'path' not in body['outputs'][0]
+    record = render_server.summary.directories[-1]
+    assert record['directory'] == 'upload' and record['success'] and record['stages']
+    assert [output['name'] for output in record['outputs']] == ['pc-combined.jpg']
+
+
+def test_server_rejects_incomplete_uploads(render_server):
+    """
+    所选处理链缺少必需的上传图片时返回 400
+    """
+    lock = png_bytes(make_screenshot((387, 838)))
+    request = {'images': {'mobile-lock.png': base64.b64encode(lock).decode('ascii')}, 'only': ['mobile']}
+    status, body, _ = post_render(render_server, render_request(request))
+    assert status == 400
+    assert 'mobile.png' in body['error']
+
+
+def test_build_puzzles_bytes_in_bytes_out(tmp_path):
+    """
+    库接口输入编码后的字节、输出编码后的字节，结果与命令行处理同一张图片写出的文件相同
+    """
+    pc = png_bytes(make_screenshot((960, 540)))
+    outputs = build_puzzles({'pc.png': pc}, '#ffffff', ['pc'])
+    assert list(outputs) == ['pc-combined.jpg']
+    output = outputs['pc-combined.jpg']
+    assert output.image.format == 'JPEG' and output.nbytes == len(output.data)
+    with Image.open(io.BytesIO(output.data)) as image:
+        assert image.format == 'JPEG' and image.size == output.image.size
+
+    (tmp_path / 'pc.png').write_bytes(pc)
+    assert process_directory(tmp_path, '#ffffff', only=['pc'])
+    assert (tmp_path / 'intr' / 'pc-combined.jpg').read_bytes() == output.data
+
+
+def test_missing_inputs_rejects_partial_input_sets():
+    """
+    所选处理链缺少必需的输入时 missing_inputs 列出缺少的文件，iter_puzzles 在开始处理前抛出 ValueError
+    """
+    mobile = png_bytes(make_screenshot((387, 838)))
+    ctx = MemoryPuzzleContext({'mobile': mobile, 'pad-lock': mobile})
+    assert missing_inputs(ctx, ['mobile']) == ['mobile-lock.png']
+    assert missing_inputs(ctx, ['pc', 'pad']) == ['pc.png', 'pad.png']
+    assert missing_inputs(MemoryPuzzleContext({'mobile': mobile, 'mobile-lock': mobile}), ['mobile']) == []
+
+    with pytest.raises(ValueError, match='mobile-lock.png'):
+        next(iter_puzzles({'mobile': mobile}, only=['mobile']))
+    with pytest.raises(ValueError, match='pc.png'):
+        build_puzzles({'mobile': mobile, 'mobile-lock': mobile})
+
+
+def test_iter_puzzles_raises_after_successful_outputs():
+    """
+    有拼图生成失败时，已完成的拼图先全部产出，全部阶段结束后才抛出 RuntimeError
+    """
+    inputs = {'pc': png_bytes(make_screenshot((960, 540))), 'pad': b'not an image'}
+    produced = []
+    with pytest.raises(RuntimeError, match='create_pad_puzzle'):
+        for output in iter_puzzles(inputs, '#ffffff', ['pc', 'pad']):
+            produced.append(output.name)
+    assert produced == ['pc-combined.jpg']
+
+
+def test_iter_puzzles_early_stop_does_not_hang():
+    """
+    调用方只取第一张拼图就停止迭代时不会阻塞，后台线程完成剩余阶段后退出
+    """
+    screenshot = png_bytes(make_screenshot((387, 838)))
+    before = set(threading.enumerate())
+    puzzles = iter_puzzles({'mobile': screenshot, 'mobile-lock': screenshot}, '#ffffff', ['mobile'])
+    first = next(puzzles)
+    runners = [thread for thread in threading.enumerate() if thread not in before and thread.name == 'puzzle-stages']
+    assert first.name.startswith('mobile-combined')
+    puzzles.close()
+
+    for runner in runners:
+        runner.join(timeout=60)
+        assert not runner.is_alive()
+
+
+# 监视测试中文件的修改时间（秒），poll 的 now 以此为基准
+WATCH_EPOCH = 1_000_000.0
+
+
+def write_watched_file(path: Path, content: bytes, mtime: float) -> None:
+    """
+    写入文件并设置修改时间，使监视测试不依赖系统时钟
+    """
+    path.write_bytes(content)
+    os.utime(path, ns=(int(mtime * 1e9), int(mtime * 1e9)))
+
+
+def make_watcher(tmp_path: Path) -> Tuple[DirectoryWatcher, Path]:
+    work_dir = tmp_path / 'set0'
+    work_dir.mkdir()
+    return DirectoryWatcher(tmp_path, lambda d: (True, []), settle=3.0), work_dir
+
+
+def test_watcher_skips_directory_changing_within_settle_window(tmp_path):
+    """
+    settle 时间内内容仍在变化的目录不返回，直到最后一次变化后保持 settle 秒不变
+    """
+    watcher, work_dir = make_watcher(tmp_path)
+    write_watched_file(work_dir / 'pc.png', b'a', WATCH_EPOCH)
+    assert watcher.poll(now=WATCH_EPOCH + 1) == []
+
+    write_watched_file(work_dir / 'pc.png', b'ab', WATCH_EPOCH + 2)
+    assert watcher.poll(now=WATCH_EPOCH + 3.5) == []
+    assert watcher.poll(now=WATCH_EPOCH + 5) == []
+
+    # 保留原修改时间复制进来的文件（cp -p、解压）同样要等待 settle 秒
+    write_watched_file(work_dir / 'pad.png', b'c', WATCH_EPOCH - 60)
+    assert watcher.poll(now=WATCH_EPOCH + 6) == []
+    assert watcher.poll(now=WATCH_EPOCH + 8.5) == []
+    ready = watcher.poll(now=WATCH_EPOCH + 9)
+    assert [work_dir for work_dir, _ in ready] == [work_dir]
+
+
+def test_watcher_emits_stable_directory_once(tmp_path):
+    """
+    内容稳定的目录只返回一次；启动时已经稳定的目录首次轮询即返回
+    """
+    watcher, work_dir = make_watcher(tmp_path)
+    old_dir = tmp_path / 'set1'
+    old_dir.mkdir()
+    write_watched_file(old_dir / 'pc.png', b'a', WATCH_EPOCH - 60)
+    write_watched_file(work_dir / 'pc.png', b'a', WATCH_EPOCH)
+
+    (d, signature), = watcher.poll(now=WATCH_EPOCH + 1)
+    assert d == old_dir
+    watcher.mark_processed(d, signature)
+    assert watcher.poll(now=WATCH_EPOCH + 2) == []
+    (d, signature), = watcher.poll(now=WATCH_EPOCH + 4.5)
+    assert d == work_dir
+    watcher.mark_processed(d, signature)
+
+    for now in (WATCH_EPOCH + 5, WATCH_EPOCH + 10, WATCH_EPOCH + 100):
+        assert watcher.poll(now=now) == []
+
+
+def test_watcher_reemits_processed_directory_only_after_change(tmp_path):
+    """
+    已按当前签名处理过的目录不再返回；内容变化并稳定后按新签名再返回一次
+    """
+    watcher, work_dir = make_watcher(tmp_path)
+    write_watched_file(work_dir / 'pc.png', b'a', WATCH_EPOCH - 60)
+    (d, signature), = watcher.poll(now=WATCH_EPOCH)
+    watcher.mark_processed(d, signature)
+    assert watcher.poll(now=WATCH_EPOCH + 60) == []
+
+    write_watched_file(work_dir / 'pc.png', b'ab', WATCH_EPOCH + 61)
+    assert watcher.poll(now=WATCH_EPOCH + 62) == []
+    (d, new_signature), = watcher.poll(now=WATCH_EPOCH + 65)
+    assert d == work_dir and new_signature != signature
+    watcher.mark_processed(d, new_signature)
+    assert watcher.poll(now=WATCH_EPOCH + 120) == []
+
+
+def test_watcher_waits_for_complete_directory(tmp_path, caplog):
+    """
+    文件不完整的目录不返回，缺失文件在签名不变时只输出一次
+    """
+    work_dir = tmp_path / 'set0'
+    work_dir.mkdir()
+    write_watched_file(work_dir / 'mobile.png', b'a', WATCH_EPOCH - 60)
+    watcher = DirectoryWatcher(
+        tmp_path, lambda d: ((d / 'mobile-lock.png').exists(), ['mobile-lock.png']), settle=3.0
+    )
+    with caplog.at_level('INFO', logger='watch'):
+        assert watcher.poll(now=WATCH_EPOCH) == []
+        assert watcher.poll(now=WATCH_EPOCH + 10) == []
+    assert sum('mobile-lock.png' in record.getMessage() for record in caplog.records) == 1
+
+    write_watched_file(work_dir / 'mobile-lock.png', b'b', WATCH_EPOCH + 11)
+    assert watcher.poll(now=WATCH_EPOCH + 12) == []
+    assert [d for d, _ in watcher.poll(now=WATCH_EPOCH + 15)] == [work_dir]
+
+
+def test_lru_image_cache_evicts_by_byte_budget():
+    """
+    超出字节容量时淘汰最久未使用的图片，命中和未命中分别计数，超过容量的单张图片不缓存
+    """
+    cache = LRUImageCache(max_bytes=250)
+    images = {key: Image.new('L', (10, 10), value) for key, value in (('a', 1), ('b', 2), ('c', 3))}
+    assert cache.put('a', images['a']) is images['a']
+    cache.put('b', images['b'])
+    assert cache.current_bytes == 200
+
+    assert cache.get('a') is images['a']
+    cache.put('c', images['c'])
+    assert len(cache) == 2 and cache.current_bytes == 200
+    assert cache.get('b') is None
+    assert cache.get('c') is images['c']
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # 其他线程已放入同一个键时返回已有的图片
+    assert cache.put('a', Image.new('L', (10, 10))) is images['a']
+    assert cache.current_bytes == 200
+
+    oversized = Image.new('L', (16, 16))
+    assert cache.put('big', oversized) is oversized
+    assert cache.get('big') is None and len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0 and cache.current_bytes == 0
+
+
+def test_directory_image_cache_follows_file_changes(tmp_path):
+    """
+    目录图片缓存按 (路径, 修改时间, 解码尺寸) 命中，文件被修改后重新解码和读取尺寸
+    """
+    path = tmp_path / 'pc.png'
+    Image.new('RGB', (80, 40), (255, 0, 0)).save(path)
+    cache = DirectoryImageCache()
+    assert cache.find(tmp_path, 'pc') == path and cache.find(tmp_path, 'pad') is None
+
+    first = cache.open(path)
+    assert cache.open(path) is first
+    assert cache.source_size(path) == (80, 40)
+    reduced = cache.open(path, (20, 10))
+    assert reduced is not first and reduced.size == (20, 10)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    stat = path.stat()
+    Image.new('RGB', (60, 30), (0, 0, 255)).save(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    second = cache.open(path)
+    assert second is not first
+    assert second.size == (60, 30) and second.getpixel((0, 0)) == (0, 0, 255)
+    assert cache.source_size(path) == (60, 30)
+
+
+def cache_snapshot(cache: LRUImageCache) -> dict:
+    """
+    记录缓存中每张图片对象及其像素，用于检查共享的缓存图片没有被调用方原地修改
+    """
+    return {key: (image, image.tobytes()) for key, image in list(cache._items.items())}
+
+
+def render_all_chains() -> dict:
+    """
+    用默认背景在内存中生成全部拼图（包括 pad-lock）
+    """
+    inputs = {name: png_bytes(make_screenshot(size)) for chain in CHAIN_INPUTS.values() for name, size in chain.items()}
+    inputs['pad-lock'] = inputs['pad']
+    return {name: output.data for name, output in build_puzzles(inputs).items()}
+
+
+def test_cover_overlays_are_cached_and_never_modified():
+    """
+    覆盖图按 (覆盖图, 尺寸) 只生成一次，叠加和整批拼图生成都不会原地修改共享的覆盖图
+    """
+    overlay = get_cover_overlay(PC_MAC_COVER, (320, 200))
+    hits = utils._cover_overlays.hits
+    assert get_cover_overlay(PC_MAC_COVER, (320, 200)) is overlay
+    assert utils._cover_overlays.hits == hits + 1
+    assert overlay.mode == 'RGBA' and overlay.size == (320, 200)
+
+    pixels = overlay.tobytes()
+    base = make_screenshot((320, 200))
+    overlay_images(base, overlay)
+    overlay_onto(base, overlay)
+    assert overlay.tobytes() == pixels
+
+    first = render_all_chains()
+    snapshot = cache_snapshot(utils._cover_overlays)
+    assert {MOBILE_BLOCK_COVER, PAD_BLOCK_COVER, PAD_LOCK_COVER, PC_MAC_COVER} <= {path for path, _ in snapshot}
+    assert render_all_chains() == first
+    for key, (image, data) in snapshot.items():
+        assert utils._cover_overlays.get(key) is image
+        assert image.tobytes() == data, key
+
+
+@pytest.mark.parametrize('main_color, with_source, cache_name', [
+    (None, False, '_default_background_cached'),
+    ('#336699', False, '_solid_background'),
+    ('', True, '_solid_background'),
+    ('', False, '_default_background_cached'),
+    ('nothex', False, '_default_background_cached')
+])
+def test_create_background_returns_private_copies(main_color, with_source, cache_name):
+    """
+    背景按 (尺寸, 颜色) 只生成一次，每次返回缓存背景的副本，调用方在上面绘制不影响之后的调用
+    """
+    source = make_screenshot((120, 90)) if with_source else None
+    size = (300, 200)
+    first = create_background(size, main_color, source)
+    pixels = first.tobytes()
+    cached = getattr(utils, cache_name)
+    hits = cached.cache_info().hits
+
+    first.paste((255, 0, 0), (0, 0, 150, 100))
+    second = create_background(size, main_color, source)
+    assert second is not first
+    assert second.size == size and second.mode == 'RGB'
+    assert second.tobytes() == pixels
+    assert cached.cache_info().hits == hits + 1
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+def test_shadow_layers_are_cached_and_never_modified(mode):
+    """
+    阴影层和圆角遮罩按尺寸只生成一次，加阴影、直接绘制和整批拼图生成都不会原地修改共享的缓存图片
+    """
+    size = (210, 140)
+    layer = get_shadow_layer(size, BORDER_RADIUS, SHADOW_OFFSET, SHADOW_BLUR)
+    mask = get_rounded_mask(size, BORDER_RADIUS)
+    stats = shadow_cache_stats()
+    assert get_shadow_layer(size, BORDER_RADIUS, SHADOW_OFFSET, SHADOW_BLUR) is layer
+    assert shadow_cache_stats()['shadow_hits'] == stats['shadow_hits'] + 1
+
+    pixels = layer.tobytes(), mask.tobytes()
+    image = make_screenshot(size).convert(mode)
+    shadowed = add_shadow_and_rounded_corners(image)
+    shadowed.paste((255, 0, 0, 255), (0, 0, 40, 40))
+    paste_with_shadow(create_background((400, 300), '#ffffff'), image, (10, 10))
+    assert (layer.tobytes(), mask.tobytes()) == pixels
+    assert get_rounded_mask(size, BORDER_RADIUS) is mask
+
+    first = render_all_chains()
+    snapshots = cache_snapshot(shadow._shadow_layers), cache_snapshot(shadow._rounded_masks)
+    assert render_all_chains() == first
+    for cache, snapshot in zip((shadow._shadow_layers, shadow._rounded_masks), snapshots):
+        for key, (cached, data) in snapshot.items():
+            assert cache.get(key) is cached
+            assert cached.tobytes() == data, key
+
+
+# 原实现（逐张缩放、加阴影后按总高度缩小重试）对各输入分辨率生成的画布尺寸和每张图片的 (内容尺寸, 带阴影图片的位置)
+BASELINE_LAYOUTS = [
+    (plan_mobile_puzzle, ('mobile-combined.png',), (((663, 1400), (277, 285)), ((663, 1400), (1030, 285)))),
+    (plan_pc_puzzle, ((3840, 2160), (3840, 2160)), (((1422, 800), (274, 140)), ((1422, 800), (274, 1030)))),
+    (plan_pc_puzzle, ((2560, 1600), (2560, 1600)), (((1422, 800), (274, 140)), ((1422, 800), (274, 1030)))),
+    (plan_pc_puzzle, ((2560, 1080), (2560, 1080)), (((1421, 800), (274, 140)), ((1421, 800), (274, 1030)))),
+    (plan_pc_puzzle, ((1920, 1080), (1919, 1080)), (((1422, 800), (274, 140)), ((1421, 800), (274, 1030)))),
+    (plan_pc_puzzle, ((2048, 2732), (2048, 2732)), (((1423, 800), (273, 140)), ((1423, 800), (273, 1030)))),
+    (plan_pad_puzzle, ((2732, 2048), (2732, 2048)), (((1067, 800), (451, 140)), ((1067, 800), (451, 1030)))),
+    (plan_pad_puzzle, ((2388, 1668), (2388, 1668)), (((1066, 800), (452, 140)), ((1066, 800), (452, 1030)))),
+    (plan_pad_puzzle, ((2048, 2732), (2732, 2048)), (((1067, 800), (451, 140)), ((1067, 800), (451, 1030)))),
+    (plan_pad_puzzle, ((2560, 1080), (2560, 1080)), (((1066, 800), (452, 140)), ((1066, 800), (452, 1030))))
+]
+
+
+@pytest.mark.parametrize('plan, args, sprites', BASELINE_LAYOUTS)
+def test_layout_matches_baseline_sizes(plan, args, sprites):
+    """
+    预先规划的布局与原实现的画布尺寸、内容尺寸和位置逐像素相同（包括比例不符、需要裁剪的输入）
+    """
+    layout = plan(*args)
+    assert layout.canvas_size == (2000, 2000)
+    assert layout.scale == 1.0
+    assert tuple((sprite.content_size, sprite.position) for sprite in layout.sprites) == sprites
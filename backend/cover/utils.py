@@ -6,11 +6,27 @@
 """
 
 import logging
+import string
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple
-from PIL import Image, ImageFilter, ImageDraw
-import numpy as np
-from sklearn.cluster import KMeans
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+
+# 尝试相对导入，如果失败则使用绝对导入
+try:
+    from .image_cache import DirectoryImageCache, LRUImageCache, find_image_file
+    from .color_extract import extract_main_color
+    from .encoding import EncodedImage, encode_jpeg_within, encode_optimized
+    from .shadow import get_rounded_mask, get_shadow_layer, shadow_margin
+    from .manifest import atomic_write_bytes
+    from .instrument import count_decode, instrumented
+except ImportError:
+    from image_cache import DirectoryImageCache, LRUImageCache, find_image_file
+    from color_extract import extract_main_color
+    from encoding import EncodedImage, encode_jpeg_within, encode_optimized
+    from shadow import get_rounded_mask, get_shadow_layer, shadow_margin
+    from manifest import atomic_write_bytes
+    from instrument import count_decode, instrumented
 
 logger = logging.getLogger(__name__)
 
@@ -30,69 +46,158 @@ SHADOW_OFFSET = (5, 5)
 SHADOW_BLUR = 10
 SPACING = 60  # 图片之间的间隔（从30增加到60，增大一倍）
 
+# 各拼图中单张图片内容的最大尺寸（2000×2000 画布上），输入图片只需解码到不小于该尺寸
+MOBILE_SPRITE_BOX = (663, 1400)  # 画布高度的 70%，9:19
+PC_SPRITE_BOX = (1600, 800)  # 画布宽度的 80%，高度的 40%
+PAD_SPRITE_BOX = (1400, 800)  # 画布宽度的 70%，高度的 40%
+
+# 所有拼图共用的覆盖图片
+COVER_ASSETS = [
+    MOBILE_BLOCK_COVER,
+    PAD_BLOCK_COVER,
+    PAD_LOCK_COVER,
+    PC_MAC_COVER
+]
+
+# 覆盖图片对应的宽高比
+COVER_RATIOS = {
+    MOBILE_BLOCK_COVER: 9 / 19,
+    PAD_BLOCK_COVER: 4 / 3,
+    PAD_LOCK_COVER: 4 / 3,
+    PC_MAC_COVER: 16 / 9
+}
+
+# 常见设备截图分辨率（用于预热覆盖图缓存）
+COMMON_SCREEN_SIZES = {
+    MOBILE_BLOCK_COVER: [(1179, 2556), (1290, 2796), (1170, 2532), (1284, 2778), (1080, 2400), (1080, 2340)],
+    PAD_BLOCK_COVER: [(2048, 1536), (2360, 1640), (2388, 1668), (2732, 2048)],
+    PAD_LOCK_COVER: [(2048, 1536), (2360, 1640), (2388, 1668), (2732, 2048)],
+    PC_MAC_COVER: [(2560, 1600), (2880, 1800), (3024, 1964), (3456, 2234), (2560, 1440), (1920, 1080)]
+}
+
+# 覆盖图缓存容量（按解码后的像素字节数计算）
+COVER_CACHE_BYTES = 384 * 1024 * 1024
+
+# 已解码的覆盖图片（每个进程只加载一次）
+_cover_images = {}
+
+# 已调整到目标尺寸的覆盖图，键为 (覆盖图路径, 目标尺寸)
+_cover_overlays = LRUImageCache(COVER_CACHE_BYTES)
+
+
+def load_cover_assets() -> None:
+    """
+    预先加载并解码所有覆盖图片，供后续的 prepare_* 函数复用
+    """
+    for asset in COVER_ASSETS:
+        if asset.exists():
+            open_cover_image(asset)
+
 
-def extract_main_color(image: Image.Image, k: int = 3) -> Tuple[int, int, int]:
+def open_cover_image(path: Path) -> Image.Image:
     """
-    提取图片的主色调
+    获取已解码的覆盖图片（首次调用时加载）
+
+    返回的图片对象在多个任务之间共享，调用方不能原地修改
 
     Args:
-        image: PIL Image 对象
-        k: K-means 聚类数量
+        path: 覆盖图片路径
 
     Returns:
-        RGB 颜色元组
+        覆盖图片
     """
-    # 将图片转换为 numpy 数组
-    img_array = np.array(image)
-
-    # 如果是 RGBA，只取 RGB
-    if img_array.shape[2] == 4:
-        img_array = img_array[:, :, :3]
+    image = _cover_images.get(path)
+    if image is None:
+        count_decode()
+        image = Image.open(path)
+        image.load()
+        _cover_images[path] = image
+    return image
 
-    # 重塑为二维数组 (像素数, RGB)
-    pixels = img_array.reshape(-1, 3)
 
-    # 使用 K-means 聚类
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-    kmeans.fit(pixels)
+def ratio_corrected_size(size: Tuple[int, int], target_ratio: float) -> Tuple[int, int]:
+    """
+    计算底图调整到目标比例后的尺寸（保持高度不变，比例误差在 1% 以内时不调整）
 
-    # 获取最大的聚类中心（主色调）
-    labels = kmeans.labels_
-    cluster_sizes = np.bincount(labels)
-    main_cluster_idx = np.argmax(cluster_sizes)
-    main_color = kmeans.cluster_centers_[main_cluster_idx]
+    Args:
+        size: 原始尺寸 (width, height)
+        target_ratio: 目标宽高比
 
-    return tuple(map(int, main_color))
+    Returns:
+        调整后的尺寸
+    """
+    width, height = size
+    if abs(width / height - target_ratio) > 0.01:
+        return int(height * target_ratio), height
+    return size
 
 
-def create_rounded_rectangle_mask(size: Tuple[int, int], radius: int) -> Image.Image:
+@instrumented
+def get_cover_overlay(path: Path, size: Tuple[int, int]) -> Image.Image:
     """
-    创建圆角矩形遮罩
+    获取调整到指定尺寸的 RGBA 覆盖图，可直接用于 overlay_images
+
+    结果按 (覆盖图, 尺寸) 缓存在进程内，批量处理时相同分辨率的截图只需解码和缩放一次。
+    返回的图片对象是共享的，调用方不能原地修改。
 
     Args:
-        size: 图片尺寸 (width, height)
-        radius: 圆角半径
+        path: 覆盖图片路径
+        size: 目标尺寸（即底图尺寸）
 
     Returns:
-        遮罩图片
+        覆盖图
     """
-    mask = Image.new('L', size, 0)
-    draw = ImageDraw.Draw(mask)
+    key = (path, size)
+    overlay = _cover_overlays.get(key)
+    if overlay is not None:
+        return overlay
+
+    overlay = open_cover_image(path)
+    # 先转换为 RGBA 再缩放：调色板（P 模式）图片（如 pc-mac-cover.png）缩放时 Pillow 只能最近邻采样，细边缘会走样
+    if overlay.mode != 'RGBA':
+        overlay = overlay.convert('RGBA')
+
+    # 调整覆盖图到目标比例
+    target_ratio = COVER_RATIOS.get(path)
+    if target_ratio is not None:
+        corrected_size = ratio_corrected_size(overlay.size, target_ratio)
+        if corrected_size != overlay.size:
+            overlay = overlay.resize(corrected_size, Image.Resampling.LANCZOS)
+
+    # 确保覆盖图与底图尺寸一致
+    if overlay.size != size:
+        overlay = overlay.resize(size, Image.Resampling.LANCZOS)
+
+    return _cover_overlays.put(key, overlay)
 
-    # 绘制圆角矩形
-    draw.rounded_rectangle(
-        [(0, 0), size],
-        radius=radius,
-        fill=255
-    )
 
-    return mask
+def warm_cover_overlays(screen_sizes: Optional[Dict[Path, List[Tuple[int, int]]]] = None) -> int:
+    """
+    按常见设备分辨率预先生成覆盖图缓存
+
+    Args:
+        screen_sizes: {覆盖图路径: 截图分辨率列表}，默认使用 COMMON_SCREEN_SIZES
+
+    Returns:
+        预热的覆盖图数量
+    """
+    count = 0
+    for path, sizes in (screen_sizes or COMMON_SCREEN_SIZES).items():
+        if not path.exists():
+            continue
+        for size in sizes:
+            get_cover_overlay(path, ratio_corrected_size(size, COVER_RATIOS[path]))
+            count += 1
+    return count
 
 
+@instrumented
 def add_shadow_and_rounded_corners(image: Image.Image, radius: int = BORDER_RADIUS) -> Image.Image:
     """
     为图片添加阴影和圆角效果
 
+    阴影层和圆角遮罩按尺寸缓存，同尺寸的图片只模糊一次
+
     Args:
         image: 原始图片
         radius: 圆角半径
@@ -100,33 +205,12 @@ def add_shadow_and_rounded_corners(image: Image.Image, radius: int = BORDER_RADI
     Returns:
         处理后的图片
     """
-    # 创建带阴影的画布（增加边距以容纳阴影）
-    shadow_margin = max(SHADOW_OFFSET) + SHADOW_BLUR
-    canvas_size = (
-        image.width + shadow_margin * 2,
-        image.height + shadow_margin * 2
-    )
-
-    # 创建阴影层
-    shadow = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
-    shadow_draw = ImageDraw.Draw(shadow)
-
-    # 绘制阴影（使用半透明黑色）
-    shadow_rect = [
-        (shadow_margin + SHADOW_OFFSET[0], shadow_margin + SHADOW_OFFSET[1]),
-        (shadow_margin + image.width + SHADOW_OFFSET[0], shadow_margin + image.height + SHADOW_OFFSET[1])
-    ]
-    shadow_draw.rounded_rectangle(
-        shadow_rect,
-        radius=radius,
-        fill=(0, 0, 0, 100)
-    )
-
-    # 模糊阴影
-    shadow = shadow.filter(ImageFilter.GaussianBlur(radius=SHADOW_BLUR))
-
-    # 创建圆角遮罩
-    mask = create_rounded_rectangle_mask(image.size, radius)
+    # 带阴影的画布（四周预留边距以容纳阴影），缓存中的阴影层需要复制后再使用
+    margin = shadow_margin(SHADOW_OFFSET, SHADOW_BLUR)
+    shadow = get_shadow_layer(image.size, radius, SHADOW_OFFSET, SHADOW_BLUR).copy()
+
+    # 圆角遮罩
+    mask = get_rounded_mask(image.size, radius)
 
     # 如果原图有透明通道，应用遮罩
     if image.mode == 'RGBA':
@@ -137,17 +221,83 @@ def add_shadow_and_rounded_corners(image: Image.Image, radius: int = BORDER_RADI
         image.putalpha(mask)
 
     # 将图片粘贴到阴影层上
-    shadow.paste(image, (shadow_margin, shadow_margin), image)
+    shadow.paste(image, (margin, margin), image)
 
     return shadow
 
 
+@instrumented
+def paste_with_shadow(
+    canvas: Image.Image,
+    image: Image.Image,
+    position: Tuple[int, int],
+    radius: int = BORDER_RADIUS
+) -> None:
+    """
+    将图片加上阴影和圆角后直接绘制到画布上（原地修改画布）
+
+    效果与 add_shadow_and_rounded_corners 后再以自身为遮罩粘贴相同，但不创建带边距的 RGBA 图片：
+    阴影层（缓存，只读）只绘制四周边距和圆角所在的条带（中间部分会被图片完全覆盖），
+    图片以缓存的圆角遮罩直接粘贴，不转换为 RGBA。圆角边缘按标准的 over 合成计算。
+
+    Args:
+        canvas: 画布（不透明的 RGB 图片）
+        image: 图片（内容尺寸，不含阴影）
+        position: 带阴影图片在画布上的左上角（即 SpritePlan.position）
+        radius: 圆角半径
+    """
+    margin = shadow_margin(SHADOW_OFFSET, SHADOW_BLUR)
+    shadow = get_shadow_layer(image.size, radius, SHADOW_OFFSET, SHADOW_BLUR)
+    width, height = shadow.size
+    x, y = position
+
+    # 不会被图片完全覆盖的区域：上下两条（整个宽度）和左右两条（中间的高度），宽度为边距加圆角半径
+    band = min(margin + radius, width // 2, height // 2)
+    for box in ((0, 0, width, band), (0, height - band, width, height),
+                (0, band, band, height - band), (width - band, band, width, height - band)):
+        if box[2] > box[0] and box[3] > box[1]:
+            strip = shadow.crop(box)
+            canvas.paste(strip, (x + box[0], y + box[1]), strip)
+
+    canvas.paste(image, (x + margin, y + margin), get_rounded_mask(image.size, radius))
+
+
+@instrumented
+def overlay_onto(canvas: Image.Image, overlay: Image.Image, position: Tuple[int, int] = (0, 0)) -> Image.Image:
+    """
+    将覆盖图直接叠加到画布上（原地修改画布），只处理覆盖图中不透明像素所在的区域
+
+    Args:
+        canvas: 画布（不透明的 RGB 图片，调用方独占）
+        overlay: 覆盖图（RGBA）
+        position: 覆盖图在画布上的左上角
+
+    Returns:
+        画布
+    """
+    if overlay.mode != 'RGBA':
+        overlay = overlay.convert('RGBA')
+
+    # RGBA 图片的 getbbox 只看透明通道，完全透明的区域不需要处理
+    bbox = overlay.getbbox()
+    if bbox is None:
+        return canvas
+    if bbox != (0, 0) + overlay.size:
+        overlay = overlay.crop(bbox)
+    canvas.paste(overlay, (position[0] + bbox[0], position[1] + bbox[1]), overlay)
+    return canvas
+
+
+@instrumented
 def overlay_images(base: Image.Image, overlay: Image.Image) -> Image.Image:
     """
     将覆盖图片叠加到底图上
 
+    不透明的 RGB 底图复制一份后直接叠加（结果为 RGB，与转换为 RGBA 后 alpha_composite 逐像素相同）；
+    其他模式的底图转换为 RGBA 后合成，保留底图的透明通道。
+
     Args:
-        base: 底图
+        base: 底图（不会被修改）
         overlay: 覆盖图
 
     Returns:
@@ -157,6 +307,9 @@ def overlay_images(base: Image.Image, overlay: Image.Image) -> Image.Image:
     if base.size != overlay.size:
         overlay = overlay.resize(base.size, Image.Resampling.LANCZOS)
 
+    if base.mode == 'RGB':
+        return overlay_onto(base.copy(), overlay)
+
     # 如果底图没有透明通道，转换为 RGBA
     if base.mode != 'RGBA':
         base = base.convert('RGBA')
@@ -171,24 +324,91 @@ def overlay_images(base: Image.Image, overlay: Image.Image) -> Image.Image:
     return result
 
 
-def get_image_file(work_dir: Path, base_name: str) -> Optional[Path]:
+def get_image_file(
+    work_dir: Path,
+    base_name: str,
+    image_cache: Optional[DirectoryImageCache] = None
+) -> Optional[Path]:
     """
     获取图片文件（支持多种格式）
 
     Args:
         work_dir: 工作目录
         base_name: 基础文件名（不含扩展名）
+        image_cache: 目录图片缓存，提供时复用已查找过的结果
 
     Returns:
         图片文件路径，如果不存在则返回 None
     """
-    for ext in ['.png', '.jpg', '.jpeg', '.webp']:
-        file_path = work_dir / f"{base_name}{ext}"
-        if file_path.exists():
-            return file_path
-    return None
+    if image_cache is not None:
+        return image_cache.find(work_dir, base_name)
+    return find_image_file(work_dir, base_name)
+
+
+def parse_color(color: str) -> Optional[Tuple[int, int, int]]:
+    """
+    解析 16 进制颜色代码
+
+    Args:
+        color: 颜色代码，如 #fff、#ffffff、ffffff
+
+    Returns:
+        RGB 颜色元组，格式无效时返回 None
+    """
+    color_str = color[1:] if color.startswith('#') else color
+
+    if len(color_str) == 3:
+        # 短格式 #fff -> #ffffff
+        color_str = ''.join([c * 2 for c in color_str])
+
+    if len(color_str) != 6 or any(c not in string.hexdigits for c in color_str):
+        return None
+
+    return int(color_str[0:2], 16), int(color_str[2:4], 16), int(color_str[4:6], 16)
+
+
+def uses_default_background(main_color: Optional[str]) -> bool:
+    """
+    create_background 是否使用默认背景（back.jpg）
+
+    create_* 阶段总会提供源图片，main_color 为空字符串时使用提取的主色调，不读取 back.jpg
+
+    Args:
+        main_color: 主色调
 
+    Returns:
+        main_color 为 None 或无效的颜色代码时为 True
+    """
+    return main_color is None or (main_color != '' and parse_color(main_color) is None)
 
+
+@lru_cache(maxsize=4)
+def _default_background_cached(size: Tuple[int, int], signature: Tuple[int, int]) -> Image.Image:
+    """
+    按 (尺寸, back.jpg 的修改时间和大小) 缓存的默认背景，只解码和缩放一次
+    """
+    count_decode()
+    with Image.open(BACK_IMAGE) as bg:
+        return bg.resize(size, Image.Resampling.LANCZOS)
+
+
+def _default_background(size: Tuple[int, int]) -> Image.Image:
+    """
+    默认背景（back.jpg），back.jpg 被替换后（--watch 常驻进程）重新解码
+    """
+    stat = BACK_IMAGE.stat()
+    return _default_background_cached(size, (stat.st_mtime_ns, stat.st_size))
+
+
+@lru_cache(maxsize=16)
+def _solid_background(size: Tuple[int, int], color: Tuple[int, int, int]) -> Image.Image:
+    """
+    按 (尺寸, 颜色) 缓存的纯色背景
+    """
+    return Image.new('RGB', size, color)
+
+
+@instrumented
 def create_background(size: Tuple[int, int], main_color: Optional[str] = None, source_image: Optional[Image.Image] = None) -> Image.Image:
     """
     创建背景图片
@@ -198,6 +418,8 @@ def create_background(size: Tuple[int, int], main_color: Optional[str] = None, s
     - main_color = "": 自动提取主色调（如果提供了 source_image）
     - main_color = "#ffffff": 使用指定的纯色背景
 
+    相同尺寸和颜色的背景只生成一次，之后返回缓存背景的副本（调用方可以直接在上面绘制）。
+
     Args:
         size: 背景尺寸
         main_color: 主色调（16进制颜色代码，如 #ffffff）。如果为空字符串，则自动提取主色调；如果为 None，则使用默认背景
@@ -206,65 +428,121 @@ def create_background(size: Tuple[int, int], main_color: Optional[str] = None, s
     Returns:
         背景图片
     """
+    size = tuple(size)
+
     # 如果 main_color 是 None，始终使用默认背景（back.jpg）
     if main_color is None:
-        bg = Image.open(BACK_IMAGE)
-        return bg.resize(size, Image.Resampling.LANCZOS)
+        return _default_background(size).copy()
 
     # 如果 main_color 是空字符串，表示自动提取主色调
     if main_color == '':
         if source_image:
             # 从源图片提取主色调
             bg_color = extract_main_color(source_image)
-            return Image.new('RGB', size, bg_color)
+            return _solid_background(size, bg_color).copy()
         else:
             # 没有源图片，使用默认背景
-            bg = Image.open(BACK_IMAGE)
-            return bg.resize(size, Image.Resampling.LANCZOS)
+            return _default_background(size).copy()
 
     # 如果 main_color 有值，使用纯色背景
-    # 解析颜色代码
-    color_str = main_color
-    if color_str.startswith('#'):
-        color_str = color_str[1:]
+    bg_color = parse_color(main_color)
+    if bg_color is None:
+        logger.warning(f"  无效的颜色代码: {main_color}，使用默认背景")
+        return _default_background(size).copy()
+    return _solid_background(size, bg_color).copy()
 
-    if len(color_str) == 3:
-        # 短格式 #fff -> #ffffff
-        color_str = ''.join([c * 2 for c in color_str])
 
-    try:
-        r = int(color_str[0:2], 16)
-        g = int(color_str[2:4], 16)
-        b = int(color_str[4:6], 16)
-        bg_color = (r, g, b)
-        return Image.new('RGB', size, bg_color)
-    except (ValueError, IndexError):
-        logger.warning(f"  无效的颜色代码: {main_color}，使用默认背景")
-        bg = Image.open(BACK_IMAGE)
-        return bg.resize(size, Image.Resampling.LANCZOS)
+def center_crop_box(size: Tuple[int, int], target_ratio: float) -> Tuple[float, float, float, float]:
+    """
+    计算按目标比例居中裁剪的区域（原图坐标）
 
+    比例差异小于 0.01 时视为已匹配，不裁剪
 
-def resize_to_fit_ratio(image: Image.Image, target_ratio: float, max_size: Tuple[int, int]) -> Image.Image:
+    Args:
+        size: 原图尺寸 (width, height)
+        target_ratio: 目标宽高比
+
+    Returns:
+        裁剪区域 (left, top, right, bottom)
     """
-    调整图片尺寸以适应目标比例，同时不超过最大尺寸
+    width, height = size
+    if abs(width / height - target_ratio) < 0.01:
+        return (0, 0, width, height)
+
+    if width / height > target_ratio:
+        # 图片更宽，裁剪宽度
+        crop_width = height * target_ratio
+        left = (width - crop_width) / 2
+        return (left, 0, left + crop_width, height)
+
+    # 图片更高，裁剪高度
+    crop_height = width / target_ratio
+    top = (height - crop_height) / 2
+    return (0, top, width, top + crop_height)
+
+
+@instrumented
+def crop_resize(image: Image.Image, target_ratio: float, size: Tuple[int, int]) -> Image.Image:
+    """
+    按目标比例居中裁剪并缩放到指定尺寸，裁剪和缩放在同一次重采样中完成
+
+    尺寸和比例都已符合要求的图片直接原样返回（不复制，调用方不能原地修改）
 
     Args:
         image: 原始图片
         target_ratio: 目标宽高比
-        max_size: 最大尺寸 (width, height)
+        size: 输出尺寸 (width, height)
 
     Returns:
         调整后的图片
     """
-    current_ratio = image.width / image.height
+    box = center_crop_box(image.size, target_ratio)
+    if box == (0, 0, image.width, image.height):
+        if image.size == size:
+            return image
+        return image.resize(size, Image.Resampling.LANCZOS)
+    return image.resize(size, Image.Resampling.LANCZOS, box=box)
+
+
+def fit_size(content_size: Tuple[float, float], max_size: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    计算保持比例放入目标区域的最大尺寸
+
+    Args:
+        content_size: 内容尺寸 (width, height)
+        max_size: 目标区域尺寸 (width, height)
+
+    Returns:
+        缩放后的尺寸
+    """
+    scaled_height_by_width = content_size[1] * max_size[0] / content_size[0]
+    if scaled_height_by_width <= max_size[1]:
+        # 按宽度缩放，高度不会超出
+        return (max_size[0], int(scaled_height_by_width))
+    # 按高度缩放，宽度不会超出
+    return (int(content_size[0] * max_size[1] / content_size[1]), max_size[1])
+
+
+def ratio_fit_size(size: Tuple[int, int], target_ratio: float, max_size: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    计算 resize_to_fit_ratio 的输出尺寸（不处理像素）
+
+    Args:
+        size: 原图尺寸 (width, height)
+        target_ratio: 目标宽高比
+        max_size: 最大尺寸 (width, height)
+
+    Returns:
+        按目标比例裁剪并缩放后的尺寸
+    """
+    width, height = size
+    current_ratio = width / height
 
     if abs(current_ratio - target_ratio) < 0.01:
         # 比例已经匹配，只需缩放
-        scale = min(max_size[0] / image.width, max_size[1] / image.height)
-        new_size = (int(image.width * scale), int(image.height * scale))
-        return image.resize(new_size, Image.Resampling.LANCZOS)
+        scale = min(max_size[0] / width, max_size[1] / height)
+        return (int(width * scale), int(height * scale))
 
-    # 需要调整比例
     # 计算在目标比例下的最大尺寸
     if current_ratio > target_ratio:
         # 图片更宽，以高度为准
@@ -274,132 +552,149 @@ def resize_to_fit_ratio(image: Image.Image, target_ratio: float, max_size: Tuple
         # 图片更高，以宽度为准
         max_width = min(max_size[0], int(max_size[1] * target_ratio))
         max_height = int(max_width / target_ratio)
-    
-    # 计算缩放比例
-    scale = min(max_width / image.width, max_height / image.height)
-    new_size = (int(image.width * scale), int(image.height * scale))
 
-    # 调整到目标比例
+    # 先按比例缩放再裁剪到目标比例后的尺寸
+    scale = min(max_width / width, max_height / height)
+    new_size = (int(width * scale), int(height * scale))
     if new_size[0] / new_size[1] > target_ratio:
-        # 需要裁剪宽度
-        new_width = int(new_size[1] * target_ratio)
-        crop_left = (new_size[0] - new_width) // 2
-        resized = image.resize(new_size, Image.Resampling.LANCZOS)
-        return resized.crop((crop_left, 0, crop_left + new_width, new_size[1]))
+        return (int(new_size[1] * target_ratio), new_size[1])
+    return (new_size[0], int(new_size[0] / target_ratio))
+
+
+@instrumented
+def resize_to_fit_ratio(image: Image.Image, target_ratio: float, max_size: Tuple[int, int]) -> Image.Image:
+    """
+    调整图片尺寸以适应目标比例，同时不超过最大尺寸
+
+    输出尺寸的计算方式不变（见 ratio_fit_size），裁剪和缩放合并为一次重采样
+
+    Args:
+        image: 原始图片
+        target_ratio: 目标宽高比
+        max_size: 最大尺寸 (width, height)
+
+    Returns:
+        调整后的图片
+    """
+    return crop_resize(image, target_ratio, ratio_fit_size(image.size, target_ratio, max_size))
+
+
+@instrumented
+def encode_optimized_image(image: Image.Image, quality: int = 95) -> EncodedImage:
+    """
+    编码图片并优化文件大小（不写入磁盘）
+
+    优先编码为 PNG，预计或实际超过 MAX_FILE_SIZE 时改为 JPEG。
+
+    Args:
+        image: 图片对象
+        quality: 初始质量（用于 JPEG）
+
+    Returns:
+        编码结果
+    """
+    result = encode_optimized(image, MAX_FILE_SIZE, quality)
+    if result.format == 'PNG':
+        logger.info(f"  已保存 PNG，大小: {result.nbytes / 1024 / 1024:.2f}MB，编码次数: {result.encodes}")
+    elif result.resized:
+        logger.info(f"  已缩小尺寸并保存为 JPEG，质量: {result.quality}，大小: {result.nbytes / 1024 / 1024:.2f}MB，编码次数: {result.encodes}")
     else:
-        # 需要裁剪高度
-        new_height = int(new_size[0] / target_ratio)
-        crop_top = (new_size[1] - new_height) // 2
-        resized = image.resize(new_size, Image.Resampling.LANCZOS)
-        return resized.crop((0, crop_top, new_size[0], crop_top + new_height))
+        logger.info(f"  已优化为 JPEG，质量: {result.quality}，大小: {result.nbytes / 1024 / 1024:.2f}MB，编码次数: {result.encodes}")
+    return result
 
 
-def save_optimized_image(image: Image.Image, output_file: Path, quality: int = 95) -> None:
+@instrumented
+def encode_optimized_jpeg(image: Image.Image, max_size: int = MAX_JPEG_SIZE, quality: int = 95) -> EncodedImage:
     """
-    保存图片并优化文件大小
+    编码为不超过指定大小（默认 500KB）的 JPEG（不写入磁盘）
 
     Args:
         image: 图片对象
-        output_file: 输出文件路径
+        max_size: 最大文件大小（字节），默认 500KB
         quality: 初始质量（用于 JPEG）
+
+    Returns:
+        编码结果（包含最终质量和编码次数）
     """
-    # 先尝试保存为 PNG
-    image.save(output_file, 'PNG', optimize=True)
+    result = encode_jpeg_within(image, max_size, quality)
+    if result.resized:
+        logger.info(f"  已缩小尺寸并保存为 JPEG，质量: {result.quality}，大小: {result.nbytes / 1024:.2f}KB，编码次数: {result.encodes}")
+    else:
+        logger.info(f"  已保存 JPEG，质量: {result.quality}，大小: {result.nbytes / 1024:.2f}KB，编码次数: {result.encodes}")
+    return result
 
-    # 检查文件大小
-    file_size = output_file.stat().st_size
 
-    if file_size > MAX_FILE_SIZE:
-        # 如果超过 2MB，转换为 JPEG 并降低质量
-        logger.info(f"  文件大小 {file_size / 1024 / 1024:.2f}MB 超过限制，转换为 JPEG")
+def encode_output(image: Image.Image, name: str, max_size: Optional[int] = None) -> EncodedImage:
+    """
+    按输出文件名编码拼图：.png 优先编码为 PNG（超出 MAX_FILE_SIZE 时改为 JPEG），其他编码为不超过 max_size 的 JPEG
 
-        # 如果原图有透明通道，需要添加白色背景
-        if image.mode == 'RGBA':
-            bg = Image.new('RGB', image.size, (255, 255, 255))
-            bg.paste(image, mask=image.split()[3])
-            image = bg
-        else:
-            image = image.convert('RGB')
+    Args:
+        image: 图片对象
+        name: 输出文件名，如 mobile-combined.png、pc-combined.jpg
+        max_size: JPEG 的最大文件大小（字节），默认 MAX_JPEG_SIZE
+
+    Returns:
+        编码结果
+    """
+    if Path(name).suffix.lower() == '.png':
+        return encode_optimized_image(image)
+    return encode_optimized_jpeg(image, max_size or MAX_JPEG_SIZE)
 
-        # 删除 PNG 文件
-        output_file.unlink()
 
-        # 生成 JPG 文件路径
-        output_file_jpg = output_file.with_suffix('.jpg')
+def write_encoded(result: EncodedImage, output_file: Path) -> Path:
+    """
+    原子写入编码结果，扩展名按实际编码格式调整；上次运行留下的另一种格式的同名文件会被删除
 
-        # 逐步降低质量直到文件大小符合要求
-        current_quality = quality
-        while current_quality > 50:
-            image.save(output_file_jpg, 'JPEG', quality=current_quality, optimize=True)
-            file_size = output_file_jpg.stat().st_size
+    Args:
+        result: 编码结果
+        output_file: 输出文件路径
 
-            if file_size <= MAX_FILE_SIZE:
-                logger.info(f"  已优化为 JPEG，质量: {current_quality}，大小: {file_size / 1024 / 1024:.2f}MB")
-                return
+    Returns:
+        实际写入的文件路径
+    """
+    saved_file = output_file.with_suffix(result.extension)
+    atomic_write_bytes(saved_file, result.data)
+    for stale_file in (output_file.with_suffix('.png'), output_file.with_suffix('.jpg')):
+        if stale_file != saved_file:
+            stale_file.unlink(missing_ok=True)
+    return saved_file
 
-            current_quality -= 5
 
-        # 如果质量降到 50 还是太大，需要缩小尺寸
-        if file_size > MAX_FILE_SIZE:
-            scale = (MAX_FILE_SIZE / file_size) ** 0.5
-            new_size = (int(image.width * scale), int(image.height * scale))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-            image.save(output_file_jpg, 'JPEG', quality=75, optimize=True)
-            file_size = output_file_jpg.stat().st_size
-            logger.info(f"  已缩小尺寸并保存为 JPEG，大小: {file_size / 1024 / 1024:.2f}MB")
+def save_optimized_image(image: Image.Image, output_file: Path, quality: int = 95) -> EncodedImage:
+    """
+    保存图片并优化文件大小
 
+    优先保存为 PNG，预计或实际超过 MAX_FILE_SIZE 时改为保存同名的 JPEG 文件。
+    所有尝试都在内存中完成，只原子写入一次最终结果；上次运行留下的另一种格式的同名文件会被删除。
 
-def save_optimized_jpeg(image: Image.Image, output_file: Path, max_size: int = MAX_JPEG_SIZE, quality: int = 95) -> None:
+    Args:
+        image: 图片对象
+        output_file: 输出文件路径（.png）
+        quality: 初始质量（用于 JPEG）
+
+    Returns:
+        编码结果
+    """
+    result = encode_optimized_image(image, quality)
+    write_encoded(result, output_file)
+    return result
+
+
+def save_optimized_jpeg(image: Image.Image, output_file: Path, max_size: int = MAX_JPEG_SIZE, quality: int = 95) -> EncodedImage:
     """
     保存 JPEG 图片并优化文件大小，确保不超过指定大小（默认 500KB）
 
+    在内存中查找满足大小限制的最高质量，确定结果后只原子写入一次磁盘
+
     Args:
         image: 图片对象
         output_file: 输出文件路径
         max_size: 最大文件大小（字节），默认 500KB
         quality: 初始质量（用于 JPEG）
+
+    Returns:
+        编码结果（包含最终质量和编码次数）
     """
-    # 确保图片是 RGB 模式（JPEG 不支持透明通道）
-    if image.mode == 'RGBA':
-        bg = Image.new('RGB', image.size, (255, 255, 255))
-        bg.paste(image, mask=image.split()[3])
-        image = bg
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
-
-    # 逐步降低质量直到文件大小符合要求
-    current_quality = quality
-    while current_quality > 30:
-        image.save(output_file, 'JPEG', quality=current_quality, optimize=True)
-        file_size = output_file.stat().st_size
-
-        if file_size <= max_size:
-            logger.info(f"  已保存 JPEG，质量: {current_quality}，大小: {file_size / 1024:.2f}KB")
-            return
-
-        current_quality -= 5
-
-    # 如果质量降到 30 还是太大，需要缩小尺寸
-    file_size = output_file.stat().st_size
-    if file_size > max_size:
-        # 计算缩放比例
-        scale = (max_size / file_size) ** 0.5
-        new_size = (int(image.width * scale), int(image.height * scale))
-        image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # 重新尝试保存，从较低质量开始
-        current_quality = 75
-        while current_quality > 30:
-            image.save(output_file, 'JPEG', quality=current_quality, optimize=True)
-            file_size = output_file.stat().st_size
-            
-            if file_size <= max_size:
-                logger.info(f"  已缩小尺寸并保存为 JPEG，质量: {current_quality}，大小: {file_size / 1024:.2f}KB")
-                return
-            
-            current_quality -= 5
-        
-        # 如果还是太大，使用最低质量
-        image.save(output_file, 'JPEG', quality=30, optimize=True)
-        file_size = output_file.stat().st_size
-        logger.info(f"  已缩小尺寸并保存为 JPEG（最低质量），大小: {file_size / 1024:.2f}KB")
+    result = encode_optimized_jpeg(image, max_size, quality)
+    atomic_write_bytes(output_file, result.data)
+    return result
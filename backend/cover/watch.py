@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录监视模块
+定期轮询图片根目录，发现新增或内容发生变化的子目录，等文件齐全且一段时间内不再变化后交给调用方处理
+"""
+
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认轮询间隔（秒）
+DEFAULT_POLL_INTERVAL = 2.0
+
+# 子目录内容保持不变多久后才认为文件已经复制完成（秒）
+DEFAULT_SETTLE_SECONDS = 3.0
+
+# 目录签名：每个文件的 (文件名, 大小, 修改时间)
+Signature = Tuple[Tuple[str, int, int], ...]
+
+
+def directory_signature(work_dir: Path) -> Signature:
+    """
+    计算目录签名（只包含目录下的文件，不包含子目录和隐藏文件）
+
+    Args:
+        work_dir: 目录
+
+    Returns:
+        目录签名，目录无法读取时为空
+    """
+    entries = []
+    try:
+        for path in work_dir.iterdir():
+            if path.name.startswith('.') or not path.is_file():
+                continue
+            stat = path.stat()
+            entries.append((path.name, stat.st_size, stat.st_mtime_ns))
+    except FileNotFoundError:
+        return ()
+    return tuple(sorted(entries))
+
+
+class DirectoryWatcher:
+    """
+    轮询式子目录监视器
+
+    子目录满足以下条件时由 poll 返回：
+    - 签名与上次返回（处理）时不同（新目录或文件发生了变化）
+    - 签名在 settle 秒内保持不变；首次发现时，最新的文件修改时间早于 settle 秒前也视为稳定（启动时已存在的目录）
+    - 文件完整性检查通过；不完整时只在签名变化时输出一次缺失的文件
+
+    不依赖 inotify 等平台相关的接口，在网络文件系统和容器挂载目录上同样可用。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        check: Callable[[Path], Tuple[bool, List[str]]],
+        settle: float = DEFAULT_SETTLE_SECONDS
+    ):
+        """
+        Args:
+            root: 图片根目录
+            check: 文件完整性检查，返回 (是否完整, 缺失文件列表)
+            settle: 目录内容需要保持不变的秒数
+        """
+        self.root = root
+        self.check = check
+        self.settle = settle
+        # 上次轮询看到的签名和该签名首次出现的时间
+        self._pending: Dict[Path, Tuple[Signature, float]] = {}
+        # 已返回给调用方处理的签名
+        self._processed: Dict[Path, Signature] = {}
+        # 已输出过缺失文件的签名，避免每次轮询重复输出
+        self._reported: Dict[Path, Signature] = {}
+
+    def poll(self, now: Optional[float] = None) -> List[Tuple[Path, Signature]]:
+        """
+        轮询一次，返回可以处理的子目录
+
+        Args:
+            now: 当前时间（time.time()），默认取系统时间
+
+        Returns:
+            [(子目录, 签名)]，处理后需要调用 mark_processed
+        """
+        now = time.time() if now is None else now
+        subdirs = sorted(d for d in self.root.iterdir() if d.is_dir() and not d.name.startswith('.'))
+        ready = []
+        for work_dir in subdirs:
+            signature = directory_signature(work_dir)
+            if not signature or self._processed.get(work_dir) == signature:
+                continue
+
+            pending = self._pending.get(work_dir)
+            if pending is None or pending[0] != signature:
+                self._pending[work_dir] = (signature, now)
+                newest = max(mtime for _, _, mtime in signature) / 1e9
+                if pending is not None or now - newest < self.settle:
+                    continue
+            elif now - pending[1] < self.settle:
+                continue
+
+            is_complete, missing_files = self.check(work_dir)
+            if not is_complete:
+                if self._reported.get(work_dir) != signature:
+                    self._reported[work_dir] = signature
+                    logger.info(f"等待文件: {work_dir.name} 缺少 {', '.join(missing_files)}")
+                continue
+            ready.append((work_dir, signature))
+
+        # 忘记已删除的目录
+        existing = set(subdirs)
+        for state in (self._pending, self._processed, self._reported):
+            for work_dir in [d for d in state if d not in existing]:
+                del state[work_dir]
+        return ready
+
+    def mark_processed(self, work_dir: Path, signature: Signature) -> None:
+        """
+        记录目录已按该签名处理，签名不变时不会再次返回
+
+        Args:
+            work_dir: 子目录
+            signature: 提交处理时的签名
+        """
+        self._processed[work_dir] = signature
+        self._pending.pop(work_dir, None)